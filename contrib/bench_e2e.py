@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+End-to-end throughput of the real client stack (IRCConnection, TWILoop,
+grok, handlers) against twichat.fake_tmi over a local TCP socket.
+
+    python contrib/bench_e2e.py [--lines 50000] [--rate 100000] [--bots 1] [--fast-loop]
+"""
+
+import time
+import asyncio
+import argparse
+
+from twichat.loop import TWILoop, fast_loop_policy
+from twichat.fake_tmi import FakeTMI
+from twichat.handlers import JoinChannel, PingPong, ReplyHandler
+from twichat.irc.reply import ChannelMessage, EndNameList
+
+
+class Count(ReplyHandler):
+    def __init__(self, bot, lines, ready):
+        self.bot = bot
+        self.lines = lines
+        self.ready = ready
+        self.seen = 0
+        self.finished = None
+
+    def accept(self, reply):
+        if isinstance(reply, EndNameList):
+            self.ready()
+        elif isinstance(reply, ChannelMessage):
+            self.seen += 1
+            if self.seen == self.lines:
+                self.finished = time.perf_counter()
+                self.bot.stop()
+
+
+async def bench(args):
+    async with FakeTMI(members={"#bench": ["someone"]}) as server:
+        counters = list()
+        joined = list()
+
+        def ready():
+            joined.append(True)
+            if len(joined) == args.bots:
+                server.firehose("#bench", rate=args.rate, count=args.lines)
+
+        bots = list()
+        for i in range(args.bots):
+            bot = TWILoop(
+                host="127.0.0.1", port=server.port, use_ssl=False, nick=f"bench{i}"
+            )
+            counter = Count(bot, args.lines, ready)
+            bot.handlers.extend((JoinChannel("bench"), PingPong(), counter))
+            counters.append(counter)
+            bots.append(bot)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(bot.run() for bot in bots))
+        t1 = max(c.finished for c in counters)
+        return t1 - t0, sum(c.seen for c in counters)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=50000)
+    ap.add_argument("--rate", type=float, default=100000)
+    ap.add_argument("--bots", type=int, default=1)
+    ap.add_argument("--fast-loop", action="store_true")
+    args = ap.parse_args()
+
+    if args.fast_loop:
+        policy = fast_loop_policy()
+        if policy is None:
+            print("(uvloop is not installed)")
+        else:
+            asyncio.set_event_loop_policy(policy)
+    dt, seen = asyncio.run(bench(args))
+    print(
+        f"{seen} lines handled by {args.bots} bot(s) in {dt:.3f}s: {seen/dt:.0f} lines/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
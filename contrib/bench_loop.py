@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Push a pile of lines through TWILoop.run() (with an in-memory socket) under
+asyncio's own event loop and under uvloop (when it's installed), with and
+without task naming.
+
+    python contrib/bench_loop.py [--lines 100000] [--echo-every 10]
+"""
+
+import time
+import asyncio
+import argparse
+
+from twichat.loop import TWILoop, fast_loop_policy
+from twichat.handlers import ReplyHandler, PingPong
+from twichat.irc.msg import TargetMessage
+
+
+class MemorySock:
+    closed = False
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.written = 0
+
+    async def start(self):
+        pass
+
+    async def readline(self):
+        return next(self.lines, "")
+
+    def writeline(self, line):
+        self.written += 1
+
+    async def send(self, line):
+        self.written += 1
+
+    def register(self, **kw):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class Echo(ReplyHandler):
+    def __init__(self, every):
+        self.every = every
+        self.seen = 0
+
+    def accept(self, reply):
+        self.seen += 1
+        if self.every and self.seen % self.every == 0:
+            return TargetMessage(reply.target, "echo")
+
+
+def make_lines(n):
+    for i in range(n):
+        if i % 1000 == 0:
+            yield "PING :tmi.twitch.tv"
+        else:
+            yield f"@badges=;color=#FF0000 :nick{i % 97}!nick@host PRIVMSG #chan :hello there {i}"
+
+
+def bench(lines, echo_every, name_tasks):
+    loop = TWILoop()
+    loop.sock = MemorySock(make_lines(lines))
+    loop.handlers.append(PingPong())
+    loop.handlers.append(Echo(echo_every))
+    t0 = time.perf_counter()
+    asyncio.run(loop.run(name_tasks=name_tasks))
+    return time.perf_counter() - t0, loop.sock.written
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=100000)
+    ap.add_argument("--echo-every", type=int, default=10)
+    args = ap.parse_args()
+
+    policies = [("asyncio", asyncio.DefaultEventLoopPolicy())]
+    fast = fast_loop_policy()
+    if fast is None:
+        print("(uvloop is not installed; only benchmarking asyncio)")
+    else:
+        policies.append(("uvloop", fast))
+
+    print(f"{'loop':>8} {'names':>6} {'seconds':>9} {'lines/s':>10} {'written':>8}")
+    for label, policy in policies:
+        asyncio.set_event_loop_policy(policy)
+        for name_tasks in (False, True):
+            dt, written = bench(args.lines, args.echo_every, name_tasks)
+            print(
+                f"{label:>8} {str(name_tasks):>6} {dt:>8.3f}s "
+                f"{args.lines/dt:>10.0f} {written:>8}"
+            )
+    asyncio.set_event_loop_policy(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Compare twichat.matcher.PatternMatcher against trying each pattern one at a
+time, for increasing numbers of patterns.
+
+    python contrib/bench_matcher.py [--messages 2000] [--sizes 10,100,1000,10000]
+"""
+
+import re
+import time
+import random
+import argparse
+
+from twichat.matcher import PatternMatcher
+
+WORDS = (
+    "kappa pog lul omegalul monkas pepega hype gg wp ez clap poggers sadge "
+    "copium hello there general kenobi buy followers cheap viewers prime "
+    "sub hype train raid incoming lets go chat what is this stream"
+).split()
+
+
+def make_vocab(rng, n=5000):
+    # chat mostly uses WORDS, but the pattern lists draw from a much bigger
+    # vocabulary, so (like real moderation lists) most patterns rarely hit
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    made = (
+        "".join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(n)
+    )
+    return list(WORDS) + list(made)
+
+
+def random_phrase(rng, vocab, n=2):
+    return " ".join(rng.choice(vocab) + str(rng.randint(0, 99)) for _ in range(n))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=2000)
+    ap.add_argument("--sizes", type=str, default="10,100,1000,10000")
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    vocab = make_vocab(rng)
+    messages = [
+        " ".join(
+            rng.choice(WORDS) + rng.choice(("", "", str(rng.randint(0, 999))))
+            for _ in range(rng.randint(3, 20))
+        )
+        for _ in range(args.messages)
+    ]
+
+    print(
+        f"{'patterns':>8} {'build':>9} {'matcher':>9} {'one-by-one':>11} {'speedup':>8}"
+    )
+    for size in (int(x) for x in args.sizes.split(",")):
+        literals = {f"l{i}": random_phrase(rng, vocab) for i in range(size // 2)}
+        patterns = {
+            f"p{i}": rf"\b{rng.choice(vocab)}\d{{{rng.randint(1, 3)}}}\b"
+            for i in range(size - size // 2)
+        }
+        # make sure something actually hits
+        literals["hit"] = "hype train"
+
+        t0 = time.perf_counter()
+        m = PatternMatcher(literals=literals, patterns=patterns)
+        m.rebuild()
+        t1 = time.perf_counter()
+        hits0 = sum(len(m.find_all(msg)) for msg in messages)
+        t2 = time.perf_counter()
+
+        compiled = [re.compile(re.escape(v), re.I) for v in literals.values()]
+        compiled += [re.compile(v) for v in patterns.values()]
+        hits1 = 0
+        for msg in messages:
+            for p in compiled:
+                hits1 += len(p.findall(msg))
+        t3 = time.perf_counter()
+
+        print(
+            f"{size:>8} {t1-t0:>8.3f}s {t2-t1:>8.3f}s {t3-t2:>10.3f}s "
+            f"{(t3-t2)/(t2-t1):>7.1f}x   hits={hits0}/{hits1}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import asyncio
 from collections import namedtuple
 
 ReplyLine = namedtuple("ReplyLine", ["testfile_lineno", "reply_no", "text"])
@@ -45,4 +46,36 @@ def populate_globals():
         g[name] = value
 
 
+class FakeSock:
+    # stands in for twichat.irc.conn.IRCConnection: reads come from lines
+    # and whatever is written is collected in sent
+    closed = False
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.sent = list()
+
+    async def start(self):
+        pass
+
+    async def readline(self):
+        await asyncio.sleep(0)
+        return self.lines.pop(0) if self.lines else ""
+
+    def writeline(self, line):
+        self.sent.append(str(line))
+
+    async def send(self, line):
+        self.writeline(line)
+
+    def write_buffer_size(self):
+        return 0
+
+    def register(self, **kw):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
 del get_test_lines, namedtuple
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+
+from twichat.loop import TWILoop
+from twichat.handlers import BatchReplyHandler, HandlerResult, PingPong
+from twichat.irc.reply import grok
+
+from t.lib import FakeSock
+
+
+def chat(channel, text):
+    return f":j!j@j.tmi.twitch.tv PRIVMSG #{channel} :{text}"
+
+
+class Echo(BatchReplyHandler):
+    def __init__(self, **kw):
+        super().__init__(**kw)
+        self.batches = list()
+
+    def accept_batch(self, replies):
+        self.batches.append([r.msg for r in replies])
+        return [
+            f"PRIVMSG {r.channel} :{r.msg}" if r.msg.endswith("!") else None
+            for r in replies
+        ]
+
+
+def run(handler, lines):
+    loop = TWILoop()
+    loop.sock = FakeSock(lines)
+    loop.handlers.extend((PingPong(), handler))
+    asyncio.run(loop.run())
+    return loop
+
+
+def test_batch_size():
+    echo = Echo(batch_size=3, max_delay=60)
+    loop = run(echo, [chat("a", i) for i in range(7)] + ["PING :x"])
+    # two full batches, the rest flushed at shutdown; the PING isn't batched
+    assert echo.batches == [["0", "1", "2"], ["3", "4", "5"], ["6"]]
+    assert loop.sock.sent == ["PONG x"]
+    assert not echo.pending and not echo.timers
+
+
+def test_batch_results_map_to_sends():
+    echo = Echo(batch_size=10)
+    loop = run(echo, [chat("a", "hi"), chat("a", "yo!"), chat("b", "hey!")])
+    assert echo.batches == [["hi", "yo!", "hey!"]]
+    assert loop.sock.sent == ["PRIVMSG #a :yo!", "PRIVMSG #b :hey!"]
+
+
+def test_batch_per_channel():
+    echo = Echo(batch_size=2, per_channel=True, max_delay=60)
+    run(echo, [chat("a", 1), chat("b", 2), chat("a", 3), chat("b", 4), chat("c", 5)])
+    assert echo.batches == [["1", "3"], ["2", "4"], ["5"]]
+
+
+def test_batch_deadline():
+    echo = Echo(batch_size=100, max_delay=0.01)
+    loop = TWILoop()
+    loop.handlers.append(echo)
+
+    async def go():
+        loop.iter_handlers(grok(chat("a", "one")))
+        loop.iter_handlers(grok(chat("a", "two")))
+        assert not echo.batches
+        await asyncio.sleep(0.05)
+        assert echo.batches == [["one", "two"]]
+
+    asyncio.run(go())
+
+
+class Quitter(BatchReplyHandler):
+    def accept_batch(self, replies):
+        return HandlerResult(send="PART #a", done=True, stop_mainloop=True)
+
+
+def test_batch_handler_result():
+    quitter = Quitter(batch_size=2)
+    loop = run(quitter, [chat("a", i) for i in range(5)])
+    assert quitter not in loop.handlers
+    assert loop.sock.sent[0] == "PART #a"
+    assert loop.sock.sent[-1] == "QUIT"
+
+
+def test_batch_handler_errors_are_logged(caplog):
+    class BadWants(Echo):
+        def wants(self, reply):
+            return reply.nope
+
+    class BadKey(Echo):
+        def key(self, reply):
+            raise KeyError("nope")
+
+    class BadBatch(Echo):
+        def accept_batch(self, replies):
+            raise RuntimeError("nope")
+
+    class WrongCount(Echo):
+        def accept_batch(self, replies):
+            return ["PRIVMSG #a :one result for the lot"]
+
+    handlers = [BadWants(), BadKey(), BadBatch(batch_size=1), WrongCount()]
+    loop = TWILoop()
+    loop.sock = FakeSock([chat("a", "one"), chat("a", "two"), "PING :x"])
+    loop.handlers.append(PingPong())
+    loop.handlers.extend(handlers)
+    asyncio.run(loop.run())
+
+    # the loop carried on, and nothing came of the bad results
+    assert loop.sock.sent == ["PONG x"]
+    errors = [r.getMessage() for r in caplog.records if r.levelname == "ERROR"]
+    # wants() fails on all three lines, key() on the two PRIVMSGs
+    assert sum("iter_handlers() error handling" in e for e in errors) == 5
+    assert sum("flush_batch() error handling" in e for e in errors) == 2
+    assert any("gave 1 results for 2 replies" in e for e in errors)
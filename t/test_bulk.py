@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+
+from twichat.bulk import chunk_offsets, line_columns, parse_log, main
+from twichat.irc.parser import parse
+
+from t.lib import TEST_LINES
+
+TAGGED = (
+    "@badges=;tmi-sent-ts=1607899999000 :nick!nick@nick.tmi.twitch.tv "
+    "PRIVMSG #chan :hello"
+)
+
+
+def write_log(path, copies=20):
+    lines = [r.text for r in TEST_LINES] + [TAGGED, "#SEND# PRIVMSG #chan :hi", ""]
+    path.write_text("\n".join(lines * copies))
+    return [l for l in lines if l and not l.startswith("#SEND#")] * copies
+
+
+def test_chunk_offsets(tmp_path):
+    log = tmp_path / "chat.log"
+    write_log(log)
+    data = log.read_bytes()
+    offsets = chunk_offsets(log, chunk_size=100)
+    assert offsets[0][0] == 0 and offsets[-1][1] == len(data)
+    for (_, end), (start, _) in zip(offsets, offsets[1:]):
+        assert end == start and data[end - 1 : end] == b"\n"
+    assert chunk_offsets(tmp_path / "chat.log", chunk_size=10**9) == [(0, len(data))]
+
+
+def test_parse_log(tmp_path):
+    log = tmp_path / "chat.log"
+    lines = write_log(log)
+    want = [parse(line) for line in lines]
+
+    for workers, window in ((1, None), (2, None), (2, 1)):
+        batches = list(parse_log(log, workers=workers, chunk_size=1000, window=window))
+        assert len(batches) > 1
+        commands = [c for b in batches for c in b.command]
+        assert commands == [r.command.name for r in want]
+        channels = [c for b in batches for c in b.channel]
+        assert channels.count("#chan") == 20
+        stamps = [t for b in batches for t in b.timestamp]
+        assert stamps.count(1607899999000) == 20
+        assert not any(b.errors for b in batches)
+
+
+def test_line_columns():
+    for line in [r.text for r in TEST_LINES] + [TAGGED]:
+        reply = parse(line)
+        channel, user, command, ts = line_columns(line)
+        assert command == reply.command.name
+        assert user == (reply.origin.name if reply.origin else None)
+        if channel is not None:
+            assert channel == reply.params[0]
+    assert line_columns(TAGGED) == ("#chan", "nick", "PRIVMSG", 1607899999000)
+
+
+def test_cli(tmp_path):
+    log = tmp_path / "chat.log"
+    lines = write_log(log, copies=2)
+    out = tmp_path / "chat.jsonl"
+    main([str(log), "--workers", "1", "--output", str(out)])
+    rows = [json.loads(line) for line in out.read_text().splitlines()]
+    assert len(rows) == len(lines)
+    assert rows[-1] == dict(
+        channel="#chan", user="nick", command="PRIVMSG", timestamp=1607899999000
+    )
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+
+from twichat.caps import CapNegotiator
+from twichat.const import TWITCH_CAPS, IRCV3_CAPS
+from twichat.fake_tmi import FakeTMI
+from twichat.handlers import ReplyHandler
+from twichat.irc.reply import grok
+from twichat.loop import TWILoop, twitch
+
+WANTED = TWITCH_CAPS + IRCV3_CAPS
+
+
+def feed(neg, line):
+    return [str(m) for m in neg.feed(grok(line))]
+
+
+def test_negotiate_ack():
+    neg = CapNegotiator(WANTED)
+    assert [str(m) for m in neg.start()] == ["CAP LS 302"]
+    # multi-line LS, with values
+    assert feed(neg, ":srv CAP * LS * :twitch.tv/tags sasl=PLAIN,EXTERNAL") == []
+    assert feed(neg, ":srv CAP * LS :twitch.tv/commands batch") == [
+        "CAP REQ :twitch.tv/tags twitch.tv/commands batch"
+    ]
+    assert "sasl" in neg.available
+    assert feed(neg, ":srv CAP * ACK :twitch.tv/tags twitch.tv/commands") == []
+    # Twitch welcomes us before it's done ACKing
+    assert feed(neg, ":srv 001 bot :Welcome, GLHF!") == []
+    assert not neg.done
+    assert feed(neg, ":srv CAP * ACK :batch") == ["CAP END"]
+    assert neg.done
+    assert neg.acked == {"twitch.tv/tags", "twitch.tv/commands", "batch"}
+
+
+def test_negotiate_nak_and_silence():
+    neg = CapNegotiator(WANTED)
+    feed(neg, ":srv CAP * LS :message-tags")
+    assert feed(neg, ":srv CAP * NAK :message-tags") == ["CAP END"]
+    assert neg.done and not neg.acked and neg.nakked == {"message-tags"}
+
+    neg = CapNegotiator(WANTED)
+    assert feed(neg, ":srv CAP * LS :sasl") == ["CAP END"]
+    assert neg.done
+
+    neg = CapNegotiator(WANTED)
+    assert feed(neg, ":srv 421 * CAP :Unknown command") == []
+    assert neg.done
+
+    neg = CapNegotiator(WANTED)
+    assert feed(neg, ":srv 001 bot :hi") == []
+    assert neg.done
+
+    neg = CapNegotiator(WANTED)
+    feed(neg, ":srv CAP * LS :batch")
+    assert [str(m) for m in neg.give_up()] == ["CAP END"]
+    assert neg.nakked == {"batch"}
+
+
+def test_registration_waits_for_caps():
+    seen = list()
+
+    async def go():
+        async with FakeTMI() as server:
+            bot = twitch(host="127.0.0.1", port=server.port, use_ssl=False, nick="bot")
+
+            class Welcome(ReplyHandler):
+                def accept(self, reply):
+                    if reply.command.name == "001":
+                        seen.append(bot.capabilities)
+                        seen.append(list(server.clients[0].received))
+                        bot.stop()
+
+            bot.handlers.append(Welcome())
+            await asyncio.wait_for(bot.run(), timeout=5)
+            return server, bot
+
+    server, bot = asyncio.run(go())
+    # the fake server doesn't offer batch or message-tags, so they were
+    # never requested
+    assert seen[0] == frozenset(TWITCH_CAPS)
+    assert seen[1][0] == "CAP LS 302"
+    assert "CAP REQ :twitch.tv/tags twitch.tv/commands twitch.tv/membership" in seen[1]
+
+
+def test_cap_timeout():
+    class Mute(FakeTMI):
+        # lists its capabilities, but never answers the REQ
+        def on_cap(self, client, args, trailing):
+            if args and args[0] == "LS":
+                super().on_cap(client, args, trailing)
+
+    async def go():
+        async with Mute() as server:
+            bot = TWILoop(
+                host="127.0.0.1",
+                port=server.port,
+                use_ssl=False,
+                nick="bot",
+                caps=TWITCH_CAPS,
+                cap_timeout=0.05,
+            )
+
+            class Welcome(ReplyHandler):
+                def accept(self, reply):
+                    if reply.command.name == "001":
+                        bot.stop()
+
+            bot.handlers.append(Welcome())
+            await asyncio.wait_for(bot.run(), timeout=5)
+            return bot
+
+    bot = asyncio.run(go())
+    assert bot.capabilities == frozenset()
+    assert bot.negotiator.nakked == set(TWITCH_CAPS)
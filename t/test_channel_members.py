@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from twichat.irc.reply import grok
+from twichat.handlers import ChannelMembers, NamesCollector
+
+
+def test_channel_members(a_reply):
+    # feed the whole test session through and make sure nothing explodes
+    cm = ChannelMembers()
+    cm(grok(a_reply.text))
+
+
+def test_freenode_session(
+    a_reply19, a_reply41, a_reply43, a_reply44, a_reply45, a_reply51, a_reply52
+):
+    diffs = list()
+    snapshots = list()
+    cm = ChannelMembers(
+        on_diff=lambda c, a, r: diffs.append((c, a, r)),
+        on_snapshot=lambda c, n: snapshots.append((c, sorted(n))),
+    )
+
+    for line in (a_reply19, a_reply41, a_reply43, a_reply44):
+        cm(grok(line))  # 001, JOIN, 353, 366
+    assert cm.nick == "just_testing_som"
+    assert cm.is_present("#twichat", "just_testing_som")
+    assert cm.is_present("#TwiChat", "Just_Testing_Som")
+    assert snapshots == [("#twichat", ["just_testing_som"])]
+    assert diffs == [("#twichat", ("just_testing_som",), ())]
+
+    cm(grok(a_reply45))  # jettero JOIN #twichat
+    assert cm.is_present("#twichat", "jettero")
+    assert cm.count("#twichat") == 2
+    assert cm.channels_of("jettero") == ["#twichat"]
+
+    cm(grok(a_reply51))  # just_testing_som PART #twichat
+    assert cm.count("#twichat") == 0
+    assert diffs[-1] == ("#twichat", (), ("just_testing_som", "jettero"))
+
+    cm(grok(a_reply52))  # just_testing_som JOIN #twichat
+    cm(grok(":jettero!~j@host QUIT :bye"))
+    assert not cm.is_present("#twichat", "jettero")
+    assert cm.is_present("#twichat", "just_testing_som")
+
+
+def test_channel_members_bounded():
+    cm = ChannelMembers(max_nicks=3)
+    cm(grok(":srv 353 me = #big :a b c d e"))
+    assert cm.count("#big") == 0
+    cm(grok(":srv 366 me #big :End of /NAMES list"))
+    assert list(cm.members_of("#big")) == ["c", "d", "e"]
+    assert cm.evicted["#big"] == 2
+
+    cm(grok(":f!f@f JOIN #big"))
+    assert list(cm.members_of("#big")) == ["d", "e", "f"]
+    assert cm.evicted["#big"] == 3
+
+    cm(grok(":d!d@d PART #big"))
+    assert list(cm.members_of("#big")) == ["e", "f"]
+
+    # the reverse index follows evictions, snapshots and departures
+    assert cm.channels_of("a") == [] and cm.channels_of("d") == []
+    cm(grok(":e!e@e JOIN #small"))
+    assert cm.channels_of("E") == ["#big", "#small"]
+    cm(grok(":srv 353 me = #small :g"))
+    cm(grok(":srv 366 me #small :End of /NAMES list"))
+    assert cm.channels_of("e") == ["#big"] and cm.channels_of("g") == ["#small"]
+    cm(grok(":e!e@e QUIT :bye"))
+    assert "e" not in cm.nick_channels
+    assert list(cm.members_of("#big")) == ["f"]
+    assert ChannelMembers().max_nicks is not None
+
+
+def test_names_collector():
+    lists = list()
+    nc = NamesCollector(on_names=lambda c, n: lists.append((c, list(n))))
+    for i in range(0, 1000, 100):
+        names = " ".join(f"Nick{j}" for j in range(i, i + 100))
+        reply = grok(f":srv 353 me = #Huge :{names}")
+        nc(reply)
+        # the Nick objects are never made unless someone asks
+        assert reply._nicks is None
+    assert not lists
+    nc(grok(":srv 366 me #Huge :End of /NAMES list"))
+    assert len(lists) == 1
+    channel, nicks = lists[0]
+    assert channel == "#huge"
+    assert nicks == [f"nick{j}" for j in range(1000)]
+    assert not nc.pending
+
+    nc = NamesCollector(max_names=10)
+    nc(grok(":srv 353 me = #c :" + " ".join(f"n{j}" for j in range(25))))
+    assert list(nc.end("#c")) == [f"n{j}" for j in range(15, 25)]
+    assert nc.evicted["#c"] == 15
+
+
+def test_name_list_lazy_nicks():
+    reply = grok(":srv 353 me = #c :@op  plain")
+    assert list(reply.iter_names()) == ["op", "plain"]
+    assert repr(reply) == "NameList<present: @op, plain>"
+    assert reply._nicks is None
+    assert [(n.nick, n.op) for n in reply.nicks] == [("op", True), ("plain", False)]
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import pytest
+
+from twichat import columns
+from twichat.columns import ReplyColumns, columnize
+from twichat.irc.reply import grok
+
+MINUTE = 1607899980000
+
+
+def chat(nick, channel, msg, ts, emotes=""):
+    return grok(
+        f"@emotes={emotes};tmi-sent-ts={ts} :{nick}!{nick}@{nick}.tmi.twitch.tv "
+        f"PRIVMSG {channel} :{msg}"
+    )
+
+
+def replies():
+    yield grok(":tmi.twitch.tv 001 me :Welcome, GLHF!")
+    yield chat("alice", "#one", "Kappa hi", MINUTE + 1000, "25:0-4")
+    yield chat("bob", "#one", "hello", MINUTE + 2000)
+    yield chat("alice", "#one", "Kappa Kappa", MINUTE + 61000, "25:0-4,6-10")
+    yield chat("carol", "#two", "Keepo", MINUTE + 3000, "1902:0-4")
+    yield chat("alice", "#two", "yo", MINUTE + 4000)
+
+
+@pytest.fixture(params=["numpy", "stdlib"])
+def cols(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(columns, "numpy", None)
+    return ReplyColumns().extend(replies(), when=0)
+
+
+def test_columns(cols):
+    assert len(cols) == 6
+    assert cols.row(0) == dict(
+        timestamp=0,
+        channel=None,
+        user="tmi.twitch.tv",
+        command="001",
+        text="",
+        emotes=[],
+    )
+    assert cols.row(3) == dict(
+        timestamp=MINUTE + 61000,
+        channel="#one",
+        user="alice",
+        command="PRIVMSG",
+        text="Kappa Kappa",
+        emotes=["25", "25"],
+    )
+    assert cols.buffer == b"Kappa hihelloKappa KappaKeepoyo"
+    assert list(cols.user) == [0, 1, 2, 1, 3, 1]
+
+
+def test_text_buffer():
+    cols = ReplyColumns().extend(
+        [chat("a", "#c", "héllo wörld", 1), chat("b", "#c", "ok ✓", 2)]
+    )
+    assert [cols.text(0), cols.text(1)] == ["héllo wörld", "ok ✓"]
+    assert isinstance(cols.buffer, bytearray)
+    assert cols.text_offsets[-1] == len(cols.buffer)
+
+
+def test_aggregations(cols):
+    assert cols.per_minute() == {
+        "#one": {MINUTE: 2, MINUTE + 60000: 1},
+        "#two": {MINUTE: 2},
+    }
+    assert cols.top_users(2) == [("alice", 3), ("bob", 1)]
+    # ties go to whoever was seen first
+    assert cols.top_users(channel="#two") == [("alice", 1), ("carol", 1)]
+    assert cols.top_users(channel="#nope") == []
+    assert cols.emote_counts() == [("25", 3), ("1902", 1)]
+
+
+def test_empty(cols):
+    empty = ReplyColumns()
+    assert empty.per_minute() == {}
+    assert empty.top_users() == []
+    assert empty.emote_counts() == []
+
+
+def test_columnize():
+    batches = list(columnize(replies(), batch_size=4, when=0))
+    assert [len(b) for b in batches] == [4, 2]
+    (everything,) = columnize(replies(), when=0)
+    assert len(everything) == 6
+
+
+def test_to_numpy():
+    numpy = pytest.importorskip("numpy")
+    cols = ReplyColumns().extend(replies(), when=0)
+    arrays = cols.to_numpy()
+    assert arrays["timestamp"].dtype == numpy.int64
+    assert arrays["channel"].tolist() == [-1, 0, 0, 0, 1, 1]
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+
+from twichat.irc.reply import grok
+from twichat.handlers import PureReplyHandler
+from twichat.dedup import DedupCache, normalize_text
+from twichat.loop import TWILoop
+
+from t.lib import FakeSock
+
+
+class Slow(PureReplyHandler):
+    def __init__(self):
+        self.calls = 0
+
+    def classify(self, reply):
+        self.calls += 1
+        return "spam" in (reply.msg or "")
+
+    def respond(self, reply, verdict):
+        if verdict:
+            return f"PRIVMSG {reply.channel} :no spam please {reply.sender}"
+
+
+def test_normalize_text():
+    assert normalize_text("  Buy   FOLLOWERS\t now ") == "buy followers now"
+    assert normalize_text("copy pasta \U000e0000") == "copy pasta"
+    assert normalize_text("zero\u200bwidth") == "zerowidth"
+
+
+def test_dedup_cache(mocker):
+    fake_time = [1000.0]
+    mocker.patch("time.time", lambda: fake_time[0])
+
+    h = Slow()
+    dc = DedupCache(ttl=10, maxsize=2, with_channel=True)
+
+    r0 = dc.classify(h, grok(":a!a@a PRIVMSG #twichat :SPAM spam"))
+    r1 = dc.classify(h, grok(":b!b@b PRIVMSG #twichat :spam   spam \U000e0000"))
+    assert r0 is r1
+    assert h.calls == 1
+    assert dc.stats()["hits"] == 1
+
+    # different channel, different key
+    dc.classify(h, grok(":b!b@b PRIVMSG #other :spam spam"))
+    assert h.calls == 2
+
+    fake_time[0] += 11
+    dc.classify(h, grok(":a!a@a PRIVMSG #twichat :spam spam"))
+    assert h.calls == 3
+    assert dc.expired == 1
+
+    dc.classify(h, grok(":a!a@a PRIVMSG #twichat :something else"))
+    assert len(dc) == 2
+
+    # no text, no caching
+    assert dc.classify(h, grok(":a!a@a JOIN #twichat")) is False
+    s = dc.stats()
+    assert (s["hits"], s["misses"]) == (1, 4)
+
+
+def test_dedup_in_loop(mocker):
+    normalize = mocker.patch("twichat.dedup.normalize_text", side_effect=normalize_text)
+    lines = [
+        ":a!a@a.tmi.twitch.tv PRIVMSG #one :spam spam",
+        ":b!b@b.tmi.twitch.tv PRIVMSG #two :SPAM  spam",
+        ":c!c@c.tmi.twitch.tv PRIVMSG #two :hello",
+    ]
+    first, second = Slow(), Slow()
+    loop = TWILoop(dedup=DedupCache())
+    loop.sock = FakeSock(lines)
+    loop.handlers.extend((first, second))
+    asyncio.run(loop.run())
+
+    # the verdict is shared, but each reply goes to its own channel and sender
+    assert (first.calls, second.calls) == (2, 2)
+    assert normalize.call_count == len(lines)
+    assert loop.sock.sent[:4] == [
+        "PRIVMSG #one :no spam please a",
+        "PRIVMSG #one :no spam please a",
+        "PRIVMSG #two :no spam please b",
+        "PRIVMSG #two :no spam please b",
+    ]
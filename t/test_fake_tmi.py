@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+
+from twichat.loop import TWILoop
+from twichat.supervisor import Supervisor
+from twichat.fake_tmi import FakeTMI
+from twichat.handlers import JoinChannel, PingPong, ReplyHandler
+from twichat.irc.msg import TargetMessage
+from twichat.irc.reply import ChannelMessage, NameList, EndNameList
+
+
+def client_of(server, **kw):
+    return TWILoop(host="127.0.0.1", port=server.port, use_ssl=False, **kw)
+
+
+def test_register_join_and_chat():
+    got = list()
+    names = list()
+
+    async def go():
+        members = {"#twichat": [f"viewer{i}" for i in range(250)]}
+        async with FakeTMI(members=members, passwd="oauth:x") as server:
+            bot = client_of(server, nick="bot", passwd="oauth:x")
+
+            class Chat(ReplyHandler):
+                def accept(self, reply):
+                    if isinstance(reply, NameList):
+                        names.extend(reply.iter_names())
+                    elif isinstance(reply, EndNameList):
+                        server.firehose("#twichat", rate=20000, count=1000)
+                    elif isinstance(reply, ChannelMessage):
+                        got.append(reply.msg)
+                        if len(got) == 1000:
+                            bot.stop("done")
+
+            bot.handlers.append(JoinChannel("twichat"))
+            bot.handlers.append(Chat())
+            await bot.run()
+            await asyncio.sleep(0.01)
+            return server
+
+    server = asyncio.run(go())
+    assert len(names) == 251
+    assert got == [f"message {i}" for i in range(1000)]
+    assert server.connections == 1
+
+
+def test_bad_passwd():
+    async def go():
+        async with FakeTMI(passwd="oauth:right") as server:
+            bot = client_of(server, nick="bot", passwd="oauth:wrong")
+            await asyncio.wait_for(bot.run(), timeout=5)
+            return bot
+
+    bot = asyncio.run(go())
+    assert bot.sock.closed
+
+
+def test_rate_limit():
+    notices = list()
+
+    async def go():
+        async with FakeTMI(rate_limit=(20, 30)) as server:
+            bot = client_of(server, nick="bot")
+
+            class Spam(ReplyHandler):
+                def accept(self, reply):
+                    if reply.command.name == "001":
+                        return [
+                            TargetMessage("#twichat", f"spam {i}") for i in range(30)
+                        ]
+                    if reply.command.name == "NOTICE":
+                        notices.append(reply.tags["msg-id"])
+                        if len(notices) == 10:
+                            bot.stop()
+
+            bot.handlers.append(Spam())
+            await asyncio.wait_for(bot.run(), timeout=5)
+            return server
+
+    server = asyncio.run(go())
+    assert notices == ["msg_ratelimit"] * 10
+    assert server.rate_limited == 10
+
+
+def test_ping_cadence():
+    async def go():
+        async with FakeTMI(ping_interval=0.01) as server:
+            bot = client_of(server, nick="bot")
+            bot.handlers.append(PingPong())
+
+            async def watch():
+                while not server.clients or server.clients[0].pongs < 3:
+                    await asyncio.sleep(0.01)
+                bot.stop()
+
+            await asyncio.wait_for(bot.run(watch()), timeout=5)
+
+    asyncio.run(go())
+
+
+def test_reconnect():
+    async def go():
+        async with FakeTMI() as server:
+            sup = Supervisor(min_delay=0)
+            bot = client_of(server, nick="bot")
+
+            class Welcome(ReplyHandler):
+                welcomes = 0
+
+                def accept(self, reply):
+                    if reply.command.name == "001":
+                        self.welcomes += 1
+                        if self.welcomes == 1:
+                            server.reconnect()
+                        else:
+                            sup.stop("bot")
+
+            bot.handlers.append(Welcome())
+            sup.add(bot)
+            await asyncio.wait_for(sup.run(), timeout=5)
+            return server, sup
+
+    server, sup = asyncio.run(go())
+    assert server.connections == 2
+    assert sup.restarts["bot"] == 1
@@ -41,3 +41,18 @@ def test_joinz(a_reply):
         assert isinstance(reply, Reply)
         assert not isinstance(reply, Arrive)
         assert "JOIN" not in a_reply
+
+
+def test_wire_and_cached_repr(a_reply):
+    reply = grok(a_reply.text)
+    assert reply.wire == a_reply.text
+    r0 = repr(reply)
+    assert repr(reply) is r0
+    assert reply.source is reply.source
+
+
+def test_msg_setter_forgets_repr(a_reply57):
+    reply = grok(a_reply57)  # jettero PRIVMSG #twichat :RUT?
+    assert "RUT?" in repr(reply)
+    reply.msg = "something else"
+    assert "something else" in repr(reply)
@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import asyncio
 from twichat.irc.reply import grok
-from twichat.handlers import JoinChannel
+from twichat.handlers import JoinChannel, JoinChannels, FloodDetector
 
 
 def test_join_channel(a_reply17, a_reply19, a_reply40):
@@ -21,3 +22,111 @@ def test_join_channel(a_reply17, a_reply19, a_reply40):
     for hr in (hr19, hr40):
         assert hr.done
         assert str(hr.send) == "JOIN #supz"
+
+
+def test_join_channels(mocker, a_reply19, a_reply45):
+    fake_time = [1000]
+
+    async def fsleep(dt):
+        fake_time[0] += dt
+
+    mocker.patch("time.time", lambda: fake_time[0])
+    mocker.patch("asyncio.sleep", fsleep)
+
+    h = JoinChannels(
+        ["twichat", "two", "#three", "TWO"],
+        items_per_interval=2,
+        interval_in_seconds=5,
+        name="test_join_channels",
+    )
+    assert h.channels == ["#twichat", "#two", "#three"]
+
+    hr = h(grok(a_reply19))  # 001 Welcome
+    assert not hr.done
+
+    async def collect():
+        return [(fake_time[0], str(msg)) async for msg in hr.send if msg is not None]
+
+    sent = asyncio.run(collect())
+    assert sent == [(1000, "JOIN #twichat,#two"), (1005, "JOIN #three")]
+
+    assert not h(grok(a_reply45))  # jettero JOIN #twichat
+    assert h.confirmed == {"#twichat"}
+
+    assert not h(grok(":tmi.twitch.tv 403 someone #two :No such channel"))
+    assert h.failed == {"#two"}
+
+    hr = h(grok(":someone.tmi.twitch.tv 366 someone #three :End of /NAMES list"))
+    assert hr.done
+    assert h.confirmed == {"#twichat", "#three"}
+
+
+def test_flood_detector(mocker):
+    mocker.patch("time.time", lambda: 1000.0)
+    floods = list()
+
+    fd = FloodDetector(
+        limit=2, interval_in_seconds=10, on_flood=lambda r, c: floods.append(c)
+    )
+    for _ in range(3):
+        fd(grok(":spammer!s@s PRIVMSG #twichat :buy followers"))
+    fd(grok(":spammer!s@s PRIVMSG #other :buy followers"))
+    fd(grok(":jettero!j@j PRIVMSG #twichat :hiya"))
+    fd(grok(":jettero!j@j JOIN #twichat"))
+
+    assert floods == [3]
+    assert fd.flagged == {("#twichat", "spammer")}
+    assert fd.channel_rate("#twichat") == 4
+
+
+def test_join_channels_throttle_per_account(mocker):
+    mocker.patch("time.time", lambda: 2000)
+    name = "test_join_channels_throttle_per_account"
+
+    def welcome(nick):
+        return grok(f":tmi.twitch.tv 001 {nick} :Welcome, GLHF!")
+
+    one = JoinChannels(["a"], items_per_interval=1, name=name)
+    two = JoinChannels(["b"], items_per_interval=1, name=name)
+    one(welcome("one"))
+    two(welcome("two"))
+    assert one.throttle.name == f"{name}/one"
+    one.throttle.tick()
+    # one's JOIN budget is spent, two's isn't
+    assert one.throttle.count == 1
+    assert two.throttle.count == 0
+
+    again = JoinChannels(["c"], items_per_interval=1, name=name, nick="ONE")
+    assert again.throttle.count == 1
+
+
+def test_join_channels_over_throttle(mocker):
+    fake_time = [3000]
+
+    async def fsleep(dt):
+        fake_time[0] += dt
+
+    mocker.patch("time.time", lambda: fake_time[0])
+    mocker.patch("asyncio.sleep", fsleep)
+
+    h = JoinChannels(
+        ["a", "b"], items_per_interval=2, interval_in_seconds=5, nick="over"
+    )
+    tick = h.throttle.tick
+    ticks = list()
+
+    def racing_tick():
+        ticks.append(fake_time[0])
+        if len(ticks) == 2:
+            tick()  # someone else sharing the throttle gets in first
+        tick()
+
+    h.throttle.tick = racing_tick
+    hr = h(grok(":tmi.twitch.tv 001 over :Welcome, GLHF!"))
+
+    async def collect():
+        return [(fake_time[0], str(msg)) async for msg in hr.send if msg is not None]
+
+    # the JOIN waits for room for the channel it couldn't tick for
+    assert asyncio.run(collect()) == [(3005, "JOIN #a,#b")]
+    assert ticks == [3000, 3000, 3005]
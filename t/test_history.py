@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from twichat.irc.reply import grok
+from twichat.history import ChannelRing, ChatHistory
+
+
+def test_channel_ring():
+    ring = ChannelRing(capacity=4, per_user=2)
+    for i, nick in enumerate("abacab"):
+        ring.append(nick, f"msg{i}", when=100.0 + i)
+
+    assert len(ring) == 4
+    assert [r.msg for r in ring.last(10)] == ["msg2", "msg3", "msg4", "msg5"]
+    assert [r.msg for r in ring.last(2)] == ["msg4", "msg5"]
+    assert [r.msg for r in ring.since(103.5)] == ["msg4", "msg5"]
+    assert [r.msg for r in ring.since(0)] == ["msg2", "msg3", "msg4", "msg5"]
+    assert ring.since(200) == []
+    assert [r.msg for r in ring.by_user("a")] == ["msg2", "msg4"]
+    assert [r.msg for r in ring.by_user("b", 1)] == ["msg5"]
+    assert ring.last_seen("c") == 103.0
+
+    ring.append("d", "msg6", when=106.0)
+    ring.append("d", "msg7", when=107.0)
+    ring.append("d", "msg8", when=108.0)
+    assert ring.by_user("c") == []
+    assert "c" not in ring.users
+    assert ring.last_seen("c") is None
+    assert ring[ring.next - 1].msg == "msg8"
+
+
+def test_chat_history(mocker):
+    mocker.patch("time.time", lambda: 1000.0)
+    h = ChatHistory(per_channel=3, max_records=4)
+
+    h.record(grok(":jettero!j@j PRIVMSG #twichat :hiya"), when=990.0)
+    h.record(grok(":jettero!j@j PRIVMSG #twichat :supz"), when=995.0)
+    h.record(grok(":jettero!j@j PRIVMSG just_testing_som :not a channel"))
+    h.record(grok(":other!o@o PRIVMSG #other :one"), when=996.0)
+    h.record(grok(":other!o@o PRIVMSG #other :two"), when=997.0)
+
+    assert len(h) == 4
+    assert [r.msg for r in h.last("#TwiChat", 5)] == ["hiya", "supz"]
+    assert [r.msg for r in h.window("#twichat", 7)] == ["supz"]
+    assert h.spoke_within("#twichat", "jettero", 6)
+    assert not h.spoke_within("#twichat", "jettero", 4)
+    assert not h.spoke_within("#twichat", "other", 600)
+
+    # the cap evicts from the quietest channel first
+    h.record(grok(":other!o@o PRIVMSG #other :three"), when=998.0)
+    assert len(h) == 4 and h.evicted == 1
+    assert [r.msg for r in h.last("#twichat", 5)] == ["supz"]
+
+    h.record(grok(":other!o@o PRIVMSG #other :four"), when=999.0)
+    assert [r.msg for r in h.by_user("#other", "other")] == ["two", "three", "four"]
+    assert len(h) == 4
+
+
+def test_ring_growth_and_idle_channels():
+    ring = ChannelRing(capacity=1000)
+    assert ring.last_when is None
+    ring.append("a", "one", when=10.0)
+    ring.append("b", "two", when=11.0)
+    assert len(ring.records) == len(ring.times) == 2
+    assert ring.last_when == 11.0
+
+    ring = ChannelRing(capacity=3)
+    for i in range(5):
+        ring.append("a", f"msg{i}", when=float(i))
+    assert len(ring.records) == 3
+    assert [r.msg for r in ring.last(5)] == ["msg2", "msg3", "msg4"]
+
+    h = ChatHistory(per_channel=10, idle_seconds=60)
+    h.add("#quiet", "a", "hello", when=100.0)
+    h.add("#busy", "b", "one", when=150.0)
+    h.add("#busy", "b", "two", when=155.0)
+    assert set(h.rings) == {"#quiet", "#busy"}
+
+    h.add("#busy", "b", "three", when=200.0)
+    assert list(h.rings) == ["#busy"]
+    assert len(h) == 3 and h.evicted == 1
+
+    h.expire(300.0)
+    assert not h.rings and len(h) == 0 and h.evicted == 4
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from twichat.irc.intern import InternTable
+from twichat.irc.parser import parse
+
+
+def test_intern_table():
+    it = InternTable(maxsize=2)
+    a = it("".join(["#twi", "chat"]))
+    assert it("".join(["#twic", "hat"])) is a
+    it("one")
+    it("two")
+    assert len(it) == 2
+    b = "".join(["#twi", "chat"])
+    assert it(b) is b  # a was forgotten
+
+
+def test_parse_interns():
+    p0 = parse(":jettero!~jettero@pdpc/supporter PRIVMSG #twichat :hiya")
+    p1 = parse(":jettero!~jettero@pdpc/supporter PRIVMSG #twichat :supz")
+    assert p0.command.name is p1.command.name
+    assert p0.origin.name is p1.origin.name
+    assert p0.origin.user.name is p1.origin.user.name
+    assert p0.params[0] is p1.params[0]
+
+    t0 = parse("@mod=0;color= :a!a@a PRIVMSG #b :c")
+    t1 = parse("@color=;mod=1 :a!a@a PRIVMSG #b :c")
+    k0 = {k: k for k in t0.tags}
+    assert all(k0[k] is k for k in t1.tags)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+import asyncio
+
+from twichat.loop import TWILoop, task_name, fast_loop_policy
+from twichat.handlers import PingPong, ReplyHandler, JoinChannels
+from twichat.irc.msg import TargetMessage
+from twichat.irc.parser import FIELDS, RECORD, REPLY, Record
+
+from t.lib import FakeSock
+
+PING = "PING :tmi.twitch.tv"
+
+
+def chat(msg):
+    return f":j!j@j.tmi.twitch.tv PRIVMSG #c :{msg}"
+
+
+def test_run_under_asyncio_run():
+    loop = TWILoop()
+    loop.sock = FakeSock([PING])
+    loop.handlers.append(PingPong())
+    asyncio.run(loop.run())
+
+    assert loop.sock.sent == ["PONG tmi.twitch.tv"]
+    assert loop.sock.closed
+    assert not loop.running
+
+
+def test_run_other_jobs():
+    ran = list()
+
+    async def other():
+        ran.append(True)
+
+    loop = TWILoop()
+    loop.sock = FakeSock([PING])
+    asyncio.run(loop.run(other()))
+    assert ran == [True]
+
+
+def test_task_names():
+    async def go(name_tasks):
+        loop = TWILoop()
+        loop.sock = FakeSock([])
+        loop.name_tasks = name_tasks
+        task = loop.create_task(asyncio.sleep(0))
+        await task
+        return loop, task.get_name()
+
+    loop, name = asyncio.run(go(True))
+    assert name.endswith(":sleep")
+    # finished tasks take themselves out
+    assert not loop.tasks
+    assert loop.tasks_started == 1
+
+    loop, name = asyncio.run(go(False))
+    assert name.startswith("Task-")
+
+    assert task_name(object()) is None
+
+
+def test_fast_loop_policy():
+    try:
+        import uvloop  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        assert fast_loop_policy() is None
+    else:
+        assert fast_loop_policy() is not None
+
+
+def test_task_tracking():
+    async def boom():
+        raise RuntimeError("boom")
+
+    async def go():
+        loop = TWILoop()
+        loop.create_task(boom(), name="boom")
+        slow = loop.create_task(asyncio.sleep(10), name="slow")
+        await asyncio.sleep(0.05)
+        report = loop.task_report()
+        long_running = loop.task_report(older_than=60)
+        slow.cancel()
+        await asyncio.sleep(0)
+        return loop, report, long_running
+
+    loop, report, long_running = asyncio.run(go())
+    assert [name for name, _ in report] == ["slow"]
+    assert report[0][1] >= 0.05
+    assert long_running == []
+    assert loop.metrics()["tasks"] == dict(pending=0, started=2, failed=1)
+
+
+def test_task_report_interval(caplog):
+    caplog.set_level("INFO", logger="twichat.loop")
+
+    async def readline():
+        await asyncio.sleep(0.03)
+        return loop.sock.lines.pop(0) if loop.sock.lines else ""
+
+    loop = TWILoop(task_report_interval=0.01, long_task_seconds=0)
+    loop.sock = FakeSock([PING])
+    loop.sock.readline = readline
+    asyncio.run(loop.run())
+
+    assert "running for" in caplog.text
+
+
+def test_stop_flushes_and_quits():
+    class Bye(ReplyHandler):
+        def accept(self, reply):
+            loop.send(TargetMessage("#c", "one"))
+            loop.send(TargetMessage("#c", "two"))
+            loop.stop("see ya")
+
+    loop = TWILoop()
+    loop.sock = FakeSock([PING, PING, PING])
+    loop.handlers.append(Bye())
+    asyncio.run(loop.run())
+
+    assert loop.sock.sent == ["PRIVMSG #c :one", "PRIVMSG #c :two", "QUIT :see ya"]
+    assert loop.sock.closed
+    # how many of the other PINGs were read before the stop() is up to timing
+    assert loop.shutdown_report["unhandled"] <= 2
+    assert loop.shutdown_report["unsent"] == loop.shutdown_report["cancelled"] == 0
+
+
+def test_shutdown_deadline():
+    class Stuck(FakeSock):
+        async def send(self, line):
+            await asyncio.sleep(60)
+
+    class Chatty(ReplyHandler):
+        def accept(self, reply):
+            loop.send(TargetMessage("#c", "one"))
+            loop.send(TargetMessage("#c", "two"))
+            loop.stop()
+
+    async def forever():
+        await asyncio.sleep(60)
+
+    async def go():
+        loop.create_task(forever())
+        await loop.run()
+
+    loop = TWILoop(shutdown_timeout=0.05)
+    loop.sock = Stuck([PING])
+    loop.handlers.append(Chatty())
+    t0 = time.monotonic()
+    asyncio.run(go())
+
+    assert time.monotonic() - t0 < 1
+    assert loop.sock.closed
+    # "one" was stuck in the writer, "two" and the QUIT never got written
+    assert loop.shutdown_report == dict(unhandled=0, unsent=2, cancelled=1)
+
+
+def test_shutdown_stops_throttled_joins():
+    class Bye(ReplyHandler):
+        def accept(self, reply):
+            if reply.command.name == "001":
+                asyncio.get_running_loop().call_later(0.05, loop.stop)
+
+    loop = TWILoop(shutdown_timeout=30)
+    loop.sock = FakeSock([":tmi.twitch.tv 001 shutdown_joins :Welcome, GLHF!"])
+    joins = JoinChannels(["a", "b", "c"], items_per_interval=1, interval_in_seconds=60)
+    loop.handlers.extend((joins, Bye()))
+    t0 = time.monotonic()
+    asyncio.run(loop.run())
+
+    # the JOINs still waiting on the throttle give up (within a second of
+    # waiting) rather than run out the clock
+    assert time.monotonic() - t0 < 5
+    assert loop.sock.sent[0] == "JOIN #a"
+    assert loop.shutdown_report["cancelled"] == 0
+
+
+def test_hangup_keeps_unsent():
+    class HungUp(FakeSock):
+        async def send(self, line):
+            self.closed = True
+            return False
+
+    loop = TWILoop()
+    loop.sock = HungUp([])
+    for i in range(50):
+        loop.send(TargetMessage("#c", f"m{i}"))
+    asyncio.run(loop.run())
+
+    assert loop.sock.sent == []
+    assert loop.shutdown_report["unsent"] == 50
+    assert loop.outbound.stats()["sent"] == 0
+    assert len(loop.outbound) == 50
+
+    loop.sock = FakeSock([])
+    asyncio.run(loop.run())
+    assert len(loop.sock.sent) == 50
+    assert loop.outbound.stats()["sent"] == 50
+
+
+def test_no_stale_lines_after_reconnect():
+    handled = list()
+
+    class Slow(ReplyHandler):
+        def accept(self, reply):
+            handled.append(reply.msg)
+            if reply.msg == "stop":
+                loop.stop()
+
+    async def readline():
+        # everything arrives at once, so the rest is still queued at stop()
+        return loop.sock.lines.pop(0) if loop.sock.lines else ""
+
+    loop = TWILoop()
+    loop.handlers.append(Slow())
+    loop.sock = FakeSock([chat("stop"), chat("old1"), chat("old2")])
+    loop.sock.readline = readline
+    asyncio.run(loop.run())
+    assert loop.shutdown_report["unhandled"] == 2
+
+    loop.sock = FakeSock([chat("new")])
+    asyncio.run(loop.run())
+    assert handled == ["stop", "new"]
+
+
+class Counter(ReplyHandler):
+    def __init__(self, mode):
+        self.reply_mode = mode
+        self.got = list()
+
+    def accept(self, reply):
+        self.got.append(reply)
+
+
+def test_reply_mode():
+    loop = TWILoop()
+    loop.sock = FakeSock([chat("hi there")])
+    assert loop.reply_mode() is None
+
+    fields, record = Counter(FIELDS), Counter(RECORD)
+    loop.handlers.extend((fields, record))
+    assert loop.reply_mode() == RECORD
+    asyncio.run(loop.run())
+    # each handler gets the shape it asked for
+    assert isinstance(record.got[0], Record)
+    assert record.got[0].msg == "hi there"
+    assert fields.got == [(None, "j!j@j.tmi.twitch.tv", "PRIVMSG", ["#c", "hi there"])]
+
+    # the mode follows the handlers
+    full = Counter(REPLY)
+    loop.handlers.append(full)
+    assert loop.reply_mode() == REPLY
+    loop.handlers.remove(full)
+    assert loop.reply_mode() == RECORD
+    loop.handlers = [fields]
+    assert loop.reply_mode() == FIELDS
+
+
+def test_fields_handler_next_to_pingpong():
+    fields = Counter(FIELDS)
+    loop = TWILoop()
+    loop.sock = FakeSock([PING, chat("yo")])
+    loop.handlers.extend((PingPong(), fields))
+    asyncio.run(loop.run())
+
+    assert loop.sock.sent == ["PONG tmi.twitch.tv"]
+    tags, prefix, command, params = fields.got[1]
+    assert (command, params) == ("PRIVMSG", ["#c", "yo"])
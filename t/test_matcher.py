@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import re
+import random
+
+from twichat.irc.reply import grok
+from twichat.matcher import (
+    AhoCorasick,
+    PatternMatcher,
+    MatchHandler,
+    required_literal,
+)
+
+
+def test_aho_corasick():
+    ac = AhoCorasick({"k1": "he", "k2": "she", "k3": "hers", "k4": "his"})
+    assert list(ac.finditer("ushers")) == [
+        ("k2", 1, 4),
+        ("k1", 2, 4),
+        ("k3", 2, 6),
+    ]
+    assert not list(ac.finditer("nothing to see"))
+
+
+def test_aho_corasick_agrees_with_find():
+    rng = random.Random(42)
+    words = {
+        i: "".join(rng.choice("ab") for _ in range(rng.randint(1, 5)))
+        for i in range(30)
+    }
+    ac = AhoCorasick(words)
+    text = "".join(rng.choice("abc") for _ in range(300))
+    expected = sorted(
+        (k, m.start(), m.start() + len(w))
+        for k, w in words.items()
+        for m in re.finditer(f"(?={w})", text)
+    )
+    assert sorted(ac.finditer(text)) == expected
+
+
+def test_required_literal():
+    assert required_literal(re.compile(r"\bkappa\d+")) == "kappa"
+    assert required_literal(re.compile(r"x(?:hello)+y")) == "hello"
+    assert required_literal(re.compile(r"ab(?i:CDEF)")) == "ab"
+    assert required_literal(re.compile(r"(ab)*c")) == "c"
+    assert required_literal(re.compile(r"a|b")) is None
+
+
+def test_pattern_matcher_case():
+    m = PatternMatcher(ignore_case=False)
+    m.add_literal("lit", "Kappa")
+    m.add_pattern("sensitive", r"Pog\d")
+    m.add_pattern("insensitive", re.compile(r"lul\d", re.I))
+    hits = m.find_all("kappa Kappa pog1 Pog2 LUL3")
+    assert sorted((h.key, h.text) for h in hits) == [
+        ("insensitive", "LUL3"),
+        ("lit", "Kappa"),
+        ("sensitive", "Pog2"),
+    ]
+
+
+def test_pattern_matcher():
+    m = PatternMatcher(whole_words=True)
+    m.add_literal("spam", "Buy Followers")
+    m.add_literal("ass", "ass")
+    m.add_pattern("cmd", r"^!(\w+)")
+    m.add_pattern("echo", r"(\w+) \1")
+
+    hits = m.find_all("!hello there, buy followers now, class class")
+    assert sorted((h.key, h.text) for h in hits) == [
+        ("cmd", "!hello"),
+        ("echo", "class class"),
+        ("spam", "buy followers"),
+    ]
+
+    m.remove("cmd")
+    m.add_literal("now", "now")
+    assert sorted(h.key for h in m.find_all("!hello buy followers now")) == [
+        "now",
+        "spam",
+    ]
+    assert m.search("nothing to see here") is None
+
+
+def test_pattern_matcher_overlaps():
+    m = PatternMatcher()
+    m.add_pattern("digits", r"\d+")
+    m.add_pattern("word", r"\w+")
+    assert sorted((h.key, h.start, h.text) for h in m.find_all("abc 123")) == [
+        ("digits", 4, "123"),
+        ("word", 0, "abc"),
+        ("word", 4, "123"),
+    ]
+
+    m = PatternMatcher()
+    m.add_pattern("cmd", r"^!\w+")
+    m.add_pattern("bang", r"!")
+    assert sorted((h.key, h.start, h.text) for h in m.find_all("!hello")) == [
+        ("bang", 0, "!"),
+        ("cmd", 0, "!hello"),
+    ]
+    assert m.find_all("hello") == []
+    assert [h.key for h in m.find_all("hi!")] == ["bang"]
+
+
+def test_match_handler():
+    mh = MatchHandler(ignore_case=True)
+    mh.on_literal("hi", "hiya", lambda r, h: f"PRIVMSG {r.channel} :hi {r.sender}")
+    mh.on_pattern("rut", r"RUT\?", lambda r, h: [f"one {h.start}", f"two {h.end}"])
+
+    hiya = grok(":jettero!~j@host PRIVMSG #twichat :HiYa")
+    assert mh.accept(hiya) == ["PRIVMSG #twichat :hi jettero"]
+
+    rut = grok(":jettero!~j@host PRIVMSG #twichat :RUT?")
+    assert mh(rut).send == ["one 0", "two 4"]
+
+    assert mh(grok(":jettero!~j@host JOIN #twichat")) is None
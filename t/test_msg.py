@@ -2,7 +2,8 @@
 # coding: utf-8
 
 import pytest
-from twichat.irc.msg import Message, NICK, TargetMessage
+from twichat.irc.msg import Message, NICK, TargetMessage, JOIN, PART, QUIT, CAP
+from twichat.const import CRLF, MAX_LINE_LENGTH
 
 
 def test_msg_basics():
@@ -42,3 +43,33 @@ def test_msg_tags():
         str(m0)
         == "@color=#FF0000;scooby=snacks PRIVMSG #channel :this is a red message"
     )
+
+
+def test_channel_list_msg():
+    assert str(JOIN("supz")) == "JOIN #supz"
+    assert str(JOIN("one", "#two", "&three")) == "JOIN #one,#two,&three"
+    assert str(PART("one", "two")) == "PART #one,#two"
+
+    with pytest.raises(ValueError):
+        JOIN()
+
+    channels = [f"channel{i:04d}" for i in range(500)]
+    batches = list(JOIN.batched(channels))
+    assert all(len(str(b)) + len(CRLF) <= MAX_LINE_LENGTH for b in batches)
+    assert [c for b in batches for c in b.channels] == ["#" + c for c in channels]
+    assert len(batches) == 14
+
+    batches = list(PART.batched(channels[:50], max_channels=20))
+    assert [len(b.channels) for b in batches] == [20, 20, 10]
+
+
+def test_quit_msg():
+    assert str(QUIT()) == "QUIT"
+    assert str(QUIT("see ya")) == "QUIT :see ya"
+
+
+def test_cap_msg():
+    assert str(CAP("LS", "302")) == "CAP LS 302"
+    assert str(CAP("req", "twitch.tv/tags")) == "CAP REQ :twitch.tv/tags"
+    assert str(CAP("REQ", "a", "b")) == "CAP REQ :a b"
+    assert str(CAP("END")) == "CAP END"
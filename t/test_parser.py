@@ -4,6 +4,8 @@
 import pytest
 
 from twichat.irc.parser import parse, ParsedReply, MarkedUnexpectedToken, MUT_MARK
+from twichat.irc.parser import FIELDS, RECORD, REPLY, Record, split_line, richest_mode
+from twichat.irc.reply import Reply, ReplyShapes, grok
 
 
 def test_can_parse(a_reply):
@@ -16,3 +18,75 @@ def test_cant_parse():
         parse("#broken")
 
     assert f'"#{MUT_MARK}broken"' in str(mut.value)
+
+
+def test_modes_agree(a_reply):
+    full = parse(a_reply.text)
+    tags, prefix, command, params = parse(a_reply.text, mode=FIELDS)
+    assert command == full.command.name
+    assert params == (full.params or [])
+
+    rec = parse(a_reply.text, mode=RECORD)
+    assert isinstance(rec, Record)
+    assert rec.command == full.command.name
+    assert rec.params == (full.params or [])
+    assert rec.tags == full.tags
+    assert rec.wire == a_reply.text
+    if full.origin:
+        assert rec.nick == full.origin.name
+        assert rec.user == (full.origin.user and full.origin.user.name)
+        assert rec.host == (full.origin.host and full.origin.host.name)
+    else:
+        assert prefix is None and rec.nick is None
+
+
+def test_split_line():
+    assert split_line("@a=b;c= :n!u@h PRIVMSG #c :hi :there") == (
+        "a=b;c=",
+        "n!u@h",
+        "PRIVMSG",
+        ["#c", "hi :there"],
+    )
+    assert split_line("PING tmi") == (None, None, "PING", ["tmi"])
+    for broken in ("@a=b", ":prefix", "", "@a=b :n!u@h "):
+        with pytest.raises(ValueError):
+            split_line(broken)
+
+
+def test_record():
+    rec = parse("@badges= :j!j@j.tmi.twitch.tv PRIVMSG #twichat :sup", mode=RECORD)
+    assert (rec.nick, rec.channel, rec.msg) == ("j", "#twichat", "sup")
+    assert rec.tags == {"badges": None}
+    assert not hasattr(rec, "__dict__")
+
+    rec = parse("PING :tmi.twitch.tv", mode=RECORD)
+    assert rec.channel is None and rec.msg is None
+
+    # msg means what Reply.msg means
+    line = ":x 353 j = #c :a b c"
+    assert parse(line, mode=RECORD).msg == grok(line).msg == "= #c a b c"
+
+
+def test_richest_mode():
+    assert richest_mode([]) is None
+    assert richest_mode([FIELDS]) == FIELDS
+    assert richest_mode([FIELDS, RECORD, FIELDS]) == RECORD
+    assert richest_mode([RECORD, REPLY]) == REPLY
+    with pytest.raises(ValueError):
+        parse("PING :x", mode="bogus")
+
+
+def test_derived_shapes(a_reply):
+    full = ReplyShapes(a_reply.text)
+    assert full[REPLY] == grok(a_reply.text)
+    # derived from the reply, they match what parsing in their mode gives
+    assert full[FIELDS] == split_line(a_reply.text)
+    rec, direct = full[RECORD], parse(a_reply.text, mode=RECORD)
+    for attr in Record.__slots__:
+        assert getattr(rec, attr) == getattr(direct, attr)
+    # the same as Reply.msg (reply classes like TOPIC reinterpret params)
+    assert rec.msg == Reply(*parse(a_reply.text)).msg
+
+    cheap = ReplyShapes(a_reply.text)
+    assert cheap[RECORD].fields() == cheap[FIELDS] == full[FIELDS]
+    assert REPLY not in cheap.shapes
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import json
+import time
+import signal
+import asyncio
+
+from twichat.loop import TWILoop
+from twichat.handlers import ReplyHandler
+from twichat.profiler import SamplingProfiler, frame_label
+
+from t.lib import FakeSock
+
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        sum(range(100))
+
+
+def test_frame_label():
+    label = frame_label(busy.__code__)
+    assert label == "t/test_profiler.py:busy"
+    assert frame_label(SamplingProfiler.sample.__code__).endswith(
+        "twichat/profiler.py:SamplingProfiler.sample"
+    )
+
+
+def test_sampling_profiler(tmp_path):
+    prof = SamplingProfiler(interval=0.001)
+    prof.start()
+    busy(0.2)
+    prof.stop()
+    assert not prof.running
+    assert prof.samples > 10
+
+    totals = prof.totals("busy")
+    assert totals["t/test_profiler.py:busy"] > prof.samples / 2
+
+    collapsed = prof.write_collapsed(tmp_path / "x.collapsed")
+    with open(collapsed) as fh:
+        lines = fh.read().splitlines()
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == prof.samples
+    assert any("test_sampling_profiler;t/test_profiler.py:busy" in l for l in lines)
+
+    with open(prof.write(tmp_path / "x.json", fmt="speedscope")) as fh:
+        doc = json.load(fh)
+    frames = [f["name"] for f in doc["shared"]["frames"]]
+    profile = doc["profiles"][0]
+    assert profile["type"] == "sampled"
+    assert len(profile["samples"]) == len(profile["weights"])
+    assert all(0 <= i < len(frames) for s in profile["samples"] for i in s)
+    assert "t/test_profiler.py:busy" in frames
+
+
+class Slow(ReplyHandler):
+    def accept(self, reply):
+        busy(0.05)
+
+
+def test_loop_profiling_by_signal(tmp_path):
+    lines = [f":j!j@j.tmi.twitch.tv PRIVMSG #twichat :{i}" for i in range(4)]
+
+    async def go():
+        loop = TWILoop(profile_signal=signal.SIGUSR2, profile_dir=tmp_path)
+        loop.profile_interval = 0.001
+        loop.sock = FakeSock(lines)
+        loop.handlers.append(Slow())
+        asyncio.get_running_loop().call_soon(os.kill, os.getpid(), signal.SIGUSR2)
+        await loop.run()
+        return loop
+
+    loop = asyncio.run(go())
+    assert not loop.profiling
+    written = list(tmp_path.iterdir())
+    assert len(written) == 1
+    assert written[0].name.endswith(".collapsed")
+    assert loop.profiler.totals(".accept")["t/test_profiler.py:Slow.accept"] > 0
+
+
+def test_profile_signal_reaches_every_bot(tmp_path):
+    lines = [f":j!j@j.tmi.twitch.tv PRIVMSG #twichat :{i}" for i in range(4)]
+    bots = [TWILoop(profile_signal=signal.SIGUSR2, profile_dir=tmp_path) for _ in "ab"]
+    for bot in bots:
+        bot.sock = FakeSock(lines)
+        bot.handlers.append(Slow())
+
+    async def go():
+        # once both bots are running (and have the signal handled)
+        asyncio.get_running_loop().call_later(
+            0.01, os.kill, os.getpid(), signal.SIGUSR2
+        )
+        await asyncio.gather(*(bot.run() for bot in bots))
+
+    asyncio.run(go())
+    assert all(bot.profiler is not None and not bot.profiling for bot in bots)
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_loop_profiling_api(tmp_path):
+    loop = TWILoop(profile_format="speedscope")
+    assert loop.stop_profiling() is None
+    loop.start_profiling(interval=0.001)
+    assert loop.profiling
+    busy(0.05)
+    path = loop.stop_profiling(path=tmp_path / "p.json")
+    assert not loop.profiling
+    with open(path) as fh:
+        assert json.load(fh)["profiles"][0]["samples"]
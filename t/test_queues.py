@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import asyncio
+import pytest
+
+from twichat.queues import (
+    InboundQueue,
+    OutboundQueue,
+    DurableOutboundQueue,
+    is_priority,
+)
+from twichat.loop import TWILoop
+from twichat.handlers import ReplyHandler, PingPong
+from twichat.irc.msg import PONG, TargetMessage, Message
+
+from t.lib import FakeSock
+
+PING = "PING :tmi.twitch.tv"
+
+
+def chat(i):
+    return f":a!a@a PRIVMSG #c :{i}"
+
+
+async def drain(q):
+    q.close()
+    return [line async for line in _lines(q)]
+
+
+async def _lines(q):
+    while True:
+        line = await q.get()
+        if line is None:
+            return
+        yield line
+
+
+def test_bad_policy():
+    with pytest.raises(ValueError):
+        InboundQueue(policy="yolo")
+
+
+def test_drop_oldest():
+    async def go():
+        q = InboundQueue(maxsize=3, policy=InboundQueue.DROP_OLDEST, priority=())
+        for line in (chat(0), PING, chat(1), chat(2), PING, PING, PING):
+            await q.put(line)
+        return q, await drain(q)
+
+    q, lines = asyncio.run(go())
+    # the chat lines made room for the PINGs, then there was no more chat to
+    # drop, but PING is never dropped so the queue went over maxsize
+    assert lines == [PING, PING, PING, PING]
+    assert q.stats()["dropped"] == 3
+
+    async def go2():
+        q = InboundQueue(maxsize=2, policy=InboundQueue.DROP_OLDEST, priority=())
+        for line in (PING, PING, chat(0)):
+            await q.put(line)
+        return q, await drain(q)
+
+    q, lines = asyncio.run(go2())
+    assert lines == [PING, PING]
+    assert q.dropped == 1
+
+
+def test_spill(tmp_path):
+    async def go():
+        q = InboundQueue(maxsize=2, policy=InboundQueue.SPILL, spill_dir=tmp_path)
+        for i in range(5):
+            await q.put(chat(i))
+        assert len(q) == 5
+        first = [await q.get(), await q.get(), await q.get()]
+        await q.put(chat(5))
+        return q, first + await drain(q)
+
+    q, lines = asyncio.run(go())
+    assert lines == [chat(i) for i in range(6)]
+    assert q.stats()["spilled"] == 4
+    assert len(q) == 0
+
+
+def test_block():
+    async def go():
+        q = InboundQueue(maxsize=1)
+        await q.put(chat(0))
+        putter = asyncio.ensure_future(q.put(chat(1)))
+        await asyncio.sleep(0)
+        assert not putter.done()
+        got = await q.get()
+        await putter
+        return [got] + await drain(q)
+
+    assert asyncio.run(go()) == [chat(0), chat(1)]
+
+
+def test_loop_reads_through_queue():
+    seen = list()
+
+    class Seen(ReplyHandler):
+        def accept(self, reply):
+            seen.append(reply.command.name)
+
+    loop = TWILoop(inbound=InboundQueue(maxsize=2, policy=InboundQueue.DROP_OLDEST))
+    loop.sock = FakeSock([PING, chat(0), ":tmi.twitch.tv 001 me :hi"])
+    loop.handlers.append(Seen())
+    loop.running = True
+    asyncio.run(loop.main())
+
+    assert seen == ["PING", "PRIVMSG", "001"]
+    assert loop.metrics()["inbound"]["received"] == 3
+    assert loop.sock.closed
+
+
+def test_is_priority():
+    assert is_priority(PING)
+    assert is_priority(PONG("tmi.twitch.tv"))
+    assert is_priority(Message("PONG", "x", tag="y"))
+    assert not is_priority(TargetMessage("#c", "hi"))
+    assert not is_priority(chat(0))
+
+
+def test_inbound_lanes():
+    async def go():
+        q = InboundQueue(maxsize=2, policy=InboundQueue.DROP_OLDEST)
+        for line in (chat(0), chat(1), chat(2), PING):
+            await q.put(line)
+        return q, await drain(q)
+
+    q, lines = asyncio.run(go())
+    assert lines == [PING, chat(1), chat(2)]
+    assert q.dropped == 1
+
+
+def test_outbound_lanes():
+    async def go():
+        q = OutboundQueue()
+        q.put(TargetMessage("#c", "one"))
+        q.put(TargetMessage("#c", "two"))
+        q.put(PONG("tmi.twitch.tv"))
+        q.close()
+        out = list()
+        while (m := await q.get()) is not None:
+            out.append(str(m))
+        return out
+
+    assert asyncio.run(go()) == [
+        "PONG tmi.twitch.tv",
+        "PRIVMSG #c :one",
+        "PRIVMSG #c :two",
+    ]
+
+
+def test_loop_answers_ping_first():
+    handled = list()
+
+    class Chatty(ReplyHandler):
+        def accept(self, reply):
+            handled.append(reply.command.name)
+            if reply.command.name == "PRIVMSG":
+                return TargetMessage(reply.target, "echo")
+
+    async def readline():
+        # everything arrives at once, so it's all queued by the time the
+        # dispatcher gets to it
+        return loop.sock.lines.pop(0) if loop.sock.lines else ""
+
+    loop = TWILoop()
+    loop.sock = FakeSock([chat(0), chat(1), PING])
+    loop.sock.readline = readline
+    loop.handlers.append(Chatty())
+    loop.handlers.append(PingPong())
+    loop.running = True
+    asyncio.run(loop.main())
+
+    assert handled == ["PING", "PRIVMSG", "PRIVMSG"]
+    assert loop.sock.sent == [
+        "PONG tmi.twitch.tv",
+        "PRIVMSG #c :echo",
+        "PRIVMSG #c :echo",
+    ]
+
+
+async def send_all(q, ack=True, confirm=True, limit=None):
+    # what TWILoop's writer does, with a write buffer that empties at once
+    out = list()
+    while (limit is None or len(out) < limit) and (m := await q.get()) is not None:
+        out.append(str(m))
+        if ack:
+            q.ack()
+            if confirm:
+                q.confirm()
+    return out
+
+
+def test_durable_replays_unacked(tmp_path):
+    path = str(tmp_path / "out.q")
+
+    async def first():
+        q = DurableOutboundQueue(path, ack_every=1)
+        for i in range(5):
+            q.put(TargetMessage("#c", f"m{i}"))
+        q.put(PONG("tmi.twitch.tv"))
+        # the PONG, then two acked, then one sent but never acked
+        assert await send_all(q, limit=3) == [
+            "PONG tmi.twitch.tv",
+            "PRIVMSG #c :m0",
+            "PRIVMSG #c :m1",
+        ]
+        assert await send_all(q, ack=False, limit=1) == ["PRIVMSG #c :m2"]
+        # and the process dies without closing anything
+
+    asyncio.run(first())
+
+    async def second():
+        q = DurableOutboundQueue(path)
+        assert q.replayed == 3
+        q.close()
+        return await send_all(q)
+
+    # control messages aren't journaled
+    assert asyncio.run(second()) == [
+        "PRIVMSG #c :m2",
+        "PRIVMSG #c :m3",
+        "PRIVMSG #c :m4",
+    ]
+
+
+def test_durable_batches_and_compacts(tmp_path):
+    path = str(tmp_path / "out.q")
+    q = DurableOutboundQueue(path, batch_size=3, ack_every=100, compact_size=50)
+    lines = ["PRIVMSG #c :one", "PRIVMSG #c :two", "PRIVMSG #c :three"]
+    q.put(lines[0])
+    q.put(lines[1])
+    assert os.path.getsize(path) == 0
+    q.put(lines[2])
+    with open(path) as fh:
+        assert fh.read() == "\n".join(lines) + "\n"
+    q.close()
+    assert asyncio.run(send_all(q)) == [
+        "PRIVMSG #c :one",
+        "PRIVMSG #c :two",
+        "PRIVMSG #c :three",
+    ]
+    # the marker went out when the queue ran dry, and the journal was compacted
+    assert os.path.getsize(path) == 0
+    assert q.stats()["unacked"] == 0
+    q.release()
+    assert DurableOutboundQueue(path).replayed == 0
+
+
+def test_loop_resends_after_reconnect(tmp_path):
+    path = str(tmp_path / "out.q")
+
+    class ClosedSock(FakeSock):
+        async def send(self, line):
+            return False
+
+    loop = TWILoop(outbound=DurableOutboundQueue(path))
+    loop.sock = ClosedSock([])
+    loop.send(TargetMessage("#c", "important"))
+    asyncio.run(loop.run())
+    assert loop.sock.sent == []
+
+    loop.sock = FakeSock([])
+    asyncio.run(loop.run())
+    assert loop.sock.sent == ["PRIVMSG #c :important"]
+    assert loop.outbound.stats()["unacked"] == 0
+
+
+def test_durable_needs_confirmation(tmp_path):
+    path = str(tmp_path / "out.q")
+
+    async def first():
+        q = DurableOutboundQueue(path, ack_every=1)
+        for i in range(3):
+            q.put(f"PRIVMSG #c :m{i}")
+        await send_all(q, limit=1)
+        # written, but still in the transport's buffer when we die
+        await send_all(q, confirm=False, limit=1)
+        q.sync()
+
+    asyncio.run(first())
+    q = DurableOutboundQueue(path)
+    assert list(q.messages) == ["PRIVMSG #c :m1", "PRIVMSG #c :m2"]
+
+
+def test_durable_torn_line(tmp_path):
+    path = str(tmp_path / "out.q")
+    with open(path, "wb") as fh:
+        fh.write(b"PRIVMSG #c :whole\nPRIVMSG #c :tor")
+    q = DurableOutboundQueue(path)
+    assert list(q.messages) == ["PRIVMSG #c :whole"]
+    q.put("PRIVMSG #c :next")
+    q.release()
+    with open(path, "rb") as fh:
+        assert fh.read() == b"PRIVMSG #c :whole\nPRIVMSG #c :next\n"
+
+
+def test_loop_confirms_only_flushed_writes(tmp_path):
+    path = str(tmp_path / "out.q")
+
+    class Backlogged(FakeSock):
+        # everything sits in the transport's buffer
+        def write_buffer_size(self):
+            return 100
+
+    loop = TWILoop(outbound=DurableOutboundQueue(path), shutdown_timeout=0.05)
+    loop.sock = Backlogged([])
+    loop.send(TargetMessage("#c", "buffered"))
+    asyncio.run(loop.run())
+    assert loop.sock.sent == ["PRIVMSG #c :buffered"]
+    loop.outbound.release()
+
+    assert list(DurableOutboundQueue(path).messages) == ["PRIVMSG #c :buffered"]
@@ -11,8 +11,8 @@ RS = "\x1e"  # \x1e is the ASCII record separator
 
 
 @pytest.fixture(scope="module")
-def file_rawlog():
-    yield RawLog("t/output/raw.log", mode="w")
+def file_rawlog(tmp_path_factory):
+    yield RawLog(str(tmp_path_factory.mktemp("output") / "raw.log"), mode="w")
 
 
 @pytest.fixture(scope="module")
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# coding: utf-8
+# pylint: disable=redefined-outer-name
+
+import re
+import pytest
+
+from twichat.irc.reply import grok
+from twichat.irc.msg import TargetMessage
+from twichat.handlers import ReplyHandler, HandlerResult
+from twichat.routing import Filter, FilteredHandler, Router, combine_patterns
+
+BITS = grok(
+    "@badge-info=;badges=staff/1,bits/1000;bits=100;mod=0;subscriber=0 "
+    ":ronni!ronni@ronni.tmi.twitch.tv PRIVMSG #ronni :cheer100"
+)
+HIYA = grok(":jettero!~jettero@pdpc/supporter/active/jettero PRIVMSG #twichat :hiya")
+JOIN = grok(":jettero!~jettero@pdpc/supporter/active/jettero JOIN #twichat")
+
+
+class Recorder(FilteredHandler):
+    def __init__(self, name, flt=None):
+        super().__init__(flt)
+        self.name = name
+        self.seen = list()
+
+    def accept(self, reply):
+        self.seen.append(reply)
+        return TargetMessage(reply.target, self.name)
+
+
+def test_filter_matches():
+    assert Filter().matches(HIYA)
+    assert Filter(command="privmsg").matches(HIYA)
+    assert not Filter(command="JOIN").matches(HIYA)
+    assert Filter(channel="twichat").matches(JOIN)
+    assert not Filter(channel={"#one", "#two"}).matches(JOIN)
+    assert Filter(sender="Jettero").matches(HIYA)
+    assert Filter(tags={"mod": "0", "bits": True}).matches(BITS)
+    assert not Filter(tags={"mod": "1"}).matches(BITS)
+    assert not Filter(tags={"mod": "0"}).matches(HIYA)
+    assert Filter(text=[r"^cheer\d+", "nope"]).matches(BITS)
+    assert Filter(text=re.compile("HIYA", re.I)).matches(HIYA)
+    assert not Filter(text="hiya").matches(JOIN)
+
+
+def test_combine_patterns():
+    c = combine_patterns([re.compile("a"), re.compile("B", re.I)])
+    assert c.search("xbx") and c.search("xax") and not c.search("xcx")
+    assert combine_patterns([re.compile(r"(a)\1")]) is None
+
+
+@pytest.fixture
+def router():
+    r = Router()
+    r.add(Recorder("all-privmsg", Filter(command="PRIVMSG")))
+    r.add(Recorder("ronni-cheers", Filter(channel="ronni", text=r"cheer\d+")))
+    r.add(Recorder("joins", Filter(command="JOIN")))
+    r.add(Recorder("mods", Filter(command="PRIVMSG", tags={"mod": "1"})))
+    return r
+
+
+def test_router(router):
+    hr = router(BITS)
+    assert [str(m) for m in hr.send] == [
+        "PRIVMSG #ronni :all-privmsg",
+        "PRIVMSG #ronni :ronni-cheers",
+    ]
+
+    hr = router(HIYA)
+    assert [str(m) for m in hr.send] == ["PRIVMSG #twichat :all-privmsg"]
+
+    hr = router(JOIN)
+    assert [str(m) for m in hr.send] == ["PRIVMSG #twichat :joins"]
+
+    assert router(grok(":tmi.twitch.tv 001 someone :Welcome, GLHF!")) is None
+
+
+def test_router_agrees_with_filters(router, a_reply):
+    reply = grok(a_reply.text)
+    expected = [r.handler.name for r in router.routes if r.filter.matches(reply)]
+    hr = router(reply)
+    got = [str(m).split(":")[-1] for m in hr.send] if hr else list()
+    assert got == expected
+
+
+def test_router_done_and_stop():
+    class Once(ReplyHandler):
+        def __call__(self, reply):
+            return HandlerResult(send="once", done=True, stop_handles=True)
+
+        def accept(self, reply):
+            pass
+
+    r = Router()
+    r.add(Once())
+    r.add(Recorder("second"))
+    hr = r(HIYA)
+    assert hr.send == ["once"] and hr.stop_handles
+    assert len(r) == 1
+    hr = r(HIYA)
+    assert [str(m) for m in hr.send] == ["PRIVMSG #twichat :second"]
+
+
+def test_router_text_one_scan(mocker):
+    r = Router()
+    r.add(Recorder("cmd", Filter(text=r"^!\w+")))
+    r.add(Recorder("bang", Filter(text="!")))
+    r.add(Recorder("hello", Filter(text=["nope", "hello"])))
+    r.add(Recorder("kappa", Filter(text="kappa")))
+    # the filters' own patterns are never searched
+    mocker.patch.object(Filter, "match_text", side_effect=AssertionError)
+    hr = r(grok(":j!j@j PRIVMSG #twichat :!hello there"))
+    assert [str(m).split(":")[-1] for m in hr.send] == ["cmd", "bang", "hello"]
+    assert r.text_hits("hi KAPPA kappa") == {4}
+    assert r.text_hits("nothing") == set()
+
+
+def test_router_text_uncombinable():
+    r = Router()
+    r.add(Recorder("echo", Filter(text=r"(\w+) \1")))
+    r.add(Recorder("hi", Filter(text="hi")))
+    assert [str(m) for m in r(HIYA).send] == ["PRIVMSG #twichat :hi"]
+    assert r.text_hits("hi hi") is None
+    hr = r(grok(":j!j@j PRIVMSG #c :hi hi"))
+    assert [str(m) for m in hr.send] == ["PRIVMSG #c :echo", "PRIVMSG #c :hi"]
+
+
+def test_router_handler_errors(caplog):
+    class Broken(ReplyHandler):
+        def accept(self, reply):
+            raise ValueError("oops")
+
+    r = Router()
+    r.add(Broken())
+    r.add(Recorder("after"))
+    assert [str(m) for m in r.accept(HIYA)] == ["PRIVMSG #twichat :after"]
+    assert "oops" in caplog.text
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import pytest
+
+from twichat.loop import TWILoop
+from twichat.supervisor import Supervisor
+from twichat.handlers import PingPong, ReplyHandler
+
+from t.lib import FakeSock
+
+PING = "PING :tmi.twitch.tv"
+
+
+def bot(nick, lines):
+    b = TWILoop(nick=nick, passwd="oauth:x")
+    b.sock = FakeSock(lines)
+    b.handlers.append(PingPong())
+    return b
+
+
+def test_many_bots_one_loop():
+    sup = Supervisor(restart=False)
+    for i in range(10):
+        sup.add(bot(f"bot{i}", [PING]))
+    with pytest.raises(ValueError):
+        sup.add(bot("bot0", []))
+
+    asyncio.run(sup.run())
+
+    assert len(sup) == 10
+    for i in range(10):
+        assert sup[f"bot{i}"].sock.sent == ["PONG tmi.twitch.tv"]
+    m = sup.metrics()
+    assert not m["bot3"]["running"]
+    assert m["bot3"]["inbound"]["received"] == 1
+
+
+class Refill(FakeSock):
+    # every reconnect gets another PING
+    starts = 0
+
+    async def start(self):
+        self.starts += 1
+        self.lines = [PING]
+
+
+def test_restart():
+    sup = Supervisor(min_delay=0)
+    b = TWILoop(nick="phoenix")
+    b.sock = Refill([])
+    registered = list()
+    b.sock.register = lambda **kw: registered.append(kw["nick"])
+
+    class StopAfter(ReplyHandler):
+        seen = 0
+
+        def accept(self, reply):
+            self.seen += 1
+            if self.seen == 3:
+                sup.stop("phoenix")
+
+    b.handlers.append(StopAfter())
+    sup.add(b)
+    asyncio.run(sup.run())
+
+    assert b.sock.starts == 3
+    assert sup.restarts["phoenix"] == 2
+    # every connection registers again
+    assert registered == ["phoenix"] * 3
+
+
+def test_await_bot():
+    b = bot("solo", [PING])
+
+    async def go():
+        await b
+
+    asyncio.run(go())
+    assert b.sock.sent == ["PONG tmi.twitch.tv"]
+
+
+def test_stop_during_shutdown():
+    class SlowSock(FakeSock):
+        async def send(self, line):
+            await asyncio.sleep(0.05)
+            return await super().send(line)
+
+    class Bye(ReplyHandler):
+        def accept(self, reply):
+            b.stop("see ya")
+            # the supervisor is told while the bot is shutting down
+            asyncio.get_running_loop().call_later(0.01, sup.stop, "slow")
+
+    sup = Supervisor(restart=False)
+    b = TWILoop(nick="slow", shutdown_timeout=5)
+    b.sock = SlowSock([PING])
+    b.handlers.append(Bye())
+    sup.add(b)
+    asyncio.run(sup.run())
+
+    # the shutdown wasn't cut short
+    assert b.sock.sent == ["QUIT :see ya"]
+    assert b.shutdown_report["cancelled"] == 0
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from twichat.irc.reply import grok
+from twichat.irc.tags import decode_badges, decode_emote_ranges, decode_emotes, Emote
+
+PREFIX = ":nick!nick@nick.tmi.twitch.tv PRIVMSG #chan"
+
+
+def test_badges():
+    reply = grok(f"@badge-info=subscriber/8;badges=subscriber/6,bits/100 {PREFIX} :hi")
+    assert dict(reply.badges) == {"subscriber": "6", "bits": "100"}
+    assert dict(reply.badge_info) == {"subscriber": "8"}
+    assert "moderator" not in reply.badges
+
+    # decoded once per distinct string, and shared (read-only) after that
+    other = grok("@badges=subscriber/6,bits/100 :other!o@o PRIVMSG #chan :yo")
+    assert other.badges is reply.badges
+    assert not other.badge_info
+
+    assert not grok(f"@badges= {PREFIX} :hi").badges
+    assert not grok(f"{PREFIX} :hi").badges
+    assert dict(decode_badges("moderator/1,,broadcaster/1")) == {
+        "moderator": "1",
+        "broadcaster": "1",
+    }
+
+
+def test_emotes():
+    reply = grok(f"@emotes=25:0-4,12-16/1902:6-10 {PREFIX} :Kappa Keepo Kappa")
+    assert reply.emotes == (
+        Emote("25", 0, 5, "Kappa"),
+        Emote("1902", 6, 11, "Keepo"),
+        Emote("25", 12, 17, "Kappa"),
+    )
+    assert reply.emotes is reply.emotes
+
+    # Twitch counts code points, so an emoji (one code point, but two UTF-16
+    # units and four UTF-8 bytes) before the emote doesn't throw it off
+    reply = grok(f"@emotes=25:2-6 {PREFIX} :\U0001f600 Kappa \U0001f600")
+    assert [e.text for e in reply.emotes] == ["Kappa"]
+
+    reply = grok(f"@emotes=25:0-4 {PREFIX} :\x01ACTION Kappa dances\x01")
+    assert [e.text for e in reply.emotes] == ["Kappa"]
+
+    assert grok(f"@emotes= {PREFIX} :Kappa").emotes == ()
+    assert grok(f"{PREFIX} :Kappa").emotes == ()
+
+
+def test_emote_ranges():
+    assert decode_emote_ranges("25:0-4,12-16/1902:6-10") == (
+        ("25", 0, 5),
+        ("1902", 6, 11),
+        ("25", 12, 17),
+    )
+    assert decode_emote_ranges("25:x-4,4-1,0-2") == (("25", 0, 3),)
+    # ranges past the end of the message are skipped
+    assert decode_emotes("25:0-4,6-99", "Kappa Kappa") == (Emote("25", 0, 5, "Kappa"),)
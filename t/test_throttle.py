@@ -3,7 +3,7 @@
 
 from time import time as now
 import pytest
-from twichat.throttle import Throttle, OverThrottle
+from twichat.throttle import Throttle, OverThrottle, RateCounter
 
 NOW = now()
 
@@ -53,3 +53,40 @@ def test_memory_throttle(mocker):
 
     assert t0.count == 0
     assert len(t0.ticks) == 0
+
+
+def test_rate_counter(mocker):
+    fake_time = [1000.0]
+    mocker.patch("time.time", lambda: fake_time[0])
+
+    rc = RateCounter(interval_in_seconds=10, max_keys=3)
+    assert rc.hit("a") == 1
+    assert rc.hit("a", 2) == 3
+    assert rc.count("a") == 3
+    assert rc.count("nobody") == 0
+
+    # halfway into the next interval, half of the previous one still counts
+    fake_time[0] = 1015.0
+    assert rc.count("a") == 1.5
+    assert rc.hit("a") == 2.5
+
+    # two intervals later, it's all gone
+    fake_time[0] = 1030.0
+    assert rc.count("a") == 0
+
+    rc.hit("b")
+    rc.hit("c")
+    rc.hit("d")
+    assert "a" not in rc  # least recently hit
+    assert rc.evicted == 1
+    assert len(rc) == 3
+
+    fake_time[0] = 1050.0
+    rc.hit("c")
+    assert rc.expire() == 2
+    assert list(rc._keys) == ["c"]  # pylint: disable=protected-access
+
+    rc.hit("c", 3)
+    rc.hit("e")
+    assert rc.decay(0.5) == 1
+    assert rc.count("c") == 2 and "e" not in rc
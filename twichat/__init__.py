@@ -2,3 +2,4 @@
 
 from .irc.reply import grok
 from .loop import TWILoop
+from .supervisor import Supervisor
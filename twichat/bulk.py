@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Parse big RawLog files in parallel.
+
+The file is memory mapped and cut into line aligned chunks; the chunks are
+parsed in a pool of processes and the results come back, in file order, as
+columnar batches:
+
+    for batch in parse_log("chat.log", workers=8):
+        batch.channel    # ['#twichat', None, …]
+        batch.user       # ['jettero', 'tmi.twitch.tv', …]
+        batch.command    # ['PRIVMSG', '001', …]
+        batch.timestamp  # array('q', [1607899999000, -1, …]) (tmi-sent-ts, ms)
+        batch.errors     # lines that didn't parse
+
+or, from the command line, as JSON lines:
+
+    python -m twichat.bulk chat.log --workers 8 > chat.jsonl
+
+Lines RawLog wrote for what we sent (#SEND# …) and blank lines are skipped.
+"""
+
+import os
+import sys
+import mmap
+import json
+import argparse
+from array import array
+from collections import namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .irc.parser import split_line
+
+CHUNK_SIZE = 4 * 1024 * 1024
+SEND_MARK = b"#SEND# "
+
+Batch = namedtuple("Batch", ["channel", "user", "command", "timestamp", "errors"])
+
+
+def chunk_offsets(path, chunk_size=CHUNK_SIZE):
+    """
+    (start, end) byte offsets of roughly chunk_size pieces of the file, each
+    ending just after a newline (or at the end of the file).
+    """
+    size = os.path.getsize(path)
+    if not size:
+        return list()
+    offsets = list()
+    with open(path, "rb") as fh, mmap.mmap(
+        fh.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        start = 0
+        while start < size:
+            end = mm.find(b"\n", min(start + chunk_size, size) - 1)
+            end = size if end < 0 else end + 1
+            offsets.append((start, end))
+            start = end
+    return offsets
+
+
+def iter_chunk_lines(path, start, end):
+    with open(path, "rb") as fh, mmap.mmap(
+        fh.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        data = mm[start:end]
+    for line in data.split(b"\n"):
+        line = line.rstrip(b"\r")
+        if line and not line.startswith(SEND_MARK):
+            yield line.decode("utf-8", errors="replace")
+
+
+def sent_ts(tags):
+    """
+    The tmi-sent-ts of a raw (unparsed) tags string, or -1.
+    """
+    if tags:
+        for tag in tags.split(";"):
+            name, _, value = tag.partition("=")
+            if name == "tmi-sent-ts":
+                try:
+                    return int(value or -1)
+                except ValueError:
+                    break
+    return -1
+
+
+def line_columns(line):
+    """
+    (channel, user, command, timestamp) of a line. These only need the raw
+    fields, so the line is cut with split_line() rather than parsed by the
+    grammar.
+    """
+    tags, prefix, command, params = split_line(line)
+    channel = params[0] if params and params[0][:1] in ("#", "&") else None
+    user = prefix.partition("!")[0].partition("@")[0] if prefix else None
+    return channel, user, command, sent_ts(tags)
+
+
+def parse_chunk(job):
+    path, start, end = job
+    batch = Batch(list(), list(), list(), array("q"), list())
+    for line in iter_chunk_lines(path, start, end):
+        try:
+            channel, user, command, ts = line_columns(line)
+        except Exception:  # pylint: disable=broad-except
+            batch.errors.append(line)
+            continue
+        batch.channel.append(channel)
+        batch.user.append(user)
+        batch.command.append(command)
+        batch.timestamp.append(ts)
+    return batch
+
+
+def parse_log(path, workers=None, chunk_size=CHUNK_SIZE, window=None):
+    """
+    Generate a Batch per chunk of the log, in file order. workers is the
+    number of processes (default: one per CPU); with workers=1, everything
+    happens in this process.
+
+    At most window chunks (default: two per worker) are in flight at once, so
+    a slow consumer doesn't end up with the whole file's batches in memory.
+    """
+    jobs = [(path, start, end) for start, end in chunk_offsets(path, chunk_size)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(jobs) <= 1:
+        yield from map(parse_chunk, jobs)
+        return
+    if window is None:
+        window = 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = iter(jobs)
+        pending = deque()
+        for job in jobs:
+            pending.append(pool.submit(parse_chunk, job))
+            if len(pending) >= window:
+                break
+        while pending:
+            batch = pending.popleft().result()
+            job = next(jobs, None)
+            if job is not None:
+                pending.append(pool.submit(parse_chunk, job))
+            yield batch
+
+
+def batch_rows(batch):
+    for row in zip(batch.channel, batch.user, batch.command, batch.timestamp):
+        yield dict(zip(("channel", "user", "command", "timestamp"), row))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Parse a RawLog in parallel")
+    ap.add_argument("logfile")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    ap.add_argument(
+        "--format",
+        choices=("jsonl", "columns"),
+        default="jsonl",
+        help="a JSON object per line, or per batch (of column arrays)",
+    )
+    ap.add_argument("--output", type=str, default="-")
+    args = ap.parse_args(argv)
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    errors = 0
+    try:
+        for batch in parse_log(args.logfile, args.workers, args.chunk_size):
+            errors += len(batch.errors)
+            if args.format == "columns":
+                cols = batch._asdict()
+                cols["timestamp"] = batch.timestamp.tolist()
+                cols["errors"] = len(batch.errors)
+                out.write(json.dumps(cols) + "\n")
+            else:
+                out.writelines(json.dumps(row) + "\n" for row in batch_rows(batch))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if errors:
+        print(f"{errors} lines didn't parse", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
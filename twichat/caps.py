@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+IRCv3 capability negotiation, folded into registration.
+
+With caps given, TWILoop sends CAP LS before PASS/USER/NICK, asks for
+whichever of the wanted capabilities the server offers, and doesn't hand
+any lines to the handlers until the server has ACKed or NAKed them. So by
+the time a handler sees the 001 welcome, loop.capabilities says what
+there is (e.g., whether every PRIVMSG will have tags):
+
+    loop = TWILoop(nick=..., passwd=..., caps=TWITCH_CAPS + IRCV3_CAPS)
+    ...
+    if "twitch.tv/tags" in loop.capabilities:
+        ...
+
+twichat.loop.twitch() asks for twitch.tv/tags, twitch.tv/commands and
+twitch.tv/membership (plus batch and message-tags, where offered) by
+default.
+"""
+
+import logging
+
+from .irc.msg import CAP
+
+log = logging.getLogger(__name__)
+
+
+def cap_names(text):
+    # CAP LS 302 lists may carry values: "sasl=PLAIN,EXTERNAL"
+    return [cap.split("=", 1)[0] for cap in text.split()]
+
+
+class CapNegotiator:
+    """
+    Keeps track of one negotiation. start() gives the messages to send
+    first; feed() takes each reply and gives whatever should be sent next.
+    Once done is set, acked, nakked and available are final.
+
+    Servers that don't know CAP either say so (421), or just ignore it and
+    welcome us (001); either way we're done with no capabilities.
+    """
+
+    def __init__(self, wanted):
+        self.wanted = tuple(wanted)
+        self.available = set()
+        self.acked = set()
+        self.nakked = set()
+        self.pending = set()
+        self.listed = False
+        self.done = False
+
+    def start(self):
+        return [CAP("LS", "302")]
+
+    def finish(self, why):
+        log.debug("finish() %s, acked=%s nakked=%s", why, self.acked, self.nakked)
+        self.done = True
+        return [CAP("END")]
+
+    def feed(self, reply):
+        if self.done:
+            return list()
+        name = reply.command.name
+        if name == "CAP" and len(reply.params) >= 3:
+            sub = reply.params[1].upper()
+            if sub == "LS":
+                return self.ls(reply.params)
+            if sub in ("ACK", "NAK"):
+                caps = cap_names(reply.params[-1])
+                (self.acked if sub == "ACK" else self.nakked).update(caps)
+                self.pending.difference_update(caps)
+                if not self.pending:
+                    return self.finish("answered")
+        elif name == "421" and "CAP" in reply.params:
+            self.done = True
+        elif name == "001" and not self.listed:
+            self.done = True
+        return list()
+
+    def ls(self, params):
+        self.available.update(cap_names(params[-1]))
+        if len(params) > 3 and params[2] == "*":
+            # more of the list to come
+            return list()
+        self.listed = True
+        self.pending = set(c for c in self.wanted if c in self.available)
+        if not self.pending:
+            return self.finish("nothing we want")
+        return [CAP("REQ", *(c for c in self.wanted if c in self.pending))]
+
+    def give_up(self):
+        """
+        Called when the server takes too long to answer.
+        """
+        if self.done:
+            return list()
+        self.nakked.update(self.pending)
+        self.pending = set()
+        return self.finish("timed out")
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Columnar storage of replies, for analytics over a lot of chat.
+
+A Reply costs several hundred bytes (the namedtuples, the params list, the
+tags dict, …). ReplyColumns keeps just what analysis usually wants, one
+array per field:
+
+    timestamp :- int64 milliseconds (tmi-sent-ts, or when it was appended)
+    channel   :- int32 codes into cols.channels (dictionary encoded; -1 for none)
+    user      :- int32 codes into cols.users
+    command   :- int32 codes into cols.commands
+    text      :- every message's text in one UTF-8 buffer (a bytearray), with
+                 text_offsets (n+1 of them) marking where each row's bytes
+                 start and end; text(row) decodes just that row
+    emotes    :- emote codes (into cols.emote_ids) for all rows, with
+                 emote_offsets marking each row's share
+
+    cols = ReplyColumns()
+    cols.extend(replies)
+    cols.per_minute()     # {'#twichat': {1607899980000: 12, …}, …}
+    cols.top_users(10)    # [('jettero', 1234), …]
+    cols.emote_counts(10) # [('25', 999), …]
+
+The columns are stdlib arrays. When numpy is installed, to_numpy() gives
+(zero copy) numpy views of them and the aggregations above use numpy too.
+"""
+
+import time
+from array import array
+from collections import Counter
+
+from .irc.reply import ChannelMessage
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+class Categories:
+    """
+    Dictionary encoding: each distinct value gets the next integer code.
+    None is always -1.
+    """
+
+    def __init__(self):
+        self.codes = dict()
+        self.values = list()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, code):
+        return None if code < 0 else self.values[code]
+
+    def code(self, value):
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def reply_timestamp(reply, default):
+    tags = reply.tags
+    if tags:
+        ts = tags.get("tmi-sent-ts")
+        if ts:
+            try:
+                return int(ts)
+            except ValueError:
+                pass
+    return default
+
+
+def _most_common(counts, n=None):
+    # like Counter.most_common(), but ties go to the lower code (the value
+    # seen first), which is what the numpy versions do
+    return sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:n]
+
+
+class ReplyColumns:
+    def __init__(self):
+        self.timestamp = array("q")
+        self.channel = array("i")
+        self.user = array("i")
+        self.command = array("i")
+        self.text_offsets = array("q", [0])
+        self.emote = array("i")
+        self.emote_offsets = array("q", [0])
+        self.channels = Categories()
+        self.users = Categories()
+        self.commands = Categories()
+        self.emote_ids = Categories()
+        self.buffer = bytearray()
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def append(self, reply, when=None):
+        """
+        Add a (grokked) reply. when (epoch milliseconds) is used if the reply
+        has no tmi-sent-ts tag; the default is now.
+        """
+        if when is None:
+            when = int(time.time() * 1000)
+        self.timestamp.append(reply_timestamp(reply, when))
+        self.channel.append(self.channels.code(getattr(reply, "channel", None)))
+        self.user.append(self.users.code(reply.origin.name if reply.origin else None))
+        self.command.append(self.commands.code(reply.command.name))
+        msg = reply.msg if isinstance(reply, ChannelMessage) else None
+        if msg:
+            self.buffer += msg.encode("utf-8")
+            self.text_offsets.append(len(self.buffer))
+            for emote in reply.emotes:
+                self.emote.append(self.emote_ids.code(emote.id))
+        else:
+            self.text_offsets.append(self.text_offsets[-1])
+        self.emote_offsets.append(len(self.emote))
+
+    def extend(self, replies, when=None):
+        for reply in replies:
+            self.append(reply, when=when)
+        return self
+
+    def text(self, row):
+        start, end = self.text_offsets[row], self.text_offsets[row + 1]
+        return self.buffer[start:end].decode("utf-8")
+
+    def row(self, row):
+        return dict(
+            timestamp=self.timestamp[row],
+            channel=self.channels[self.channel[row]],
+            user=self.users[self.user[row]],
+            command=self.commands[self.command[row]],
+            text=self.text(row),
+            emotes=[
+                self.emote_ids[c]
+                for c in self.emote[
+                    self.emote_offsets[row] : self.emote_offsets[row + 1]
+                ]
+            ],
+        )
+
+    def to_numpy(self):
+        """
+        numpy views of the columns (they share memory with the arrays, so
+        don't append while using them).
+        """
+        if numpy is None:
+            raise RuntimeError("numpy is not installed")
+        return dict(
+            timestamp=numpy.frombuffer(self.timestamp, dtype=numpy.int64),
+            channel=numpy.frombuffer(self.channel, dtype=numpy.int32),
+            user=numpy.frombuffer(self.user, dtype=numpy.int32),
+            command=numpy.frombuffer(self.command, dtype=numpy.int32),
+            text_offsets=numpy.frombuffer(self.text_offsets, dtype=numpy.int64),
+            emote=numpy.frombuffer(self.emote, dtype=numpy.int32),
+            emote_offsets=numpy.frombuffer(self.emote_offsets, dtype=numpy.int64),
+        )
+
+    def _rows(self, command, channel=None):
+        """
+        A numpy mask (or a list of row numbers without numpy) of the rows
+        with the given command (and channel).
+        """
+        cmd = self.commands.codes.get(command, -2) if command else None
+        chan = self.channels.codes.get(channel, -2) if channel else None
+        if numpy is not None:
+            cols = self.to_numpy()
+            mask = numpy.ones(len(self), dtype=bool)
+            if cmd is not None:
+                mask &= cols["command"] == cmd
+            if chan is not None:
+                mask &= cols["channel"] == chan
+            return mask
+        return [
+            i
+            for i in range(len(self))
+            if (cmd is None or self.command[i] == cmd)
+            and (chan is None or self.channel[i] == chan)
+        ]
+
+    def per_minute(self, command="PRIVMSG"):
+        """
+        {channel: {minute (epoch ms): rows}} for the rows with command.
+        """
+        res = dict()
+        if numpy is not None:
+            cols = self.to_numpy()
+            mask = self._rows(command)
+            minutes = cols["timestamp"][mask] // 60000 * 60000
+            pairs = numpy.stack((cols["channel"][mask].astype(numpy.int64), minutes))
+            if not pairs.size:
+                return res
+            keys, counts = numpy.unique(pairs, axis=1, return_counts=True)
+            for (chan, minute), count in zip(keys.T.tolist(), counts.tolist()):
+                res.setdefault(self.channels[chan], dict())[minute] = count
+            return res
+        counts = Counter(
+            (self.channel[i], self.timestamp[i] // 60000 * 60000)
+            for i in self._rows(command)
+        )
+        for (chan, minute), count in sorted(counts.items()):
+            res.setdefault(self.channels[chan], dict())[minute] = count
+        return res
+
+    def top_users(self, n=10, channel=None, command="PRIVMSG"):
+        """
+        The n users with the most rows (with command, in channel), as
+        (user, count) pairs, most first.
+        """
+        if numpy is not None:
+            users = self.to_numpy()["user"][self._rows(command, channel)]
+            users = users[users >= 0]
+            if not users.size:
+                return list()
+            counts = numpy.bincount(users)
+            top = numpy.argsort(-counts, kind="stable")[:n]
+            return [(self.users[u], int(counts[u])) for u in top.tolist() if counts[u]]
+        counts = Counter(
+            self.user[i] for i in self._rows(command, channel) if self.user[i] >= 0
+        )
+        return [(self.users[u], count) for u, count in _most_common(counts, n)]
+
+    def emote_counts(self, n=None):
+        """
+        (emote id, times used) pairs, most used first.
+        """
+        if numpy is not None:
+            emotes = self.to_numpy()["emote"]
+            if not emotes.size:
+                return list()
+            counts = numpy.bincount(emotes)
+            top = numpy.argsort(-counts, kind="stable")[:n]
+            return [(self.emote_ids[e], int(counts[e])) for e in top.tolist()]
+        counts = Counter(self.emote)
+        return [(self.emote_ids[e], count) for e, count in _most_common(counts, n)]
+
+
+def columnize(replies, batch_size=None, when=None):
+    """
+    Turn a stream of replies into ReplyColumns; all of them at once, or a
+    ReplyColumns every batch_size replies (each with its own dictionaries).
+    """
+    if not batch_size:
+        yield ReplyColumns().extend(replies, when=when)
+        return
+    cols = ReplyColumns()
+    for reply in replies:
+        cols.append(reply, when=when)
+        if len(cols) >= batch_size:
+            yield cols
+            cols = ReplyColumns()
+    if len(cols):
+        yield cols
@@ -7,6 +7,19 @@ import uuid
 CRLF = "\x0d\x0a"
 WS = "\x20\x09" + CRLF
 
+# RFC1459 limits a line to 512 bytes, and that includes the trailing CRLF
+MAX_LINE_LENGTH = 512
+
+# Commands that keep the connection alive (or tell us about its state). These
+# are never dropped from the inbound queue, even when it's overflowing.
+CONTROL_COMMANDS = frozenset(
+    ("PING", "PONG", "RECONNECT", "CAP", "001", "NOTICE", "ERROR")
+)
+
+# IRCv3 capabilities we ask for, when the server offers them
+TWITCH_CAPS = ("twitch.tv/tags", "twitch.tv/commands", "twitch.tv/membership")
+IRCV3_CAPS = ("batch", "message-tags")
+
 TWITCH_HOST = "irc.chat.twitch.tv"
 TWITCH_PORT = 6697
 
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Raids and spam waves send the same text thousands of times. Pure handlers
+split their work into a classify() that only looks at the text of the
+message and a respond() for the reply at hand; the verdicts are cached by
+normalized text so repeated copies skip the expensive part:
+
+    class Classify(PureReplyHandler):
+        def classify(self, reply):
+            ...  # something slow that only looks at reply.msg
+
+        def respond(self, reply, verdict):
+            ...  # what to say in reply.channel (to reply.sender)
+
+    loop = TWILoop(..., dedup=DedupCache(ttl=60, maxsize=10000))
+    loop.handlers.append(Classify())
+    ...
+    loop.dedup.stats()  # → {'hits': 9000, 'misses': 1000, 'size': 1000, ...}
+"""
+
+import re
+import time
+from collections import OrderedDict
+
+# Twitch refuses to relay the same message twice in a row from one user, so
+# chat clients tack invisible characters onto repeats to get around that.
+_INVISIBLE = re.compile("[\u200b-\u200f\u2060\ufeff\U000e0000-\U000e007f]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """
+    Lowercase the text, drop the invisible characters clients use to dodge
+    duplicate message checks, and collapse whitespace.
+    """
+    text = _INVISIBLE.sub("", text.casefold())
+    return _SPACES.sub(" ", text).strip()
+
+
+class DedupCache:
+    """
+    A TTL and size bounded cache of handler verdicts (what classify()
+    returned) keyed by the handler and the normalized text of the reply
+    (plus the command, and the channel if with_channel is set). Verdicts
+    don't say anything about where to reply, so by default the same text
+    shares one verdict across channels.
+
+    Entries are kept in least recently used order; when there are more than
+    maxsize of them, the least recently used are dropped. Expired entries
+    are dropped when they're looked up.
+    """
+
+    def __init__(self, ttl=60, maxsize=10000, with_channel=False):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.with_channel = with_channel
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.expired = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, reply):
+        msg = getattr(reply, "msg", None)
+        if not msg:
+            return None
+        channel = getattr(reply, "channel", None) if self.with_channel else None
+        return (reply.command.name, channel, normalize_text(msg))
+
+    def classify(self, handler, reply, key=None):
+        """
+        Return handler.classify(reply), from the cache if the same
+        (normalized) text was classified recently. key is self.key(reply),
+        if that's already been worked out.
+        """
+        if key is None:
+            key = self.key(reply)
+        if key is None:
+            return handler.classify(reply)
+        key = (handler, key)
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry[1]
+            self.expired += 1
+            del self.entries[key]
+        self.misses += 1
+        res = handler.classify(reply)
+        self.entries[key] = (now + self.ttl, res)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return res
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        looked = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            expired=self.expired,
+            size=len(self.entries),
+            hit_rate=self.hits / looked if looked else 0.0,
+        )
+
+    def __repr__(self):
+        s = self.stats()
+        return f"DedupCache(hits={s['hits']}, misses={s['misses']}, size={s['size']})"
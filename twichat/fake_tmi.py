@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+A small stand-in for Twitch's chat server (TMI), for integration tests and
+load tests of the real client stack without touching the network:
+
+    server = FakeTMI(members={"#twichat": ["alice", "bob"]})
+    await server.start()
+    bot = TWILoop(host="127.0.0.1", port=server.port, use_ssl=False, nick="bot")
+    ...
+    server.firehose("#twichat", rate=5000, count=100000)  # synthetic chat
+    server.reconnect()                                     # RECONNECT everyone
+    await server.stop()
+
+It speaks just enough of TMI: PASS/NICK registration with the usual 001-376
+welcome, CAP LS/REQ (ACK or NAK), JOIN with 353/366 names, PART, PING/PONG
+both ways, and a PRIVMSG rate limit that drops (and NOTICEs about) messages
+over the limit, the way Twitch does.
+
+It can also be run on its own:
+
+    python -m twichat.fake_tmi --port 6667 --firehose '#twichat:1000'
+"""
+
+import asyncio
+import logging
+import argparse
+
+from .const import CRLF, WS, TWITCH_CAPS
+from .irc.msg import channel_name
+from .throttle import RateCounter
+
+log = logging.getLogger(__name__)
+
+SERVER = "tmi.twitch.tv"
+
+
+class FakeClient:
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.nick = self.passwd = None
+        self.registered = False
+        self.caps = set()
+        self.channels = set()
+        self.received = list()
+        self.pongs = 0
+
+    @property
+    def prefix(self):
+        return f":{self.nick}!{self.nick}@{self.nick}.{SERVER}"
+
+    def write(self, line):
+        if not self.writer.is_closing():
+            self.writer.write((line + CRLF).encode("utf-8"))
+
+    def numeric(self, num, *params):
+        self.write(f":{SERVER} {num} {self.nick} " + " ".join(params))
+
+    def close(self):
+        if not self.writer.is_closing():
+            self.writer.close()
+
+
+class FakeTMI:
+    """
+    Options:
+
+        host, port     :- where to listen (port 0 picks a free port; see .port)
+        passwd         :- if given, PASS must match or login fails
+        caps           :- capabilities CAP REQ will ACK; anything else is NAKed
+        members        :- {channel: [nicks]} for the 353 names on JOIN
+        names_per_line :- nicks per 353 line
+        ping_interval  :- seconds between the server's PINGs (None for never)
+        rate_limit     :- (messages, seconds) a client may send PRIVMSGs at
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        passwd=None,
+        caps=TWITCH_CAPS,
+        members=None,
+        names_per_line=100,
+        ping_interval=None,
+        rate_limit=(20, 30),
+    ):
+        self.host = host
+        self.port = port
+        self.passwd = passwd
+        self.caps = frozenset(caps)
+        self.members = {channel_name(c): list(n) for c, n in (members or {}).items()}
+        self.names_per_line = names_per_line
+        self.ping_interval = ping_interval
+        self.rate_limit = rate_limit
+        self.rates = RateCounter(rate_limit[1]) if rate_limit else None
+        self.clients = list()
+        self.connections = 0
+        self.rate_limited = 0
+        self.fired = 0
+        self.server = None
+        self.tasks = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        log.debug("start() listening on %s:%d", self.host, self.port)
+        return self
+
+    async def stop(self):
+        for task in tuple(self.tasks):
+            task.cancel()
+        for client in self.clients:
+            client.close()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def serve(self, reader, writer):
+        client = FakeClient(self, reader, writer)
+        self.clients.append(client)
+        self.connections += 1
+        pinger = self.spawn(self.ping(client)) if self.ping_interval else None
+        try:
+            while not writer.is_closing():
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode("utf-8").rstrip(WS)
+                if line:
+                    client.received.append(line)
+                    self.handle(client, line)
+                    await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            if pinger is not None:
+                pinger.cancel()
+            client.close()
+            self.clients.remove(client)
+
+    async def ping(self, client):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            client.write(f"PING :{SERVER}")
+
+    def handle(self, client, line):
+        words = line.split(" ")
+        if words[0].startswith("@"):
+            words = words[1:]
+        cmd, args = words[0].upper(), words[1:]
+        trailing = None
+        for idx, arg in enumerate(args):
+            if arg.startswith(":"):
+                trailing = " ".join(args[idx:])[1:]
+                args = args[:idx]
+                break
+        method = getattr(self, f"on_{cmd.lower()}", None)
+        if method is None:
+            client.numeric("421", cmd, ":Unknown command")
+        else:
+            method(client, args, trailing)
+
+    def on_pass(self, client, args, trailing):
+        client.passwd = trailing if trailing is not None else args[0]
+
+    def on_user(self, client, args, trailing):
+        pass
+
+    def on_nick(self, client, args, trailing):
+        client.nick = (trailing if trailing is not None else args[0]).lower()
+        if self.passwd is not None and client.passwd != self.passwd:
+            client.write(f":{SERVER} NOTICE * :Login authentication failed")
+            client.close()
+            return
+        client.registered = True
+        client.numeric("001", ":Welcome, GLHF!")
+        client.numeric("002", f":Your host is {SERVER}")
+        client.numeric("003", ":This server is rather new")
+        client.numeric("004", ":-")
+        client.numeric("375", ":-")
+        client.numeric("372", ":You are in a maze of twisty passages, all alike.")
+        client.numeric("376", ":>")
+
+    def on_cap(self, client, args, trailing):
+        sub = args[0].upper() if args else ""
+        if sub == "LS":
+            client.write(f":{SERVER} CAP * LS :" + " ".join(sorted(self.caps)))
+        elif sub == "REQ":
+            wanted = (trailing or "").split()
+            if all(cap in self.caps for cap in wanted):
+                client.caps.update(wanted)
+                client.write(f":{SERVER} CAP * ACK :" + " ".join(wanted))
+            else:
+                client.write(f":{SERVER} CAP * NAK :" + " ".join(wanted))
+
+    def on_ping(self, client, args, trailing):
+        client.write(f":{SERVER} PONG {SERVER} :{trailing or ' '.join(args)}")
+
+    def on_pong(self, client, args, trailing):
+        client.pongs += 1
+
+    def on_join(self, client, args, trailing):
+        channels = trailing if trailing is not None else args[0]
+        for channel in channels.split(","):
+            channel = channel.lower()
+            client.channels.add(channel)
+            client.write(f"{client.prefix} JOIN {channel}")
+            nicks = [client.nick] + self.members.get(channel, [])
+            for i in range(0, len(nicks), self.names_per_line):
+                chunk = " ".join(nicks[i : i + self.names_per_line])
+                client.numeric("353", "=", channel, f":{chunk}")
+            client.numeric("366", channel, ":End of /NAMES list")
+
+    def on_part(self, client, args, trailing):
+        channels = trailing if trailing is not None else args[0]
+        for channel in channels.split(","):
+            channel = channel.lower()
+            client.channels.discard(channel)
+            client.write(f"{client.prefix} PART {channel}")
+
+    def on_privmsg(self, client, args, trailing):
+        if self.rates is None:
+            return
+        if self.rates.hit(client) > self.rate_limit[0]:
+            self.rate_limited += 1
+            client.write(
+                f"@msg-id=msg_ratelimit :{SERVER} NOTICE {args[0]} :Your message "
+                "was not sent because you are sending messages too quickly."
+            )
+
+    def on_quit(self, client, args, trailing):
+        client.close()
+
+    def broadcast(self, line, channel=None):
+        """
+        Send a line to every registered client (in channel, if given).
+        """
+        for client in self.clients:
+            if client.registered and (channel is None or channel in client.channels):
+                client.write(line)
+
+    def reconnect(self):
+        """
+        Tell every client to RECONNECT (and hang up on them, like TMI does).
+        """
+        for client in tuple(self.clients):
+            client.write(f":{SERVER} RECONNECT")
+            client.close()
+
+    def chat(self, channel, nick, msg, tags=None):
+        channel = channel_name(channel).lower()
+        prefix = f":{nick}!{nick}@{nick}.{SERVER}"
+        if tags is not None:
+            prefix = "@" + ";".join(f"{k}={v}" for k, v in tags.items()) + " " + prefix
+        self.broadcast(f"{prefix} PRIVMSG {channel} :{msg}", channel)
+        self.fired += 1
+
+    def firehose(self, channel, rate, count=None, duration=None, tags=None):
+        """
+        Start sending synthetic chat to channel at about rate lines per second
+        (in bursts of up to a tenth of a second's worth), until count lines
+        or duration seconds. Returns the task.
+        """
+        return self.spawn(self._firehose(channel, rate, count, duration, tags))
+
+    async def _firehose(self, channel, rate, count, duration, tags):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        sent = 0
+        while count is None or sent < count:
+            elapsed = loop.time() - started
+            if duration is not None and elapsed >= duration:
+                break
+            due = int(elapsed * rate) + 1 - sent
+            if count is not None:
+                due = min(due, count - sent)
+            for _ in range(max(0, due)):
+                self.chat(channel, f"chatter{sent % 997}", f"message {sent}", tags)
+                sent += 1
+            # let the writers drain before the next burst
+            for client in self.clients:
+                if not client.writer.is_closing():
+                    await client.writer.drain()
+            await asyncio.sleep(min(0.1, max(0.001, 1.0 / rate)))
+        return sent
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--host", type=str, default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=6667)
+    ap.add_argument("--passwd", type=str, default=None)
+    ap.add_argument("--ping-interval", type=float, default=None)
+    ap.add_argument(
+        "--firehose",
+        type=str,
+        action="append",
+        default=list(),
+        help="channel:rate, send synthetic chat to channel at rate lines per second",
+    )
+    args = ap.parse_args()
+
+    async def run():
+        server = FakeTMI(
+            host=args.host,
+            port=args.port,
+            passwd=args.passwd,
+            ping_interval=args.ping_interval,
+        )
+        await server.start()
+        print(f"listening on {server.host}:{server.port}")
+        for spec in args.firehose:
+            channel, rate = spec.rsplit(":", 1)
+            server.firehose(channel, float(rate))
+        await server.server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
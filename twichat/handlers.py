@@ -2,8 +2,14 @@
 # coding: utf-8
 
 import os
+import asyncio
+from itertools import islice
 from abc import abstractmethod, ABC
-from .irc.msg import JOIN, PONG
+from .irc.msg import JOIN, PONG, channel_name
+from .irc.intern import intern_name
+from .irc.reply import Arrive, Depart, NameList, EndNameList, ChannelMessage
+from .irc.parser import REPLY
+from .throttle import Throttle, OverThrottle, RateCounter
 
 from .const import WS
 
@@ -27,6 +33,20 @@ class HandlerResult:
             # or maybe join two channels
             send3 = [ JOIN('blah'), JOIN('bleak') ]
 
+            send can also be an async generator, in which case the mainloop
+            sends each item as it's yielded. This is handy for things that
+            have to be spread out over time (e.g., rate limits).
+
+            async def slowly():
+                for c in channels:
+                    yield JOIN(c)
+                    await asyncio.sleep(1)
+            send4 = slowly()
+
+            A generator that has to wait a long time between items can
+            yield None now and then; nothing is sent, but the mainloop gets
+            to stop it if the bot is shutting down meanwhile.
+
     done :- tell the mainloop the handler is done, meaning it should not be
             given further messages. Note that the twichat.loop.TWILoop object
             (at the time of this writing anyway) removes the handler from its
@@ -57,6 +77,15 @@ class HandlerResult:
 
 
 class BaseHandler(ABC):
+    # see PureReplyHandler
+    pure = False
+
+    # what accept() gets: the full reply (REPLY), or, for handlers that can
+    # make do with less, a Record or raw fields (see twichat.irc.parser); the
+    # loop parses each line once, in the richest mode any handler wants, and
+    # derives the others from that (only REPLY handlers use the dedup cache)
+    reply_mode = REPLY
+
     @abstractmethod
     def accept(self, reply):
         return "something to send"
@@ -104,6 +133,108 @@ class ReplyHandler(BaseHandler):
     """
 
 
+class PureReplyHandler(ReplyHandler):
+    """
+    A ReplyHandler split in two: classify(reply), the expensive part, which
+    may only look at the text of the message, and respond(reply, verdict),
+    which turns the verdict into whatever to send for this particular reply
+    (its channel, its sender, …).
+
+        class NoSpam(PureReplyHandler):
+            def classify(self, reply):
+                return model.is_spam(reply.msg)
+
+            def respond(self, reply, verdict):
+                if verdict:
+                    return TargetMessage(reply.channel, f"/timeout {reply.sender} 60")
+
+    When the loop has a dedup cache (see twichat.dedup.DedupCache), repeated
+    copies of the same text reuse the cached verdict instead of calling
+    classify() again; respond() is called for every reply.
+
+    Any handler with classify() and respond() can claim this by setting the
+    class attribute pure = True.
+    """
+
+    pure = True
+
+    @abstractmethod
+    def classify(self, reply):
+        return "a verdict about reply.msg"
+
+    def respond(self, reply, verdict):
+        return verdict
+
+    def accept(self, reply):
+        return self.respond(reply, self.classify(reply))
+
+
+class BatchReplyHandler(ABC):
+    """
+    Handles replies in batches: TWILoop collects the replies this handler
+    wants() and calls accept_batch() with up to batch_size of them at once,
+    or with whatever it has once the oldest has waited max_delay seconds.
+    With per_channel, each channel gets batches of its own.
+
+        class Scorer(BatchReplyHandler):
+            batch_size = 100
+            max_delay = 0.5
+
+            def accept_batch(self, replies):
+                scores = model.score([r.msg for r in replies])
+                return [f"PRIVMSG {r.channel} :/timeout {r.origin.name}"
+                        if s > 0.9 else None
+                        for r, s in zip(replies, scores)]
+
+    accept_batch() can return None, a list with a result per reply (each
+    like what accept() returns: nothing, something to send, or a
+    HandlerResult), or a single HandlerResult for the whole batch. Batched
+    replies have already been through the other handlers, so stop_handles
+    means nothing here; done and stop_mainloop work as usual.
+    """
+
+    batch_size = 100
+    max_delay = 0.25
+    per_channel = False
+    # see BaseHandler; with anything but REPLY, override wants() and key()
+    reply_mode = REPLY
+
+    def __init__(self, batch_size=None, max_delay=None, per_channel=None):
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if max_delay is not None:
+            self.max_delay = max_delay
+        if per_channel is not None:
+            self.per_channel = per_channel
+        self.pending = dict()
+        self.timers = dict()
+
+    def wants(self, reply):
+        return isinstance(reply, ChannelMessage)
+
+    def key(self, reply):
+        return reply.channel if self.per_channel else None
+
+    def add(self, reply):
+        """
+        Queue reply; returns its batch key and whether that batch is now full.
+        """
+        key = self.key(reply)
+        batch = self.pending.setdefault(key, list())
+        batch.append(reply)
+        return key, len(batch) >= self.batch_size
+
+    def take(self, key):
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        return self.pending.pop(key, None) or list()
+
+    @abstractmethod
+    def accept_batch(self, replies):
+        return ["something to send for each reply"]
+
+
 class WaitSendOnceHandler(ReplyHandler):
     """
     A ReplyHandler that only fires one time. That is, if a message is actually
@@ -137,6 +268,392 @@ class JoinChannel(WaitSendOnceHandler):
             return self.join_msg
 
 
+class JoinChannels(ReplyHandler):
+    """
+    Like JoinChannel, but for lots of channels. After the server says welcome
+    (see JoinChannel), the channels are packed into as few comma separated
+    JOIN lines as possible and sent no faster than the JOIN rate limit allows.
+
+    Twitch counts each channel in a JOIN as one attempt against the limit.
+    The default (20 per 10 seconds) is the limit for normal accounts; verified
+    bots are allowed quite a lot more.
+
+        h = JoinChannels(['one', 'two', 'three'], items_per_interval=20, interval_in_seconds=10)
+
+    Throttles share their counts by name, process wide, and the limit is
+    per account, so the throttle is named after the nick (e.g.
+    "JOIN/jettero"); unless nick is given, it's taken from the welcome. Bots
+    on different accounts (say, under one twichat.supervisor.Supervisor)
+    each get their own budget, while handlers on the same account share one.
+
+    The handler tracks which channels the server confirmed (with a JOIN echo
+    or the end of the NAMES list) in h.confirmed and which it refused (e.g.
+    403 no such channel) in h.failed. It announces it's done when every
+    channel has landed in one or the other.
+    """
+
+    # numeric replies that mean a JOIN was refused; the channel is params[1]
+    refusals = {"403", "405", "471", "473", "474", "475", "476"}
+
+    def __init__(
+        self,
+        channels,
+        items_per_interval=20,
+        interval_in_seconds=10,
+        name="JOIN",
+        nick=None,
+    ):
+        # an insertion ordered dict drops the repeats without a list search
+        self.channels = list(dict.fromkeys(channel_name(c).lower() for c in channels))
+        self.name = name
+        self.items_per_interval = items_per_interval
+        self.interval_in_seconds = interval_in_seconds
+        self.throttle = None
+        if nick:
+            self.use_throttle_for(nick)
+        self.started = False
+        self.requested = set()
+        self.confirmed = set()
+        self.failed = set()
+
+    @property
+    def complete(self):
+        return len(self.confirmed) + len(self.failed) >= len(self.channels)
+
+    async def join_all(self):
+        for msg in JOIN.batched(self.channels, max_channels=self.throttle.limit):
+            owed = len(msg.channels)
+            while owed:
+                if self.throttle.count + owed > self.throttle.limit:
+                    # nothing to send yet, but let the loop stop us if it's quitting
+                    yield None
+                    await asyncio.sleep(1)
+                    continue
+                try:
+                    while owed:
+                        self.throttle.tick()
+                        owed -= 1
+                except OverThrottle:
+                    # someone else sharing the throttle (e.g., through its
+                    # file) beat us to it; wait for room for the rest
+                    pass
+            self.requested.update(msg.channels)
+            yield msg
+
+    def use_throttle_for(self, nick):
+        self.throttle = Throttle(
+            f"{self.name}/{nick.lower()}",
+            self.items_per_interval,
+            self.interval_in_seconds,
+        )
+
+    def resolve(self, channel, into):
+        channel = channel.lower()
+        if channel in self.requested:
+            into.add(channel)
+
+    def accept(self, reply):
+        name = reply.command.name
+        if not self.started:
+            if name in ("001", "MODE"):
+                self.started = True
+                if self.throttle is None:
+                    # both are addressed to us: ":tmi.twitch.tv 001 jettero :Welcome…"
+                    nick = reply.params[0] if reply.params else f"{id(self):x}"
+                    self.use_throttle_for(nick)
+                return self.join_all()
+            return None
+        if isinstance(reply, (Arrive, EndNameList)):
+            self.resolve(reply.channel, self.confirmed)
+        elif name in self.refusals and len(reply.params) > 1:
+            self.resolve(reply.params[1], self.failed)
+        elif name == "NOTICE" and reply.tags:
+            if reply.tags.get("msg-id") == "msg_channel_suspended":
+                self.resolve(reply.target, self.failed)
+        return None
+
+    def __call__(self, reply):
+        send = self.accept(reply)
+        done = self.started and self.complete
+        if send or done:
+            return HandlerResult(send=send, done=done)
+
+
+class NamesCollector(ReplyHandler):
+    """
+    The NAMES list for a channel arrives as any number of 353 lines (one
+    per few hundred nicks) and ends with a 366. This adds the nicks from
+    each line straight into one insertion ordered dict (used as a set) per
+    channel and calls on_names(channel, nicks) once, at the 366:
+
+        nc = NamesCollector(on_names=lambda channel, nicks: print(channel, len(nicks)))
+        loop.handlers.append(nc)
+
+    Channels and nicks are lowercased and interned (see twichat.irc.intern),
+    and no per-nick objects are made along the way. If max_names is given,
+    a channel's list never holds more than that many nicks; the earliest
+    are evicted first and counted in nc.evicted[channel].
+    """
+
+    def __init__(self, on_names=None, max_names=None):
+        self.on_names = on_names
+        self.max_names = max_names
+        self.pending = dict()
+        self.evicted = dict()
+
+    @staticmethod
+    def normalize(name):
+        return intern_name(name.lower())
+
+    def add(self, channel, nicks):
+        channel = self.normalize(channel)
+        pending = self.pending.setdefault(channel, dict())
+        for nick in nicks:
+            pending[self.normalize(nick)] = None
+        if self.max_names is not None and len(pending) > self.max_names:
+            extra = len(pending) - self.max_names
+            for nick in list(islice(pending, extra)):
+                del pending[nick]
+            self.evicted[channel] = self.evicted.get(channel, 0) + extra
+
+    def end(self, channel):
+        """
+        Finish the channel's list and return it (a dict of nicks).
+        """
+        return self.pending.pop(self.normalize(channel), dict())
+
+    def forget(self, channel):
+        channel = self.normalize(channel)
+        self.pending.pop(channel, None)
+        self.evicted.pop(channel, None)
+
+    def accept(self, reply):
+        if isinstance(reply, NameList):
+            self.add(reply.channel, reply.iter_names())
+        elif isinstance(reply, EndNameList):
+            nicks = self.end(reply.channel)
+            if callable(self.on_names):
+                self.on_names(self.normalize(reply.channel), nicks.keys())
+
+
+class ChannelMembers(ReplyHandler):
+    """
+    Keeps track of who is in which channel, incrementally, using JOIN, PART,
+    QUIT and the NAMES list (353 ... 366) replies.
+
+        cm = ChannelMembers(max_nicks=10000)
+        loop.handlers.append(cm)
+        ...
+        if cm.is_present('#twichat', 'jettero'):
+            ...
+
+    Channels and nicks are lowercased and interned (see twichat.irc.intern),
+    and each channel's members are kept in an insertion ordered dict (used
+    as a set) so membership checks are O(1); a reverse index (nick to
+    channels) does the same for channels_of() and QUIT. A channel never
+    holds more than max_nicks nicks (None for no limit); the nicks that
+    arrived longest ago are evicted first and counted in cm.evicted[channel].
+
+    Note that Twitch only sends JOIN/PART for other users when the
+    twitch.tv/membership capability was requested, and it stops sending
+    NAMES lists for channels with more than 1000 chatters.
+
+    Optionally provide callbacks for changes:
+
+        on_snapshot(channel, nicks) :- called at the end of each NAMES list
+                                       (366) with the complete membership
+        on_diff(channel, added, removed) :- called with the nicks that were
+                                            added and removed by any update
+    """
+
+    def __init__(self, max_nicks=10000, on_snapshot=None, on_diff=None):
+        self.max_nicks = max_nicks
+        self.on_snapshot = on_snapshot
+        self.on_diff = on_diff
+        self.nick = None
+        self.members = dict()
+        self.nick_channels = dict()
+        self.names_lists = NamesCollector(max_names=max_nicks)
+        self.evicted = dict()
+
+    normalize = staticmethod(NamesCollector.normalize)
+
+    def is_present(self, channel, nick):
+        members = self.members.get(channel.lower())
+        return members is not None and nick.lower() in members
+
+    def members_of(self, channel):
+        return self.members.get(channel.lower(), dict()).keys()
+
+    def count(self, channel):
+        return len(self.members.get(channel.lower(), ()))
+
+    def channels_of(self, nick):
+        return list(self.nick_channels.get(nick.lower(), ()))
+
+    def _link(self, channel, nick):
+        self.nick_channels.setdefault(nick, dict())[channel] = None
+
+    def _unlink(self, channel, nick):
+        channels = self.nick_channels.get(nick)
+        if channels is not None:
+            channels.pop(channel, None)
+            if not channels:
+                del self.nick_channels[nick]
+
+    def _add(self, members, channel, nick):
+        if nick in members:
+            return False
+        members[nick] = None
+        self._link(channel, nick)
+        if self.max_nicks is not None and len(members) > self.max_nicks:
+            oldest = next(iter(members))
+            del members[oldest]
+            self._unlink(channel, oldest)
+            self.evicted[channel] = self.evicted.get(channel, 0) + 1
+        return True
+
+    def _diff(self, channel, added=(), removed=()):
+        if callable(self.on_diff) and (added or removed):
+            self.on_diff(channel, added, removed)
+
+    def arrive(self, channel, nick):
+        channel, nick = self.normalize(channel), self.normalize(nick)
+        members = self.members.setdefault(channel, dict())
+        if self._add(members, channel, nick):
+            self._diff(channel, added=(nick,))
+
+    def depart(self, channel, nick):
+        channel, nick = self.normalize(channel), self.normalize(nick)
+        if nick == self.nick:
+            # we left, so we won't hear about this channel anymore
+            members = self.members.pop(channel, dict())
+            for member in members:
+                self._unlink(channel, member)
+            self.names_lists.forget(channel)
+            self.evicted.pop(channel, None)
+            self._diff(channel, removed=tuple(members))
+        else:
+            members = self.members.get(channel, dict())
+            if nick in members:
+                del members[nick]
+                self._unlink(channel, nick)
+                self._diff(channel, removed=(nick,))
+
+    def quit(self, nick):
+        nick = self.normalize(nick)
+        # QUIT doesn't name any channels; the reverse index knows them
+        for channel in self.nick_channels.pop(nick, ()):
+            del self.members[channel][nick]
+            self._diff(channel, removed=(nick,))
+
+    def names(self, channel, nicks):
+        self.names_lists.add(channel, nicks)
+
+    def end_of_names(self, channel):
+        channel = self.normalize(channel)
+        snapshot = self.names_lists.end(channel)
+        evicted = self.names_lists.evicted.pop(channel, 0)
+        if evicted:
+            self.evicted[channel] = self.evicted.get(channel, 0) + evicted
+        old = self.members.get(channel, dict())
+        self.members[channel] = snapshot
+        if callable(self.on_snapshot):
+            self.on_snapshot(channel, snapshot.keys())
+        added = tuple(n for n in snapshot if n not in old)
+        removed = tuple(n for n in old if n not in snapshot)
+        for nick in added:
+            self._link(channel, nick)
+        for nick in removed:
+            self._unlink(channel, nick)
+        self._diff(channel, added=added, removed=removed)
+
+    def accept(self, reply):
+        name = reply.command.name
+        if name == "001" and reply.params:
+            self.nick = self.normalize(reply.target)
+        elif isinstance(reply, Arrive):
+            self.arrive(reply.channel, reply.joiner)
+        elif isinstance(reply, Depart):
+            if name == "QUIT":
+                self.quit(reply.leaver)
+            else:
+                self.depart(reply.channel, reply.leaver)
+        elif isinstance(reply, NameList):
+            self.names(reply.channel, reply.iter_names())
+        elif isinstance(reply, EndNameList):
+            self.end_of_names(reply.channel)
+
+
+class FloodDetector(ReplyHandler):
+    """
+    Counts channel messages per sender (and per channel) and flags senders
+    who go over limit messages in interval_in_seconds.
+
+        def timeout(reply, count):
+            return TargetMessage(reply.channel, f"/timeout {reply.sender} 60")
+
+        fd = FloodDetector(limit=20, interval_in_seconds=30, on_flood=timeout)
+        loop.handlers.append(fd)
+
+    on_flood(reply, count) is called for every message over the limit and
+    whatever it returns is sent. The flagged (channel, sender) pairs (or just
+    senders, with per_channel=False) are also kept in fd.flagged until they
+    calm down.
+
+    All the counting is done with RateCounters (see twichat.throttle), so
+    each message costs O(1) no matter how many chatters there are, and at
+    most max_keys senders are remembered. fd.channel_rate(channel) gives the
+    message rate of each channel over the same window.
+    """
+
+    # expire idle senders after this many messages
+    expire_every = 1000
+
+    def __init__(
+        self,
+        limit=20,
+        interval_in_seconds=30,
+        per_channel=True,
+        max_keys=100000,
+        on_flood=None,
+    ):
+        self.limit = limit
+        self.per_channel = per_channel
+        self.on_flood = on_flood
+        self.senders = RateCounter(interval_in_seconds, max_keys=max_keys)
+        self.channels = RateCounter(interval_in_seconds, max_keys=max_keys)
+        self.flagged = set()
+        self._seen = 0
+
+    def key(self, reply):
+        if self.per_channel:
+            return (reply.channel, reply.sender)
+        return reply.sender
+
+    def channel_rate(self, channel):
+        return self.channels.count(channel)
+
+    def accept(self, reply):
+        if not isinstance(reply, ChannelMessage):
+            return None
+        self._seen += 1
+        if self._seen % self.expire_every == 0:
+            self.senders.expire()
+            self.channels.expire()
+            self.flagged = set(k for k in self.flagged if k in self.senders)
+        self.channels.hit(reply.channel)
+        key = self.key(reply)
+        count = self.senders.hit(key)
+        if count <= self.limit:
+            self.flagged.discard(key)
+            return None
+        self.flagged.add(key)
+        if callable(self.on_flood):
+            return self.on_flood(reply, count)
+        return None
+
+
 class PingPong(ReplyHandler):
     def accept(self, reply):
         if reply.command.name == "PING":
@@ -194,6 +711,11 @@ class RawLog(RawHandler):
     def format_message(self, message):
         return str(message).rstrip(WS) + self.line_ending
 
+    def flush(self):
+        # TWILoop.shutdown() calls this on its way out
+        if self.fh is not None:
+            self.fh.flush()
+
     def __call__(self, message):
         # NOTE: open(name,'a') defaults to line buffering so there's no reason
         # to flush the write or anything like that. Note also that write()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+A bounded, shared history of channel chat.
+
+Handlers that want context ("the last 20 messages in #channel", "has this
+nick said anything in the last five minutes") can ask the loop's history
+instead of keeping their own (unbounded) lists of replies:
+
+    loop = TWILoop(..., history=ChatHistory(per_channel=500, max_records=200000))
+    ...
+    loop.history.last("#twichat", 20)
+    loop.history.spoke_within("#twichat", "jettero", 300)
+"""
+
+import time
+from array import array
+from collections import namedtuple, deque, OrderedDict
+
+from .irc.reply import ChannelMessage
+
+Record = namedtuple("Record", ["seq", "when", "nick", "msg"])
+
+
+class ChannelRing:
+    """
+    A ring of (at most capacity) Records for one channel.
+
+    The slots (a list for the records and an array of floats for their
+    times) grow as records arrive, until there are capacity of them, so a
+    channel that only ever sees a few messages only costs a few slots. Each
+    record has a sequence number; the ring holds the sequence numbers
+    [first, next). A per-nick index of sequence numbers
+    (at most per_user of them per nick) is kept up to date as records are
+    evicted, so per-user queries never scan the ring.
+    """
+
+    def __init__(self, capacity=1000, per_user=50):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.per_user = per_user
+        self.records = list()
+        self.times = array("d")
+        self.first = self.next = 0
+        self.users = dict()
+
+    def __len__(self):
+        return self.next - self.first
+
+    def __getitem__(self, seq):
+        if not self.first <= seq < self.next:
+            raise IndexError(f"seq={seq} is not in the ring")
+        return self.records[seq % self.capacity]
+
+    def append(self, nick, msg, when=None):
+        """
+        Add a record. Returns the record that fell off the end to make room
+        for it (or None).
+        """
+        if when is None:
+            when = time.time()
+        evicted = self.popleft() if len(self) >= self.capacity else None
+        seq = self.next
+        rec = Record(seq, when, nick, msg)
+        slot = seq % self.capacity
+        if slot == len(self.records):
+            # still growing (sequence numbers start at 0, so the slots fill
+            # in order until the ring wraps)
+            self.records.append(rec)
+            self.times.append(when)
+        else:
+            self.records[slot] = rec
+            self.times[slot] = when
+        self.next += 1
+        idx = self.users.get(nick)
+        if idx is None:
+            idx = self.users[nick] = deque(maxlen=self.per_user)
+        idx.append(seq)
+        return evicted
+
+    def popleft(self):
+        """
+        Evict (and return) the oldest record.
+        """
+        if not len(self):
+            return None
+        slot = self.first % self.capacity
+        rec = self.records[slot]
+        self.records[slot] = None
+        self.first += 1
+        idx = self.users.get(rec.nick)
+        if idx:
+            if idx[0] == rec.seq:
+                idx.popleft()
+            if not idx:
+                del self.users[rec.nick]
+        return rec
+
+    @property
+    def last_when(self):
+        """
+        The time of the newest record (None if there isn't one).
+        """
+        return self.times[(self.next - 1) % self.capacity] if len(self) else None
+
+    def last(self, n):
+        """
+        The last n records, oldest first.
+        """
+        start = max(self.first, self.next - n)
+        return [self.records[s % self.capacity] for s in range(start, self.next)]
+
+    def since(self, when):
+        """
+        The records at or after the time 'when', oldest first. The start is
+        found with a binary search over the ring.
+        """
+        lo, hi = self.first, self.next
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[mid % self.capacity] < when:
+                lo = mid + 1
+            else:
+                hi = mid
+        return [self.records[s % self.capacity] for s in range(lo, self.next)]
+
+    def by_user(self, nick, n=None):
+        """
+        The last n (default all remembered) records by nick, oldest first.
+        """
+        idx = self.users.get(nick, ())
+        seqs = list(idx)[-n:] if n else idx
+        return [self.records[s % self.capacity] for s in seqs]
+
+    def last_seen(self, nick):
+        idx = self.users.get(nick)
+        if idx:
+            return self.times[idx[-1] % self.capacity]
+        return None
+
+
+class ChatHistory:
+    """
+    A ChannelRing per channel, with a cap on the total number of records.
+    When the cap is reached, the oldest records of the channel that has been
+    quiet the longest are evicted first. Channels that have been quiet for
+    more than idle_seconds (if given) are forgotten altogether.
+
+        history = ChatHistory(per_channel=1000, max_records=500000, per_user=50)
+        history.record(reply)  # TWILoop does this for you
+        history.last('#twichat', 10)
+        history.window('#twichat', 60)  # the last minute
+        history.by_user('#twichat', 'jettero', 5)
+        history.spoke_within('#twichat', 'jettero', 300)
+
+    Channels are lowercased; nicks are kept as sent.
+    """
+
+    def __init__(
+        self, per_channel=1000, max_records=1000000, per_user=50, idle_seconds=86400
+    ):
+        self.per_channel = per_channel
+        self.max_records = max_records
+        self.per_user = per_user
+        self.idle_seconds = idle_seconds
+        self.rings = OrderedDict()
+        self.total = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return self.total
+
+    def ring(self, channel):
+        return self.rings.get(channel.lower())
+
+    def record(self, reply, when=None):
+        if not isinstance(reply, ChannelMessage):
+            return
+        self.add(reply.channel, reply.sender, reply.msg, when=when)
+
+    def add(self, channel, nick, msg, when=None):
+        if when is None:
+            when = time.time()
+        channel = channel.lower()
+        ring = self.rings.get(channel)
+        if ring is None:
+            ring = self.rings[channel] = ChannelRing(self.per_channel, self.per_user)
+        else:
+            self.rings.move_to_end(channel)
+        if ring.append(nick, msg, when=when) is None:
+            self.total += 1
+        else:
+            self.evicted += 1
+        while self.total > self.max_records:
+            quiet_channel, quiet = next(iter(self.rings.items()))
+            quiet.popleft()
+            self.total -= 1
+            self.evicted += 1
+            if not quiet:
+                del self.rings[quiet_channel]
+        if self.idle_seconds is not None:
+            self.expire(when - self.idle_seconds)
+
+    def expire(self, before):
+        """
+        Forget the channels with nothing said since the time 'before'. The
+        rings are kept in order of activity, so this stops at the first
+        channel that's still active.
+        """
+        while self.rings:
+            channel, ring = next(iter(self.rings.items()))
+            if ring.last_when is not None and ring.last_when >= before:
+                break
+            del self.rings[channel]
+            self.total -= len(ring)
+            self.evicted += len(ring)
+
+    def last(self, channel, n):
+        ring = self.ring(channel)
+        return ring.last(n) if ring else list()
+
+    def window(self, channel, seconds):
+        ring = self.ring(channel)
+        return ring.since(time.time() - seconds) if ring else list()
+
+    def by_user(self, channel, nick, n=None):
+        ring = self.ring(channel)
+        return ring.by_user(nick, n) if ring else list()
+
+    def spoke_within(self, channel, nick, seconds):
+        ring = self.ring(channel)
+        when = ring.last_seen(nick) if ring else None
+        return when is not None and time.time() - when <= seconds
@@ -44,17 +44,38 @@ class IRCConnection:
         )
         self.closed = False
 
-    def writeline(self, blah):
+    def writeline(self, blah, drain=True):
         # RFC1459 says IRC lines should end with \x0d\x0a, but on most servers
         # they actually end with \x0a only … we'll try to do the right thing
         if self.closed:
             log.debug("writeline() closed, ignored")
-            return
+            return False
         if not isinstance(blah, (bytes, bytearray)):
             blah = str(blah).rstrip(WS) + CRLF
             blah = blah.encode(self.outgoing_encoding)
         self.writer.write(blah)
-        asyncio.create_task(self.writer.drain())
+        if drain:
+            asyncio.create_task(self.writer.drain())
+        return True
+
+    async def send(self, blah):
+        """
+        Like writeline(), but waits for the write buffer to drain (which only
+        actually waits when the buffer is over its high water mark) rather
+        than starting a task to do it. Returns False if the connection was
+        closed (so nothing was written).
+        """
+        if not self.writeline(blah, drain=False):
+            return False
+        await self.writer.drain()
+        return True
+
+    def write_buffer_size(self):
+        """
+        How much of what we wrote is still in the transport's buffer (i.e.,
+        not handed to the kernel yet).
+        """
+        return self.writer.transport.get_write_buffer_size()
 
     def close(self):
         if self.closed:
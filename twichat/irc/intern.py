@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Bounded string interning for the hot strings in parsed replies (command
+names, tag keys, channels, nicks, …). The same handful of values show up on
+millions of lines, so handing back one shared str for each of them saves
+memory on stored replies and lets == short circuit on identity.
+
+sys.intern() would work for this too, but it never forgets anything, and
+nicks (or client-only tag keys) are chosen by whoever is on the other end of
+the chat. These tables forget the oldest entries once they're full.
+"""
+
+
+class InternTable:
+    """
+    A bounded intern table. Call it with a string and it returns the first
+    equal string it saw (or the one you gave it, if it's new).
+
+        intern_name = InternTable(maxsize=100000)
+        a = intern_name("".join(["#", "twichat"]))
+        b = intern_name("".join(["#twi", "chat"]))
+        assert a is b
+
+    When the table is full, the oldest entry is dropped. (This is FIFO rather
+    than LRU so a hit costs a single dict lookup.)
+    """
+
+    def __init__(self, maxsize=65536):
+        self.maxsize = maxsize
+        self.table = dict()
+
+    def __call__(self, txt):
+        try:
+            return self.table[txt]
+        except KeyError:
+            pass
+        if len(self.table) >= self.maxsize:
+            del self.table[next(iter(self.table))]
+        self.table[txt] = txt
+        return txt
+
+    def __len__(self):
+        return len(self.table)
+
+    def clear(self):
+        self.table.clear()
+
+
+# command names and tag keys; there aren't many of these
+intern_word = InternTable(maxsize=4096)
+
+# channels, nicks, hostnames and other middle params
+intern_name = InternTable(maxsize=100000)
@@ -8,6 +8,7 @@ message classes and gadgets, look in twichat.irc.reply instead.
 """
 
 from .annoying import no_space_or_error
+from ..const import CRLF, MAX_LINE_LENGTH
 
 
 class Message:
@@ -112,36 +113,108 @@ class OneArgMessage(Message):
         super().__init__(self.__class__.__name__, arg)
 
 
-class JOIN(OneArgMessage):
-    def __init__(self, channel):
-        """
-        channel will automatically be prefixed with '#' unless '&' or '#' is
-        given at the start of the name
+def channel_name(channel):
+    """
+    channel will automatically be prefixed with '#' unless '&' or '#' is
+    given at the start of the name
+
+        channel_name('channelname') → "#channelname"
 
-            str(JoinMessage('channelname')) → "JOIN #channelname"
+    Note that there are two types of IRC channels:
+      '#' a distributed channel known to the whole network
+      '&' a server channel known by only that server, and only joinable
+          by users on that server
 
-        Note that there are two types of IRC channels:
-          '#' a distributed channel known to the whole network
-          '&' a server channel known by only that server, and only joinable
-              by users on that server
+    Also note that some channels really do have multiple '#' prefixes...
+    In which case, it must actually be expressed twice, since the automatic
+    prefixing will be skipped without this:
 
-        Also note that some channels really do have multiple '#' prefixes...
-        In which case, it must actually be expressed twice, since the automatic
-        prefixing will be skipped without this:
+        channel_name('math') → "#math"
+        channel_name('#math') → "#math"
+        channel_name('##math') → "##math"
+
+    Interestingly, if you join '#math' on freenode, you'll actually be
+    joined to '##math'; which is somewhat inexplicable. IRC! \\o/
+    """
+
+    if not channel.startswith("#"):
+        if not channel.startswith("&"):
+            channel = "#" + channel
+    return channel
+
+
+class ChannelListMessage(Message):
+    """
+    Messages like JOIN and PART take a comma separated list of channels as
+    their first argument. Each channel name is passed through channel_name()
+    before it's added to the list.
 
-            str(JoinMessage('math')) → "JOIN #math"
-            str(JoinMessage('#math')) → "JOIN #math"
-            str(JoinMessage('##math')) → "JOIN ##math"
+        str(JOIN('one', 'two')) → "JOIN #one,#two"
 
-        Interestingly, if you join '#math' on freenode, you'll actually be
-        joined to '##math'; which is somewhat inexplicable. IRC! \\o/
+    Use batched() to pack a large set of channels into as few lines as the
+    RFC1459 512 byte line limit allows:
+
+        for msg in JOIN.batched(channels):
+            loop.send(msg)
+    """
+
+    def __init__(self, *channels):
+        if not channels:
+            raise ValueError(f"{self.__class__.__name__} needs at least one channel")
+        self.channels = tuple(channel_name(c) for c in channels)
+        for c in self.channels:
+            no_space_or_error(c, fieldname="channel")
+            if "," in c:
+                raise ValueError("comma not allowed in channel names")
+        super().__init__(self.__class__.__name__, ",".join(self.channels))
+
+    @classmethod
+    def batched(cls, channels, max_length=MAX_LINE_LENGTH, max_channels=None):
+        """
+        Generate messages of this type with as many channels in each as will
+        fit in max_length bytes (including the CRLF) and, optionally, no more
+        than max_channels channels per message.
         """
 
-        if not channel.startswith("#"):
-            if not channel.startswith("&"):
-                channel = "#" + channel
+        # "JOIN " + "#a,#b,#c" + CRLF
+        overhead = len(cls.__name__) + 1 + len(CRLF)
+        batch = list()
+        size = overhead
+        for channel in channels:
+            channel = channel_name(channel)
+            clen = len(channel.encode("utf-8"))
+            if overhead + clen > max_length:
+                raise ValueError(f"channel name {channel} is too long for one line")
+            # the +1 is for the separating comma
+            extra = clen + 1 if batch else clen
+            full = size + extra > max_length
+            if full or (max_channels and len(batch) >= max_channels):
+                yield cls(*batch)
+                batch = list()
+                size = overhead
+                extra = clen
+            batch.append(channel)
+            size += extra
+        if batch:
+            yield cls(*batch)
+
+
+class JOIN(ChannelListMessage):
+    """
+    JOIN one or more channels. See channel_name() for the '#' prefixing rules.
+
+        str(JOIN('channelname')) → "JOIN #channelname"
+        str(JOIN('one', '#two')) → "JOIN #one,#two"
+    """
 
-        super().__init__(channel)
+
+class PART(ChannelListMessage):
+    """
+    PART (leave) one or more channels. See channel_name() for the '#'
+    prefixing rules.
+
+        str(PART('channelname')) → "PART #channelname"
+    """
 
 
 class PASS(OneArgMessage):
@@ -167,3 +240,42 @@ class PONG(Message):
 
         PONG(*parsed_reply_obj.params[1:])
     """
+
+    def __init__(self, *params):
+        super().__init__("PONG", *params)
+
+
+class QUIT(Message):
+    """
+    Leave the server, optionally saying why.
+
+        str(QUIT()) → "QUIT"
+        str(QUIT('see ya')) → "QUIT :see ya"
+    """
+
+    def __init__(self, reason=None):
+        if reason:
+            super().__init__("QUIT", reason)
+        else:
+            super().__init__("QUIT")
+
+
+class CAP(Message):
+    """
+    IRCv3 capability negotiation. See twichat.caps for the whole dance.
+
+        str(CAP('LS', '302')) → "CAP LS 302"
+        str(CAP('REQ', 'twitch.tv/tags', 'twitch.tv/commands')) → "CAP REQ :twitch.tv/tags twitch.tv/commands"
+        str(CAP('END')) → "CAP END"
+    """
+
+    def __init__(self, sub, *caps):
+        sub = sub.upper()
+        if sub == "REQ":
+            # the list is the trailing arg (so it always gets its ':')
+            super().__init__("CAP", sub, " ".join(caps))
+        else:
+            super().__init__("CAP", sub)
+            for cap in caps:
+                no_space_or_error(cap)
+            self.msg += caps
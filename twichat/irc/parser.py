@@ -4,6 +4,7 @@
 
 from collections import namedtuple
 from lark import Lark, Transformer, UnexpectedToken
+from .intern import intern_word, intern_name
 
 Origin = namedtuple("Origin", ["name", "user", "host"])
 User = namedtuple("User", ["name"])
@@ -11,10 +12,22 @@ Host = namedtuple("Host", ["name"])
 Command = namedtuple("Command", ["name"])
 TagPair = namedtuple("TagPair", ["name", "value"])
 
-ParsedReply = namedtuple("Reply", ["tags", "origin", "command", "params"])
+# wire is the original line the reply was parsed from (if there was one)
+ParsedReply = namedtuple(
+    "Reply", ["tags", "origin", "command", "params", "wire"], defaults=(None,)
+)
 
 MUT_MARK = "←!"
 
+# what parse() (and twichat.irc.reply.grok()) can produce, cheapest first:
+#   FIELDS :- the raw fields of the line as a plain tuple, see split_line()
+#   RECORD :- a flat Record, built from those fields
+#   REPLY  :- the full (lark parsed) reply with its nested namedtuples
+FIELDS = "fields"
+RECORD = "record"
+REPLY = "reply"
+MODE_COST = {FIELDS: 0, RECORD: 1, REPLY: 2}
+
 
 class TagSet(dict):
     pass
@@ -37,34 +50,37 @@ class ReplyTransformer(Transformer):
         return v[0].value
 
     def middle(self, v):
-        return v[0].value
+        return intern_name(v[0].value)
 
     def command(self, v):
-        return Command(v[0].value)
+        return Command(intern_word(v[0].value))
 
     def params(self, v):
         return Params(v[1:])
 
     def server_or_nick(self, v):
-        return v[0].value
+        return intern_name(v[0].value)
 
     def username(self, v):
-        return User(v[1].value)
+        return User(intern_name(v[1].value))
 
     def hostname(self, v):
-        return Host(v[1].value)
+        return Host(intern_name(v[1].value))
 
     def tagstr(self, v):
         return v[0].value
 
+    def tagval(self, v):
+        return v[0].value
+
     def tagpair(self, v):
         # eg ('badge-info', Token(EQ))
         if len(v) == 2:
-            return TagPair(v[0], None)
+            return TagPair(intern_word(v[0]), None)
 
         # eg ('badges', Token(EQ), 'staff/1,bits/1000')
         if len(v) == 3:
-            return TagPair(v[0], v[2])
+            return TagPair(intern_word(v[0]), v[2])
 
         # hopefully there's no more variations to consider
         raise ValueError(f"WTF(v={v})")
@@ -87,17 +103,18 @@ class ReplyTransformer(Transformer):
         return Origin(**kw)
 
     def reply(self, v):
-        kw = dict(tags=None, origin=None, command=None, params=None)
+        # just the fields; parse() builds the ParsedReply (with its wire)
+        tags = origin = command = params = None
         for i in v:
             if isinstance(i, Origin):
-                kw["origin"] = i
+                origin = i
             elif isinstance(i, Command):
-                kw["command"] = i
+                command = i
             elif isinstance(i, Params):
-                kw["params"] = i
+                params = i
             elif isinstance(i, TagSet):
-                kw["tags"] = i
-        return ParsedReply(**kw)
+                tags = i
+        return tags, origin, command, params
 
 
 __REPLY_PARSER = None
@@ -110,8 +127,12 @@ def ReplyParser():
         return __REPLY_PARSER
 
     # CSTRING :- command names are fairly restrictive... just word chars
-    # MSTRING :- middle params have these exact restrictions apparently
+    # MSTRING :- middle params can't start with a colon (but can contain them,
+    #            e.g., the 005 token CHANLIMIT=#:120)
     # TSTRING :- the last param must be prefixed with a colon and then anything goes after that
+    # PSTRING :- tag names
+    # VSTRING :- tag values can be anything but ';' and space (e.g., Twitch's
+    #            emotes=25:0-4,12-16/1902:6-10)
     # NSTRING :- names can be almost anything, probably, and RFC1459 is ambiguous about it
     #            I've chosen to allow almost anything except the symbols the
     #            parser uses to separate origin fields; ... and I disallowed
@@ -125,8 +146,9 @@ def ReplyParser():
         reply: id3tags? prefix? command params?
         params: SP middle* trailing
         id3tags: AT tagpair (SEMI tagpair)* SP
-        tagpair: tagstr EQ tagstr | tagstr EQ
+        tagpair: tagstr EQ tagval | tagstr EQ
         tagstr: PSTRING
+        tagval: VSTRING
         middle: MSTRING SP?
         trailing: TSTRING | MSTRING
         command: (CSTRING | DIGITS)
@@ -138,8 +160,9 @@ def ReplyParser():
         CSTRING: /\w[\w\d]+/
         NSTRING: /[^\x00\x0d\x0a@:!\s]+/
         TSTRING: ":" /.*/
-        MSTRING: /[^:\x00\x0d\x0a\s]+/
+        MSTRING: /[^:\x00\x0d\x0a\s][^\x00\x0d\x0a\s]*/
         PSTRING: /[^=:;\s\x00\x0d\x0a]+/
+        VSTRING: /[^;\s\x00\x0d\x0a]+/
         AT: "@"
         EQ: "="
         COLON: ":"
@@ -154,8 +177,178 @@ def ReplyParser():
     return __REPLY_PARSER
 
 
-def parse(line):
+def split_line(line):
+    """
+    Cut a line into its raw fields without the grammar:
+
+        split_line("@a=b :nick!u@h PRIVMSG #c :hi there")
+            → ("a=b", "nick!u@h", "PRIVMSG", ["#c", "hi there"])
+
+    The tags and prefix are None when the line has none, and nothing is
+    unescaped, decoded or interned.
+    """
+    tags = prefix = None
+    pos = 0
+    if line.startswith("@"):
+        pos = line.find(" ")
+        if pos < 0:
+            raise ValueError(f'failed to split "{line}": nothing after the tags')
+        tags = line[1:pos]
+        while line.startswith(" ", pos):
+            pos += 1
+    if line.startswith(":", pos):
+        end = line.find(" ", pos)
+        if end < 0:
+            raise ValueError(f'failed to split "{line}": nothing after the prefix')
+        prefix = line[pos + 1 : end]
+        pos = end + 1
+    end = line.find(" :", pos)
+    if end < 0:
+        params = line[pos:].split()
+    else:
+        params = line[pos:end].split()
+        params.append(line[end + 2 :])
+    if not params:
+        raise ValueError(f'failed to split "{line}": no command')
+    return tags, prefix, params[0], params[1:]
+
+
+class Record:
+    """
+    A flat, slotted alternative to the full reply (see parse()); for
+    consumers that just want the command, channel and text.
+
+        rec = parse("@a=b :nick!u@h PRIVMSG #c :hi there", mode=RECORD)
+        rec.command  → "PRIVMSG"
+        rec.nick     → "nick"
+        rec.channel  → "#c"
+        rec.msg      → "hi there"
+        rec.tags     → {"a": "b"}
+    """
+
+    __slots__ = ("tags", "nick", "user", "host", "command", "params", "wire")
+
+    def __init__(self, tags, nick, user, host, command, params, wire=None):
+        self.tags = tags
+        self.nick = nick
+        self.user = user
+        self.host = host
+        self.command = command
+        self.params = params
+        self.wire = wire
+
+    @classmethod
+    def from_fields(cls, fields, wire=None):
+        tags, prefix, command, params = fields
+        if tags is not None:
+            tagset = dict()
+            for pair in tags.split(";"):
+                name, _, value = pair.partition("=")
+                tagset[intern_word(name)] = value or None
+            tags = tagset
+        nick = user = host = None
+        if prefix is not None:
+            nick, _, host = prefix.partition("@")
+            nick, _, user = nick.partition("!")
+            nick = intern_name(nick)
+            user = intern_name(user) if user else None
+            host = intern_name(host) if host else None
+        if params and params[0][:1] in ("#", "&"):
+            params[0] = intern_name(params[0])
+        return cls(tags, nick, user, host, intern_word(command), params, wire)
+
+    @property
+    def channel(self):
+        params = self.params
+        return params[0] if params and params[0][:1] in ("#", "&") else None
+
+    @property
+    def msg(self):
+        # like Reply.msg: the params after the target
+        params = self.params
+        if len(params) > 2:
+            return " ".join(params[1:])
+        return params[1] if len(params) > 1 else None
+
+    @classmethod
+    def from_reply(cls, reply):
+        """
+        The Record of an already parsed (or grokked) reply.
+        """
+        nick = user = host = None
+        origin = reply.origin
+        if origin is not None:
+            nick = origin.name
+            user = origin.user.name if origin.user else None
+            host = origin.host.name if origin.host else None
+        tags = dict(reply.tags) if reply.tags is not None else None
+        params = list(reply.params or ())
+        return cls(tags, nick, user, host, reply.command.name, params, reply.wire)
+
+    def fields(self):
+        """
+        The raw fields (see split_line()) this Record was made from.
+        """
+        tags = prefix = None
+        if self.tags is not None:
+            tags = ";".join(
+                f"{name}={'' if value is None else value}"
+                for name, value in self.tags.items()
+            )
+        if self.nick is not None:
+            prefix = self.nick
+            if self.user:
+                prefix += f"!{self.user}"
+            if self.host:
+                prefix += f"@{self.host}"
+        return tags, prefix, self.command, list(self.params)
+
+    def __repr__(self):
+        return f"Record({self.wire or self.command!r})"
+
+
+def richest_mode(modes):
+    """
+    The most expensive of modes (an iterable of parse() modes): the one to
+    parse in so every other shape can be derived from it (see
+    twichat.irc.reply.ReplyShapes). None if modes is empty.
+    """
+    return max(modes, key=MODE_COST.__getitem__, default=None)
+
+
+def parse(line, mode=REPLY):
+    if mode == FIELDS:
+        return split_line(line)
+    if mode == RECORD:
+        return Record.from_fields(split_line(line), wire=line)
+    if mode != REPLY:
+        raise ValueError(f"mode should be one of {tuple(MODE_COST)}, not {mode}")
     try:
-        return ReplyParser().parse(line)
+        tags, origin, command, params = ReplyParser().parse(line)
+        return ParsedReply(tags, origin, command, params, line)
     except UnexpectedToken as ut:
         raise MarkedUnexpectedToken(ut, line) from ut
+
+
+def peek_command(line):
+    """
+    Return the command of a raw line without parsing it (skipping the tags
+    and prefix, if any). This is meant for quick decisions like queue
+    priorities; it makes no attempt to validate anything.
+
+        peek_command("@a=b :nick!u@h PRIVMSG #c :hi") → "PRIVMSG"
+        peek_command("PING :tmi.twitch.tv") → "PING"
+    """
+    start = 0
+    if line.startswith("@"):
+        start = line.find(" ") + 1
+        if not start:
+            return ""
+    if line.startswith(":", start):
+        start = line.find(" ", start) + 1
+        if not start:
+            return ""
+    end = line.find(" ", start)
+    if end < 0:
+        return line[start:]
+    return line[start:end]
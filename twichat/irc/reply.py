@@ -5,7 +5,9 @@
 import re
 import datetime
 from abc import abstractmethod, ABC
-from .parser import ParsedReply, parse as parse_reply_text
+from .parser import ParsedReply, Record, FIELDS, RECORD, REPLY, MODE_COST
+from .parser import parse as parse_reply_text
+from .tags import decode_badges, decode_emotes, NO_BADGES
 
 
 class GrokError(TypeError):
@@ -13,13 +15,47 @@ class GrokError(TypeError):
         super().__init__(f"unable to deal with {reply}, expected type {ParsedReply}")
 
 
-def grok(reply):
-    return Reply.grok(reply)
+def grok(reply, mode=REPLY):
+    return Reply.grok(reply, mode=mode)
 
 
 parse = grok
 
 
+class ReplyShapes:
+    """
+    One line in whichever of the parse modes (see twichat.irc.parser) are
+    asked for. The line is only parsed once, in the richest mode anyone
+    wants (ask for that one first); the cheaper shapes are derived from it:
+
+        shapes = ReplyShapes(line)
+        reply = shapes[REPLY]    # grok(line)
+        rec = shapes[RECORD]     # Record.from_reply(reply)
+        fields = shapes[FIELDS]  # rec.fields()
+    """
+
+    __slots__ = ("line", "shapes")
+
+    def __init__(self, line):
+        self.line = line
+        self.shapes = dict()
+
+    def __getitem__(self, mode):
+        shapes = self.shapes
+        if mode in shapes:
+            return shapes[mode]
+        if mode not in MODE_COST:
+            raise ValueError(f"mode should be one of {tuple(MODE_COST)}, not {mode}")
+        if mode == RECORD and REPLY in shapes:
+            res = Record.from_reply(shapes[REPLY])
+        elif mode == FIELDS and (RECORD in shapes or REPLY in shapes):
+            res = self[RECORD].fields()
+        else:
+            res = grok(self.line, mode=mode)
+        shapes[mode] = res
+        return res
+
+
 class _RE:
     chan = re.compile(r"^[&#]")
     numb = re.compile(r"^\d+$")
@@ -35,12 +71,23 @@ def isnumber(name):
 
 
 class Reply(ABC, ParsedReply):
-    _msg = _target = None
+    # NOTE: tuple subclasses can't have (non-empty) __slots__, so these
+    # cached values live in the instance __dict__ once they're computed
+    _msg = _target = _source = _repr = None
     cname = lcname = None
     reply_classes = list()
 
     @classmethod
-    def grok(cls, reply):
+    def grok(cls, reply, mode=REPLY):
+        """
+        Turn a line (or a ParsedReply) into the most specific Reply class
+        that accepts it. With mode (see twichat.irc.parser), a line can be
+        turned into something cheaper instead: a Record, or raw fields.
+        """
+        if mode != REPLY:
+            if not isinstance(reply, str):
+                raise GrokError(reply)
+            return parse_reply_text(reply, mode=mode)
         if isinstance(reply, str):
             reply = parse_reply_text(reply)
         if not isinstance(reply, ParsedReply):
@@ -77,6 +124,11 @@ class Reply(ABC, ParsedReply):
 
     @property
     def source(self):
+        if self._source is None:
+            self._source = self._compute_source()
+        return self._source
+
+    def _compute_source(self):
         if self.origin:
             if self.origin.name:
                 return self.origin.name
@@ -98,28 +150,32 @@ class Reply(ABC, ParsedReply):
     @target.setter
     def target(self, v):
         self._target = v
+        self._repr = None
 
     @property
     def msg(self):
         if self._msg is not None:
             return self._msg
-        if len(self.params) > 1:
+        if self.params and len(self.params) > 1:
             self._msg = " ".join(self.params[1:])
         return self._msg
 
     @msg.setter
     def msg(self, v):
         self._msg = v
+        self._repr = None
 
     def stringify(self):
-        p = " ".join(self.params)
+        p = " ".join(self.params or ())
         return f"{self.source} {self.command.name} {p}"
 
     def __repr__(self):
-        s = self.stringify()
-        if s:
-            return f"{self.cname}<{s}>"
-        return self.cname
+        # stringify() is computed at most once per reply (the setters above
+        # forget the cached value)
+        if self._repr is None:
+            s = self.stringify()
+            self._repr = f"{self.cname}<{s}>" if s else self.cname
+        return self._repr
 
 
 class Arrive(Reply):
@@ -165,6 +221,17 @@ class DirectMessage(Reply):
 
 
 class ChannelMessage(Reply):
+    """
+    A PRIVMSG to a channel. With Twitch's tags, these also have (decoded on
+    first use; see twichat.irc.tags):
+
+        reply.badges     → {'subscriber': '6', 'bits': '100'}
+        reply.badge_info → {'subscriber': '8'}
+        reply.emotes     → (Emote(id='25', start=0, end=5, text='Kappa'), …)
+    """
+
+    _emotes = None
+
     @classmethod
     def accept(cls, reply):
         if reply.command.name == "PRIVMSG" and ischannel(reply.target):
@@ -174,6 +241,23 @@ class ChannelMessage(Reply):
         self.sender = self.source
         self.channel = self.target
 
+    def _tag(self, name):
+        return self.tags.get(name) if self.tags else None
+
+    @property
+    def badges(self):
+        return decode_badges(self._tag("badges")) if self.tags else NO_BADGES
+
+    @property
+    def badge_info(self):
+        return decode_badges(self._tag("badge-info")) if self.tags else NO_BADGES
+
+    @property
+    def emotes(self):
+        if self._emotes is None:
+            self._emotes = decode_emotes(self._tag("emotes"), self.msg)
+        return self._emotes
+
     def stringify(self):
         return f'{self.sender} says, "{self.msg}" on {self.channel}'
 
@@ -311,6 +395,8 @@ class NameList(Reply):
                 return f"@{self.nick}"
             return self.nick
 
+    _nicks = None
+
     @classmethod
     def accept(cls, reply):
         if reply.command.name == "353":
@@ -323,15 +409,33 @@ class NameList(Reply):
 
         self.channel = self.params[2]
 
-        self.nicks = list()
+    def iter_names(self):
+        """
+        The nicks in this line as plain strings (without the '@' op marker).
+        Big channels send hundreds of these lines, so this doesn't build a
+        Nick for each name; see twichat.handlers.NamesCollector.
+        """
         for name in self.params[3].split(" "):
-            if name.startswith("@"):
-                self.nicks.append(self.Nick(name[1:], op=True))
-            else:
-                self.nicks.append(self.Nick(name))
+            if name:
+                yield name[1:] if name.startswith("@") else name
+
+    @property
+    def nicks(self):
+        # built the first time someone asks
+        if self._nicks is None:
+            self._nicks = [
+                (
+                    self.Nick(name[1:], op=True)
+                    if name.startswith("@")
+                    else self.Nick(name)
+                )
+                for name in self.params[3].split(" ")
+                if name
+            ]
+        return self._nicks
 
     def stringify(self):
-        sp = ", ".join(str(x) for x in self.nicks)
+        sp = ", ".join(name for name in self.params[3].split(" ") if name)
         return f"present: {sp}"
 
 
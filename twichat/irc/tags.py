@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Decoders for Twitch's emotes= and badges= (and badge-info=) tags.
+
+ChannelMessage uses these for its emotes, badges and badge_info attributes,
+so handlers shouldn't normally need to call them directly:
+
+    reply.badges               → {'subscriber': '6', 'bits': '100'}
+    reply.badge_info           → {'subscriber': '8'}
+    reply.emotes               → (Emote(id='25', start=0, end=5, text='Kappa'), …)
+
+Badge strings repeat constantly (most chatters in a channel have one of a
+handful of badge sets), so they're decoded once per distinct string and kept
+in a bounded LRU cache; the decoded mappings are read-only so they can be
+shared between replies. Emote ranges are decoded into sorted offsets and
+cached the same way (emote-only spam repeats them too).
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+from types import MappingProxyType
+
+BADGE_CACHE_SIZE = 4096
+EMOTE_CACHE_SIZE = 4096
+
+# start and end are offsets into the message, in code points (which is what
+# Twitch counts, and what python str indexes by); end is exclusive
+Emote = namedtuple("Emote", ["id", "start", "end", "text"])
+
+NO_BADGES = MappingProxyType(dict())
+
+ACTION_START = "\x01ACTION "
+ACTION_END = "\x01"
+
+
+@lru_cache(maxsize=BADGE_CACHE_SIZE)
+def decode_badges(tag):
+    """
+    "subscriber/6,bits/100" → {'subscriber': '6', 'bits': '100'} (read-only)
+    """
+    if not tag:
+        return NO_BADGES
+    badges = dict()
+    for badge in tag.split(","):
+        name, _, version = badge.partition("/")
+        if name:
+            badges[name] = version
+    return MappingProxyType(badges)
+
+
+@lru_cache(maxsize=EMOTE_CACHE_SIZE)
+def decode_emote_ranges(tag):
+    """
+    "25:0-4,12-16/1902:6-10" → (('25', 0, 5), ('1902', 6, 11), ('25', 12, 17))
+
+    The ranges are sorted by where they start; malformed ones are skipped.
+    """
+    if not tag:
+        return ()
+    ranges = list()
+    for emote in tag.split("/"):
+        emote_id, _, positions = emote.partition(":")
+        for pos in positions.split(","):
+            start, _, end = pos.partition("-")
+            try:
+                start, end = int(start), int(end) + 1
+            except ValueError:
+                continue
+            if 0 <= start < end:
+                ranges.append((emote_id, start, end))
+    ranges.sort(key=lambda r: r[1])
+    return tuple(ranges)
+
+
+def decode_emotes(tag, msg):
+    """
+    The Emotes in msg according to the emotes= tag, in order. Ranges that
+    don't fit in the message are skipped.
+    """
+    ranges = decode_emote_ranges(tag)
+    if not ranges or not msg:
+        return ()
+    if msg.startswith(ACTION_START) and msg.endswith(ACTION_END):
+        # Twitch counts from the start of the /me text
+        msg = msg[len(ACTION_START) : -len(ACTION_END)]
+    size = len(msg)
+    return tuple(
+        Emote(emote_id, start, end, msg[start:end])
+        for emote_id, start, end in ranges
+        if end <= size
+    )
+
+
+def cache_info():
+    return dict(
+        badges=decode_badges.cache_info(), emotes=decode_emote_ranges.cache_info()
+    )
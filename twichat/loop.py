@@ -1,21 +1,120 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import os
+import time
 import signal
 import asyncio
+import inspect
 import logging
-from .irc.reply import grok
+from .irc.reply import grok, ReplyShapes
+from .irc.parser import REPLY, richest_mode
 from .irc.conn import IRCConnection
+from .irc.msg import QUIT
 from .const import (
     TWITCH_HOST as TH,
     TWITCH_PORT as TP,
+    TWITCH_CAPS,
+    IRCV3_CAPS,
     INSTALL_DIR,
     PYTHON_DIR,
 )
-from .handlers import HandlerResult, ReplyHandler, RawHandler, SendRawHandler
+from .caps import CapNegotiator
+from .profiler import SamplingProfiler
+from .handlers import (
+    HandlerResult,
+    ReplyHandler,
+    BatchReplyHandler,
+    RawHandler,
+    SendRawHandler,
+)
+from .queues import InboundQueue, OutboundQueue
 
 log = logging.getLogger(__name__)
 
+# signal handlers are process wide, so each profile_signal gets just one,
+# which toggles the profiler of every running bot that asked for it (e.g.,
+# all the bots under a twichat.supervisor.Supervisor)
+_PROFILE_SIGNAL_BOTS = dict()
+
+
+def toggle_profiling_all(signo):
+    for bot in tuple(_PROFILE_SIGNAL_BOTS.get(signo, ())):
+        bot.toggle_profiling()
+
+
+def task_name(coro):
+    """
+    A descriptive name for a task running coro, like
+    "loop.py.312:read_lines" (None if coro isn't a plain coroutine).
+    """
+    try:
+        cobj = coro.cr_code
+    except AttributeError:
+        return None
+    fname = cobj.co_filename
+    if fname.startswith(INSTALL_DIR):
+        fname = fname[len(INSTALL_DIR) + 1 :]
+    if fname.startswith(PYTHON_DIR):
+        fname = fname[len(PYTHON_DIR) + 1 :]
+    return f"{fname}.{cobj.co_firstlineno}:{cobj.co_name}"
+
+
+def fast_loop_policy():
+    """
+    uvloop's event loop policy, if uvloop is installed; otherwise None.
+    """
+    try:
+        import uvloop  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    return uvloop.EventLoopPolicy()
+
+
+class HandlerList(list):
+    """
+    A list of handlers that counts its changes (in version), so the loop
+    can tell when to work out its reply mode again.
+    """
+
+    version = 0
+
+    def append(self, handler):
+        self.version += 1
+        super().append(handler)
+
+    def extend(self, handlers):
+        self.version += 1
+        super().extend(handlers)
+
+    def insert(self, index, handler):
+        self.version += 1
+        super().insert(index, handler)
+
+    def remove(self, handler):
+        self.version += 1
+        super().remove(handler)
+
+    def pop(self, index=-1):
+        self.version += 1
+        return super().pop(index)
+
+    def clear(self):
+        self.version += 1
+        super().clear()
+
+    def __setitem__(self, index, handler):
+        self.version += 1
+        super().__setitem__(index, handler)
+
+    def __delitem__(self, index):
+        self.version += 1
+        super().__delitem__(index)
+
+    def __iadd__(self, handlers):
+        self.version += 1
+        return super().__iadd__(handlers)
+
 
 class RegistrationInfo(dict):
     def __bool__(self):
@@ -29,7 +128,8 @@ class RegistrationInfo(dict):
 
 
 class TWILoop:
-    main_coro = loop = sock = None
+    loop = sock = None
+    name_tasks = False
 
     def __init__(
         self,
@@ -42,122 +142,424 @@ class TWILoop:
         username=None,
         realname="M. Incognito",
         hostname=None,
+        history=None,
+        dedup=None,
+        inbound=None,
+        outbound=None,
+        task_report_interval=None,
+        long_task_seconds=60,
+        shutdown_timeout=5,
+        caps=None,
+        cap_timeout=5,
+        profile_signal=None,
+        profile_interval=0.005,
+        profile_format="collapsed",
+        profile_dir=None,
     ):
         self.host = host
         self.port = port
         self.use_ssl = use_ssl
         self.verify_ssl = verify_ssl
 
-        self.handlers = list()
+        self.handlers = HandlerList()
+        self._reply_mode = self._reply_mode_key = None
+        self._pure_handlers = False
         self.running = False
-        self.tasks = list()
+        # our pending tasks and when they started (by the event loop's
+        # clock); tasks remove themselves when they finish
+        self.tasks = dict()
+        self.tasks_started = self.tasks_failed = 0
+
+        # every task_report_interval seconds (if given), log the tasks that
+        # have been running for more than long_task_seconds
+        self.task_report_interval = task_report_interval
+        self.long_task_seconds = long_task_seconds
+
+        # a twichat.history.ChatHistory (or None); when given, every
+        # ChannelMessage is recorded before the handlers see it
+        self.history = history
+
+        # a twichat.dedup.DedupCache (or None); when given, the verdicts of
+        # pure handlers are cached by message text
+        self.dedup = dedup
+
+        # lines are read into this twichat.queues.InboundQueue and handled
+        # from there; see the overflow policies in that module
+        self.inbound = InboundQueue() if inbound is None else inbound
+
+        # send() puts messages in this twichat.queues.OutboundQueue and a
+        # writer task writes them out, control messages first
+        self.outbound = OutboundQueue() if outbound is None else outbound
+
+        # once stop()ed, we get this long to send what's queued (and QUIT)
+        # before the connection is closed and leftover tasks are cancelled
+        self.shutdown_timeout = shutdown_timeout
+        self.quitting = False
+        self.quit_reason = None
+        self.shutdown_report = None
+        self.reader = self.writer = None
 
-        self.registration_info = RegistrationInfo(
+        # IRCv3 capabilities to ask for (see twichat.caps); after
+        # registration, capabilities holds the ones the server ACKed
+        self.caps = tuple(caps) if caps else ()
+        self.cap_timeout = cap_timeout
+        self.capabilities = frozenset()
+        self.negotiator = None
+
+        # an opt-in sampling profiler (see twichat.profiler): start_profiling()
+        # and stop_profiling(), or send the process profile_signal (e.g.,
+        # signal.SIGUSR2) to toggle it (in every bot using that signal);
+        # profiles are written to profile_dir (default: the current
+        # directory) as collapsed stacks or speedscope
+        self.profile_signal = profile_signal
+        self.profile_interval = profile_interval
+        self.profile_format = profile_format
+        self.profile_dir = profile_dir
+        self.profiler = None
+
+        # registration_info is what's still to be sent on this connection;
+        # run() resets it from registration so reconnects register again
+        self.registration = RegistrationInfo(
             nick=nick,
             passwd=passwd,
             username=username,
             realname=realname,
             hostname=hostname,
         )
+        self.registration_info = self.registration
 
-    def start(self, *other_jobs):
-        log.debug("start() starting asyncio.event_loop")
-        self.running = True
-        if other_jobs:
-            self.main_coro = asyncio.gather(*((self.main(),) + other_jobs))
-        else:
-            self.main_coro = self.main()
-        loop = asyncio.get_event_loop()
-        # once we set this task factory, any new task we create
-        # is automatically tracked in self.tasks
-        loop.set_task_factory(self.task_factory)
-        log.debug("start() building connection")
-        self.sock = IRCConnection(
+    @property
+    def handlers(self):
+        return self._handlers
+
+    @handlers.setter
+    def handlers(self, handlers):
+        if not isinstance(handlers, HandlerList):
+            handlers = HandlerList(handlers)
+        self._handlers = handlers
+        self._reply_mode_key = None
+
+    @property
+    def nick(self):
+        return self.registration.get("nick")
+
+    def __await__(self):
+        # a TWILoop is a plain awaitable: "await loop" is "await loop.run()"
+        return self.run().__await__()
+
+    def connection(self):
+        return IRCConnection(
             host=self.host,
             port=self.port,
             use_ssl=self.use_ssl,
             verify_ssl=self.verify_ssl,
         )
-        log.debug("start() adding signal handlers")
-        loop.add_signal_handler(signal.SIGINT, self.signal_handler, signal.SIGINT)
-        loop.add_signal_handler(signal.SIGTERM, self.signal_handler, signal.SIGTERM)
-        loop.add_signal_handler(signal.SIGQUIT, self.signal_handler, signal.SIGQUIT)
+
+    async def run(self, *other_jobs, name_tasks=False, signals=False):
+        """
+        Run the bot (and any other_jobs coroutines alongside it) in whatever
+        event loop is already running; so this works under asyncio.run(),
+        uvloop, or an application's own loop, next to any number of other
+        bots (see twichat.supervisor):
+
+            asyncio.run(loop.run())
+
+        name_tasks gives the loop's tasks descriptive names (file, line and
+        coroutine name), which is handy in debug dumps but costs a little
+        per task. signals installs SIGINT/SIGTERM/SIGQUIT handlers that
+        stop() the bot (they're removed again when run() returns).
+        """
+        log.debug("run() starting up")
+        self.running = True
+        self.registration_info = self.registration
+        self.name_tasks = name_tasks
+        if self.sock is None:
+            log.debug("run() building connection")
+            self.sock = self.connection()
+        loop = asyncio.get_running_loop()
+        signos = (signal.SIGINT, signal.SIGTERM, signal.SIGQUIT) if signals else ()
+        for signo in signos:
+            log.debug("run() adding signal handler for signo=%d", signo)
+            loop.add_signal_handler(signo, self.signal_handler, signo)
+        if self.profile_signal is not None:
+            bots = _PROFILE_SIGNAL_BOTS.setdefault(self.profile_signal, list())
+            if not bots:
+                loop.add_signal_handler(
+                    self.profile_signal, toggle_profiling_all, self.profile_signal
+                )
+            bots.append(self)
+        try:
+            if other_jobs:
+                await asyncio.gather(self.main(), *other_jobs)
+            else:
+                await self.main()
+        finally:
+            for signo in signos:
+                loop.remove_signal_handler(signo)
+            if self.profile_signal is not None:
+                bots = _PROFILE_SIGNAL_BOTS[self.profile_signal]
+                bots.remove(self)
+                if not bots:
+                    del _PROFILE_SIGNAL_BOTS[self.profile_signal]
+                    loop.remove_signal_handler(self.profile_signal)
+            if self.profiling:
+                self.stop_profiling()
+
+    def start(self, *other_jobs, fast_loop=False):
+        """
+        Run the bot until it stops, taking over the process: this installs
+        the signal handlers and names tasks, then hands run() to asyncio.run().
+        With fast_loop, uvloop is used if it's installed.
+        """
+        if fast_loop:
+            policy = fast_loop_policy()
+            if policy is None:
+                log.info("start() uvloop is not installed, using asyncio's loop")
+            else:
+                asyncio.set_event_loop_policy(policy)
+        log.debug("start() starting asyncio.run()")
         try:
-            loop.run_until_complete(self.main_coro)
+            asyncio.run(self.run(*other_jobs, name_tasks=True, signals=True))
         except asyncio.exceptions.CancelledError:
             pass
 
     def signal_handler(self, signo):
         if signo == 2:
             print(" ")  # otherwise the screen looks like shit with a ^C on that line
-        log.info("received signal=%d, issuing stop()")
+        log.info("received signal=%d, issuing stop()", signo)
         self.stop()
 
-    def task_factory(self, loop, coro, name=None):
-        if name is None:
-            try:
-                cobj = coro.cr_code
-                fname = cobj.co_filename
-                if fname.startswith(INSTALL_DIR):
-                    fname = fname[len(INSTALL_DIR) + 1 :]
-                if fname.startswith(PYTHON_DIR):
-                    fname = fname[len(PYTHON_DIR) + 1 :]
-                name = f"{fname}.{cobj.co_firstlineno}:{cobj.co_name}"
-            except Exception as e:
-                log.debug("failed to build a name for coro: %s", e)
-        task = asyncio.tasks.Task(coro, loop=loop, name=name)
-        if coro is not self.main_coro:
-            self.tasks.append(task)
+    @property
+    def profiling(self):
+        return self.profiler is not None and self.profiler.running
+
+    def start_profiling(self, interval=None):
+        """
+        Start sampling the stacks of the thread the event loop runs in (call
+        this from that thread; the signal handler does).
+        """
+        if self.profiling:
+            return self.profiler
+        self.profiler = SamplingProfiler(
+            interval=self.profile_interval if interval is None else interval
+        )
+        self.profiler.start()
+        return self.profiler
+
+    def stop_profiling(self, path=None, fmt=None):
+        """
+        Stop the profiler and write what it saw to path (by default, a
+        timestamped twichat-<pid>-<bot>-<time>.collapsed or .speedscope.json
+        in profile_dir, where bot tells apart the bots of one process).
+        Returns the path written (None if not profiling).
+        """
+        if not self.profiling:
+            return None
+        self.profiler.stop()
+        fmt = self.profile_format if fmt is None else fmt
+        if path is None:
+            ext = "speedscope.json" if fmt == "speedscope" else "collapsed"
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            path = os.path.join(
+                self.profile_dir or os.curdir,
+                f"twichat-{os.getpid()}-{id(self):x}-{stamp}.{ext}",
+            )
+        self.profiler.write(path, fmt=fmt)
+        log.info("stop_profiling() wrote %d samples to %s", self.profiler.samples, path)
+        return path
+
+    def toggle_profiling(self):
+        if self.profiling:
+            return self.stop_profiling()
+        self.start_profiling()
+        return None
+
+    def create_task(self, coro, name=None):
+        """
+        Start a task and keep track of it in self.tasks; main() waits for
+        these to finish before it returns.
+        """
+        if name is None and self.name_tasks:
+            name = task_name(coro)
+        task = asyncio.create_task(coro, name=name)
+        self.tasks[task] = task.get_loop().time()
+        self.tasks_started += 1
+        task.add_done_callback(self.task_done)
         return task
 
-    def stop(self):
+    def task_done(self, task):
+        self.tasks.pop(task, None)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.tasks_failed += 1
+            log.error(
+                "task_done() task=%s failed: %s", task.get_name(), error, exc_info=error
+            )
+
+    def task_report(self, older_than=0):
+        """
+        The (name, seconds running) of the pending tasks that have been
+        running for more than older_than seconds, longest running first.
+        """
+        if not self.tasks:
+            return list()
+        now = asyncio.get_running_loop().time()
+        return sorted(
+            (
+                (task.get_name(), now - started)
+                for task, started in self.tasks.items()
+                if now - started > older_than
+            ),
+            key=lambda x: -x[1],
+        )
+
+    async def report_tasks(self):
+        while True:
+            await asyncio.sleep(self.task_report_interval)
+            log.info(
+                "report_tasks() %d pending, %d started, %d failed",
+                len(self.tasks),
+                self.tasks_started,
+                self.tasks_failed,
+            )
+            for name, seconds in self.task_report(self.long_task_seconds):
+                log.info("report_tasks() task=%s running for %.1fs", name, seconds)
+
+    def stop(self, reason=None):
+        """
+        Ask the bot to quit. main() stops reading and handling lines and
+        shutdown() takes it from there.
+        """
+        log.debug("stop() reason=%s", reason)
         self.running = False
-        if self.sock is not None and not self.sock.closed:
-            self.sock.close()
+        self.quitting = True
+        self.quit_reason = reason
+        self.inbound.close()
+
+    async def shutdown(self):
+        """
+        Close down the session within shutdown_timeout seconds: stop reading,
+        write out what's queued to send (control messages first), send QUIT
+        if we were stop()ed, close the connection and flush the handlers
+        that have a flush() (e.g. RawLog). Tasks still running after that are
+        given whatever time is left and then cancelled.
+
+        Returns (and keeps in self.shutdown_report) a count of what didn't
+        make it: lines read but never handled, messages never sent and tasks
+        cancelled.
+        """
+        self.running = False
+        clock = asyncio.get_running_loop().time
+        deadline = clock() + self.shutdown_timeout
+        report = dict(unhandled=len(self.inbound), unsent=0, cancelled=0)
+        # lines from this connection make no sense on the next one
+        self.inbound.clear()
+        if self.reader is not None:
+            self.reader.cancel()
+        self.flush_batches()
+        self.outbound.close()
+        if self.writer is not None:
+            await asyncio.wait((self.writer,), timeout=max(0, deadline - clock()))
+            if not self.writer.done():
+                log.debug("shutdown() out of time while writing")
+                self.writer.cancel()
+        report["unsent"] = len(self.outbound)
+        if self.quitting and not self.sock.closed:
+            try:
+                await asyncio.wait_for(
+                    self.sock.send(QUIT(self.quit_reason)),
+                    timeout=max(0, deadline - clock()),
+                )
+            except asyncio.TimeoutError:
+                report["unsent"] += 1
+        if not self.sock.closed:
+            # what's still in the write buffer isn't confirmed (see
+            # twichat.queues.DurableOutboundQueue) until it's with the kernel
+            while self.sock.write_buffer_size() and clock() < deadline:
+                await asyncio.sleep(0.01)
+            if not self.sock.write_buffer_size():
+                self.outbound.confirm()
+        self.outbound.sync()
+        self.sock.close()
+        for handler in self.handlers:
+            if callable(getattr(handler, "flush", None)):
+                handler.flush()
+        if self.tasks:
+            log.debug("shutdown() just waiting for the last few tasks to finish")
+            await asyncio.wait(tuple(self.tasks), timeout=max(0, deadline - clock()))
+            for task in tuple(self.tasks):
+                task.cancel()
+                report["cancelled"] += 1
+        self.quitting = False
+        self.shutdown_report = report
+        if any(report.values()):
+            log.info("shutdown() dropped %s", report)
+        return report
 
     def send(self, message):
         log.debug("send() invoking SendRawHandler(message=%s)", message)
         if self.iter_handlers(message, filter_cls=SendRawHandler):
             log.debug("send() a handler says we should abort sending: %s", message)
             return
-        self.sock.writeline(message)
+        self.outbound.put(message)
+
+    async def send_later(self, agen):
+        try:
+            async for message in agen:
+                if not self.running:
+                    log.debug("send_later() not running, dropping %s", message)
+                    break
+                if message is not None:
+                    self.send(message)
+        finally:
+            await agen.aclose()
 
     async def readline(self):
         return await self.sock.readline()
 
-    def iter_handlers(self, handle_me, filter_cls=ReplyHandler):
+    def iter_handlers(
+        self, handle_me, filter_cls=ReplyHandler, shapes=None, dedup_key=None
+    ):
+        """
+        Hand handle_me to each handler of filter_cls. With shapes (a
+        ReplyShapes), each reply handler gets the shape its reply_mode
+        asks for instead. With dedup_key (see twichat.dedup.DedupCache.key),
+        pure handlers get their verdicts from the dedup cache.
+        """
         log.debug("iter_handlers() iterating about %s using %s", handle_me, filter_cls)
         stop_handles = False
         to_remove = list()
         for handler in self.handlers:
             log.debug("iter_handlers() considering handler=%s", handler)
-            if isinstance(handler, filter_cls):
+            batched = filter_cls is ReplyHandler and isinstance(
+                handler, BatchReplyHandler
+            )
+            if batched or isinstance(handler, filter_cls):
                 try:
-                    res = handler(handle_me)
-                except Exception as error1:
-                    try:
-                        log.error(
-                            "iter_handlers() error handling handle_me=%s with handler=%s: %s",
-                            handle_me,
-                            handler,
-                            error1,
-                        )
-                    except Exception as error2:
-                        log.error(
-                            'iter_handlers() error logging error="%s": %s',
-                            error1,
-                            error2,
-                            exc_info=True,
-                        )
+                    shaped = handle_me
+                    if shapes is not None:
+                        shaped = shapes[handler.reply_mode]
+                    if batched:
+                        if handler.wants(shaped):
+                            self.batch_reply(handler, shaped)
+                        continue
+                    if (
+                        dedup_key is not None
+                        and getattr(handler, "pure", False)
+                        and handler.reply_mode == REPLY
+                    ):
+                        verdict = self.dedup.classify(handler, shaped, dedup_key)
+                        send = handler.respond(shaped, verdict)
+                        res = HandlerResult(send=send) if send else None
+                    else:
+                        res = handler(shaped)
+                except Exception as error:
+                    self.handler_error("iter_handlers", handle_me, handler, error)
                     continue
                 if isinstance(res, HandlerResult):
-                    if res.send:
-                        log.debug("iter_handlers() handler has something to say")
-                        if isinstance(res.send, (list, tuple)):
-                            for item in res.send:
-                                self.send(item)
-                        else:
-                            self.send(res.send)
+                    self.apply_result(res)
                     if res.done:
                         log.debug(
                             "iter_handlers() handler says it fulfilled its purpose"
@@ -167,11 +569,6 @@ class TWILoop:
                         log.debug("iter_handlers() handler says it handled the message")
                         stop_handles = True
                         break
-                    if res.stop_mainloop:
-                        log.debug(
-                            "iter_handlers() handler says this whole circus is done"
-                        )
-                        self.stop()
                 elif res is not None:
                     log.debug("ignoring result=%s from handler=%s", res, handler)
         for handler in to_remove:
@@ -180,50 +577,266 @@ class TWILoop:
         # see `if self.iter_handlers(...RawHandler...)` below
         return stop_handles
 
-    async def handle_message(self, message):
-        if self.registration_info:
-            log.debug(
-                "handle_message() sending registration info %s", self.registration_info
+    def handler_error(self, caller, handle_me, handler, error1):
+        try:
+            log.error(
+                "%s() error handling handle_me=%s with handler=%s: %s",
+                caller,
+                handle_me,
+                handler,
+                error1,
             )
+        except Exception as error2:
+            log.error(
+                '%s() error logging error="%s": %s',
+                caller,
+                error1,
+                error2,
+                exc_info=True,
+            )
+
+    def apply_result(self, res):
+        """
+        Act on a HandlerResult's send and stop_mainloop (done and
+        stop_handles are up to the caller).
+        """
+        if res.send:
+            log.debug("apply_result() handler has something to say")
+            send = res.send
+            if not isinstance(send, (list, tuple)):
+                send = (send,)
+            for item in send:
+                if inspect.isasyncgen(item):
+                    self.create_task(self.send_later(item))
+                else:
+                    self.send(item)
+        if res.stop_mainloop:
+            log.debug("apply_result() handler says this whole circus is done")
+            self.stop()
+
+    def batch_reply(self, handler, reply):
+        key, full = handler.add(reply)
+        if full:
+            self.flush_batch(handler, key)
+        elif key not in handler.timers:
+            handler.timers[key] = asyncio.get_running_loop().call_later(
+                handler.max_delay, self.flush_batch, handler, key
+            )
+
+    def flush_batch(self, handler, key):
+        """
+        Hand the replies batched under key to handler.accept_batch() and act
+        on the results.
+        """
+        replies = handler.take(key)
+        if not replies:
+            return
+        log.debug("flush_batch() %d replies for %s", len(replies), handler)
+        try:
+            results = handler.accept_batch(replies)
+            if results is None:
+                return
+            if isinstance(results, HandlerResult):
+                results = (results,)
+            else:
+                results = list(results)
+                if len(results) != len(replies):
+                    log.error(
+                        "flush_batch() handler=%s gave %d results for %d replies,"
+                        " ignoring them",
+                        handler,
+                        len(results),
+                        len(replies),
+                    )
+                    return
+        except Exception as error:
+            self.handler_error("flush_batch", replies, handler, error)
+            return
+        done = False
+        for res in results:
+            if not res:
+                continue
+            if not isinstance(res, HandlerResult):
+                res = HandlerResult(send=res)
+            self.apply_result(res)
+            done = done or res.done
+        if done and handler in self.handlers:
+            log.debug("flush_batch() handler says it fulfilled its purpose")
+            self.handlers.remove(handler)
+            self.flush_batches(handler)
+
+    def flush_batches(self, only=None):
+        """
+        Flush every pending batch now (of only that handler, if given).
+        """
+        for handler in list(self.handlers) if only is None else (only,):
+            if isinstance(handler, BatchReplyHandler):
+                for key in list(handler.pending):
+                    self.flush_batch(handler, key)
+
+    def register(self):
+        if self.caps:
+            # CAP LS goes first so IRCv3 servers hold registration until
+            # we're done negotiating
+            self.negotiator = CapNegotiator(self.caps)
+            self.capabilities = frozenset()
+            for message in self.negotiator.start():
+                self.sock.writeline(message)
+        if self.registration_info:
+            log.debug("register() sending registration info %s", self.registration_info)
             # we don't know how long it takes to send, and this loop is async,
             # so we prevent accidentally re-sending by deleting the reginfo
             # before sending.
             ri = self.registration_info
             self.registration_info = False
             self.sock.register(**ri)
+
+    async def negotiate(self):
+        """
+        Read lines until the capability negotiation is done (or cap_timeout
+        runs out). Returns the lines read, so they can still be handled (in
+        order) once the handlers can count on loop.capabilities.
+        """
+        neg = self.negotiator
+        held = list()
+        clock = asyncio.get_running_loop().time
+        deadline = clock() + self.cap_timeout
+        while not neg.done:
+            try:
+                line = await asyncio.wait_for(
+                    self.inbound.get(), timeout=max(0, deadline - clock())
+                )
+            except asyncio.TimeoutError:
+                log.info("negotiate() server didn't answer CAP in time")
+                for message in neg.give_up():
+                    self.send(message)
+                break
+            if line is None:
+                break
+            held.append(line)
+            for message in neg.feed(grok(line)):
+                self.send(message)
+        self.capabilities = frozenset(neg.acked)
+        log.debug("negotiate() capabilities=%s", sorted(self.capabilities))
+        return held
+
+    def reply_mode(self):
+        """
+        The richest of the modes the reply handlers ask for (see reply_mode
+        in twichat.handlers; history needs full replies). Each line is parsed
+        once in that mode and each handler gets the shape it asked for,
+        derived from that (see twichat.irc.reply.ReplyShapes). None when
+        nothing wants replies at all, in which case lines aren't parsed.
+
+        This is only worked out again when the handlers change.
+        """
+        key = (self.handlers.version, self.history is None)
+        if key != self._reply_mode_key:
+            modes = [
+                handler.reply_mode
+                for handler in self.handlers
+                if isinstance(handler, (ReplyHandler, BatchReplyHandler))
+            ]
+            if self.history is not None:
+                modes.append(REPLY)
+            self._reply_mode = richest_mode(modes)
+            self._reply_mode_key = key
+            self._pure_handlers = any(
+                getattr(handler, "pure", False) and handler.reply_mode == REPLY
+                for handler in self.handlers
+                if isinstance(handler, ReplyHandler)
+            )
+        return self._reply_mode
+
+    async def handle_message(self, message):
         log.debug("handle_message() invoking RawHandler(message=%s)", message)
         if self.iter_handlers(message, filter_cls=RawHandler) is True:
             log.debug('handle_message() RawHandler "handled" message')
             return
-        reply = grok(message)
+        mode = self.reply_mode()
+        if mode is None:
+            return
+        shapes = ReplyShapes(message)
+        reply = shapes[mode]
+        if self.history is not None:
+            self.history.record(reply)
+        dedup_key = None
+        if self.dedup is not None and self._pure_handlers:
+            # normalized once here, however many pure handlers there are
+            dedup_key = self.dedup.key(shapes[REPLY])
         log.debug("handle_message() invoking ReplyHandler(reply=%s)", reply)
-        self.iter_handlers(reply)
+        self.iter_handlers(reply, shapes=shapes, dedup_key=dedup_key)
+
+    async def read_lines(self):
+        try:
+            while self.running:
+                line = await self.readline()  # NOTE: conn.readline issues rstrip()
+                if not line:
+                    log.debug("read_lines() line was false, done reading")
+                    break
+                await self.inbound.put(line)
+        finally:
+            self.inbound.close()
+
+    async def write_lines(self):
+        while not self.sock.closed:
+            message = await self.outbound.get()
+            if message is None:
+                break
+            if await self.sock.send(message) is False:
+                # the connection went away; what's left waits for the next
+                self.outbound.unget(message)
+                log.debug("write_lines() closed with %d unsent", len(self.outbound))
+                break
+            self.outbound.ack()
+            if not self.sock.write_buffer_size():
+                self.outbound.confirm()
 
     async def main(self):
         log.debug("main() starting up by starting socket")
         await self.sock.start()
+        # the queues are closed at the end of each session
+        self.inbound.closed = False
+        self.outbound.reopen()
+        # servers like Twitch's say nothing at all until we register
+        self.register()
+        self.reader = self.create_task(self.read_lines())
+        self.writer = self.create_task(self.write_lines())
+        reporter = None
+        if self.task_report_interval:
+            reporter = asyncio.create_task(self.report_tasks())
         log.debug("main() entering mainloop")
-        while self.running:
-            line = await self.readline()  # NOTE: conn.readline issues rstrip()
-            if not line:
-                log.debug("main() line was false, stopping socket")
-                self.stop()
-                break
-            await self.handle_message(line)
-            await self.check_on_pending_tasks()
-        log.debug("main() seems like we're done here")
-        if self.tasks:
-            log.debug("main() just waiting for the last few tasks to finish")
-            await asyncio.gather(*self.tasks)
+        try:
+            if self.negotiator is not None:
+                for line in await self.negotiate():
+                    await self.handle_message(line)
+            while self.running:
+                line = await self.inbound.get()
+                if line is None:
+                    log.debug("main() nothing left to read")
+                    break
+                await self.handle_message(line)
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+            log.debug("main() seems like we're done here")
+            await self.shutdown()
         log.debug("FIN")
 
-    async def check_on_pending_tasks(self):
-        self.tasks = [task for task in self.tasks if not task.done()]
-        for task in self.tasks:
-            log.debug("check_on_pending_tasks() task=%s", task.get_name())
+    def metrics(self):
+        return dict(
+            inbound=self.inbound.stats(),
+            outbound=self.outbound.stats(),
+            tasks=dict(
+                pending=len(self.tasks),
+                started=self.tasks_started,
+                failed=self.tasks_failed,
+            ),
+        )
 
 
 def twitch(*a, **kw):
+    kw.setdefault("caps", TWITCH_CAPS + IRCV3_CAPS)
     return TWILoop(*a, **kw)
 
 
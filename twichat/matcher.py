@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Matching chat text against lots of patterns at once.
+
+A bot with hundreds of banned phrases and !commands shouldn't have to try
+them one at a time on every message. The PatternMatcher keeps the literal
+phrases in an Aho-Corasick automaton (a trie with failure links, so every
+literal is found in a single pass over the text) and folds the regular
+expressions into one combined alternation that tells which of them are
+worth trying.
+
+    m = PatternMatcher(ignore_case=True, whole_words=True)
+    m.add_literal("spam", "buy followers")
+    m.add_pattern("cmd", r"^!(\\w+)")
+    for hit in m.find_all(reply.msg):
+        print(hit.key, hit.start, hit.end, hit.text)
+
+The lists can change at any time; the automaton and the combined pattern are
+rebuilt (once) the next time something is matched.
+"""
+
+import re
+import logging
+from collections import namedtuple, deque
+
+from .handlers import ReplyHandler
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # python < 3.11
+    import sre_parse
+    import sre_constants
+
+log = logging.getLogger(__name__)
+
+Hit = namedtuple("Hit", ["key", "start", "end", "text"])
+
+# numbered or named backreferences break when patterns are glued together
+_BACKREF = re.compile(r"\\[1-9]|\(\?P=")
+_SCOPED_FLAGS = ((re.I, "i"), (re.M, "m"), (re.S, "s"), (re.X, "x"))
+
+
+def scoped_pattern(pattern):
+    """
+    Return the source of a compiled pattern wrapped in a group that carries
+    its flags, so it keeps its meaning when it's glued to other patterns.
+    """
+    flags = "".join(f for bit, f in _SCOPED_FLAGS if pattern.flags & bit)
+    if flags:
+        return f"(?{flags}:{pattern.pattern})"
+    return f"(?:{pattern.pattern})"
+
+
+def combinable(pattern):
+    return not _BACKREF.search(pattern.pattern)
+
+
+def combine_patterns(patterns):
+    """
+    Glue compiled patterns together into one alternation. The result matches
+    (using search()) exactly when at least one of the patterns would. Returns
+    None if the patterns can't be combined (e.g., they use backreferences or
+    global inline flags).
+    """
+    patterns = list(patterns)
+    if not patterns:
+        return None
+    if not all(combinable(p) for p in patterns):
+        return None
+    try:
+        return re.compile("|".join(scoped_pattern(p) for p in patterns))
+    except re.error as e:
+        log.debug("combine_patterns() unable to combine patterns: %s", e)
+        return None
+
+
+def lookahead_patterns(patterns):
+    """
+    Glue compiled patterns together into a sequence of optional lookaheads,
+    each in a group named _0, _1, … (in order). The result always matches
+    the empty string; used with match(text, pos), the groups that took part
+    tell which of the patterns match at pos (an alternation only ever tells
+    one). Returns None if the patterns can't be combined.
+    """
+    patterns = list(patterns)
+    if not patterns:
+        return None
+    if not all(combinable(p) for p in patterns):
+        return None
+    parts = (f"(?:(?=(?P<_{i}>{scoped_pattern(p)})))?" for i, p in enumerate(patterns))
+    try:
+        return re.compile("".join(parts))
+    except re.error as e:
+        log.debug("lookahead_patterns() unable to combine patterns: %s", e)
+        return None
+
+
+def required_literal(pattern):
+    """
+    Return the longest run of literal characters that every match of the
+    compiled pattern must contain (or None if there's no such run).
+
+        required_literal(re.compile(r"\\bkappa\\d+")) → "kappa"
+        required_literal(re.compile(r"a|b")) → None
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception as e:  # pylint: disable=broad-except
+        log.debug("required_literal() unable to parse %s: %s", pattern, e)
+        return None
+
+    best = ""
+
+    def walk(items):
+        nonlocal best
+        run = list()
+        for op, av in items:
+            if op is sre_constants.LITERAL:
+                run.append(chr(av))
+                continue
+            if len(run) > len(best):
+                best = "".join(run)
+            run = list()
+            if op is sre_constants.SUBPATTERN:
+                # (?i:...) groups can match other cases than the ones written
+                if not av[1] & sre_constants.SRE_FLAG_IGNORECASE:
+                    walk(av[-1])
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+                if av[0] >= 1:
+                    walk(av[-1])
+        if len(run) > len(best):
+            best = "".join(run)
+
+    walk(parsed)
+    return best or None
+
+
+def lower_same_length(text):
+    """
+    str.lower(), unless that would change the length of the string (e.g.,
+    'İ'), in which case the offending characters are left alone so offsets
+    in the result still line up with the original.
+    """
+    low = text.lower()
+    if len(low) == len(text):
+        return low
+    return "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+class AhoCorasick:
+    """
+    An Aho-Corasick automaton for a fixed set of literals.
+
+        ac = AhoCorasick({"k1": "he", "k2": "she", "k3": "hers"})
+        list(ac.finditer("ushers")) → [("k2", 1, 4), ("k1", 2, 4), ("k3", 2, 6)]
+
+    finditer() reports every occurrence of every literal, overlaps included,
+    in order of where they end.
+    """
+
+    def __init__(self, literals):
+        # state 0 is the root; goto[s] maps a character to the next state,
+        # out[s] lists the (key, length) of each literal ending at state s
+        self.goto = [dict()]
+        self.fail = [0]
+        self.out = [()]
+        for key, literal in literals.items():
+            if not literal:
+                raise ValueError(f"empty literal for key={key}")
+            state = 0
+            for ch in literal:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append(dict())
+                    self.fail.append(0)
+                    self.out.append(())
+                state = nxt
+            self.out[state] += ((key, len(literal)),)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                f = self.goto[f].get(ch, 0)
+                self.fail[nxt] = f
+                if self.out[f]:
+                    self.out[nxt] += self.out[f]
+
+    def __len__(self):
+        return len(self.goto)
+
+    def finditer(self, text):
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for key, length in out[state]:
+                    yield key, i + 1 - length, i + 1
+
+
+class PatternMatcher:
+    """
+    Finds all the literals and regular expressions that occur in a piece of
+    text.
+
+    ignore_case :- literals are matched case insensitively (regexes can use
+                   re.I or (?i:...) themselves)
+    whole_words :- literal hits are only reported when they aren't in the
+                   middle of a word (so "ass" doesn't hit "class")
+
+    Keys can be anything hashable. Each key has exactly one literal or
+    pattern; adding a key again replaces it.
+
+    Python's re module tries the alternatives of a big alternation one after
+    the other at every position, so gluing thousands of regexes together
+    doesn't scale. Instead, each regex that contains a run of literal
+    characters it can't match without (e.g., "kappa" in r"\\bkappa\\d+") has
+    that run added to the Aho-Corasick automaton, and a regex is only tried
+    when its literal turns up in the text. The few regexes without such a
+    literal are glued into one combined alternation that rules them all out
+    in one search when none of them match (when they can't be combined, e.g.
+    because they use backreferences, they're searched one at a time).
+
+    All hits are reported, overlapping ones included, but each regex on its
+    own reports non-overlapping matches (as re.finditer() does).
+    """
+
+    min_required = 2
+
+    def __init__(
+        self, literals=None, patterns=None, ignore_case=True, whole_words=False
+    ):
+        self.ignore_case = ignore_case
+        self.whole_words = whole_words
+        self.literals = dict()
+        self.patterns = dict()
+        self._ac = self._combined = None
+        self._keys = self._loners = ()
+        self.dirty = True
+        for key, literal in (literals or dict()).items():
+            self.add_literal(key, literal)
+        for key, pattern in (patterns or dict()).items():
+            self.add_pattern(key, pattern)
+
+    def add_literal(self, key, literal):
+        if not literal:
+            raise ValueError(f"empty literal for key={key}")
+        self.patterns.pop(key, None)
+        self.literals[key] = literal
+        self.dirty = True
+
+    def add_pattern(self, key, pattern):
+        self.literals.pop(key, None)
+        self.patterns[key] = re.compile(pattern)
+        self.dirty = True
+
+    def remove(self, key):
+        self.literals.pop(key, None)
+        self.patterns.pop(key, None)
+        self.dirty = True
+
+    def __len__(self):
+        return len(self.literals) + len(self.patterns)
+
+    def __contains__(self, key):
+        return key in self.literals or key in self.patterns
+
+    def rebuild(self):
+        # The automaton keys are (True, key) for literals and (False, key)
+        # for the literal runs required by regexes. Everything is searched
+        # for in the lowercased text when ignore_case is set, which is fine
+        # for the regex runs since finding them is only a hint.
+        ac_keys = dict()
+        for key, literal in self.literals.items():
+            if self.ignore_case:
+                literal = lower_same_length(literal)
+            ac_keys[(True, key)] = literal
+
+        keys = list()
+        together = list()
+        loners = list()
+        for key, pattern in self.patterns.items():
+            hint = required_literal(pattern)
+            if hint is not None and len(hint) >= self.min_required:
+                if self.ignore_case:
+                    ac_keys[(False, key)] = lower_same_length(hint)
+                    continue
+                if not pattern.flags & re.I:
+                    ac_keys[(False, key)] = hint
+                    continue
+            if combinable(pattern):
+                keys.append(key)
+                together.append(pattern)
+            else:
+                loners.append((key, pattern))
+        combined = combine_patterns(together)
+        if together and combined is None:
+            loners.extend(zip(keys, together))
+            keys = list()
+        ac = AhoCorasick(ac_keys) if ac_keys else None
+
+        # swap everything in at once
+        self._ac, self._combined = ac, combined
+        self._keys, self._loners = tuple(keys), tuple(loners)
+        self.dirty = False
+        log.debug(
+            "rebuild() literals=%d patterns=%d combined=%d loners=%d",
+            len(self.literals),
+            len(self.patterns),
+            len(keys),
+            len(loners),
+        )
+
+    def _word_edge(self, text, start, end):
+        if start > 0 and (text[start - 1].isalnum() or text[start - 1] == "_"):
+            return False
+        if end < len(text) and (text[end].isalnum() or text[end] == "_"):
+            return False
+        return True
+
+    def finditer(self, text):
+        if self.dirty:
+            self.rebuild()
+        if self._ac is not None:
+            hinted = set()
+            haystack = lower_same_length(text) if self.ignore_case else text
+            for (is_lit, key), start, end in self._ac.finditer(haystack):
+                if not is_lit:
+                    hinted.add(key)
+                    continue
+                if self.whole_words and not self._word_edge(text, start, end):
+                    continue
+                yield Hit(key, start, end, text[start:end])
+            for key in hinted:
+                for m in self.patterns[key].finditer(text):
+                    yield Hit(key, m.start(), m.end(), m.group())
+        if self._combined is not None:
+            # The alternation only reports one hit per position, so it's just
+            # used to find out whether (and from where) any of its patterns
+            # match; each of them is then searched on its own.
+            first = self._combined.search(text)
+            if first is not None:
+                for key in self._keys:
+                    pattern = self.patterns[key]
+                    for m in pattern.finditer(text, first.start()):
+                        yield Hit(key, m.start(), m.end(), m.group())
+        for key, pattern in self._loners:
+            for m in pattern.finditer(text):
+                yield Hit(key, m.start(), m.end(), m.group())
+
+    def find_all(self, text):
+        return list(self.finditer(text))
+
+    def search(self, text):
+        """
+        Return the first Hit found, or None. Cheaper than find_all() when
+        you only need to know whether anything matched.
+        """
+        for hit in self.finditer(text):
+            return hit
+        return None
+
+
+class MatchHandler(ReplyHandler):
+    """
+    Runs a PatternMatcher over the text of each message and dispatches every
+    hit to the callback registered for its key. Callbacks are called as
+    callback(reply, hit) and whatever they return is sent (just like the
+    return value of accept()).
+
+        mh = MatchHandler(ignore_case=True, whole_words=True)
+        mh.on_literal("no-spam", "buy followers", lambda r, h: f"PRIVMSG {r.channel} :/timeout {r.sender} 600")
+        mh.on_pattern("hello", r"^!hello\\b", lambda r, h: TargetMessage(r.channel, "hi"))
+        loop.handlers.append(mh)
+
+    Only replies with message text (PRIVMSG and the like) are considered.
+    """
+
+    def __init__(self, matcher=None, **kw):
+        self.matcher = PatternMatcher(**kw) if matcher is None else matcher
+        self.callbacks = dict()
+
+    def on_literal(self, key, literal, callback):
+        self.matcher.add_literal(key, literal)
+        self.callbacks[key] = callback
+
+    def on_pattern(self, key, pattern, callback):
+        self.matcher.add_pattern(key, pattern)
+        self.callbacks[key] = callback
+
+    def remove(self, key):
+        self.matcher.remove(key)
+        self.callbacks.pop(key, None)
+
+    def accept(self, reply):
+        if reply.command.name not in ("PRIVMSG", "NOTICE", "WHISPER"):
+            return None
+        msg = reply.msg
+        if not msg:
+            return None
+        send = list()
+        for hit in self.matcher.finditer(msg):
+            callback = self.callbacks.get(hit.key)
+            if callback is None:
+                continue
+            res = callback(reply, hit)
+            if isinstance(res, (list, tuple)):
+                send.extend(res)
+            elif res:
+                send.append(res)
+        return send or None
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+A small sampling profiler for live bots; no external profiler needed.
+
+A background thread looks at the event loop thread's stack every interval
+seconds and counts the stacks it sees. Frames are labeled by file and
+qualified name, so handler time shows up under the handler's class
+(Chatty.accept) and twichat's own stages under theirs
+(TWILoop.handle_message, ReplyTransformer.reply, …).
+
+    prof = SamplingProfiler(interval=0.005)
+    prof.start()
+    ...
+    prof.stop()
+    prof.write_collapsed("bot.collapsed")    # for flamegraph.pl / inferno
+    prof.write_speedscope("bot.speedscope")  # for https://www.speedscope.app
+
+TWILoop wraps this up as start_profiling() / stop_profiling(), and can
+toggle it with a signal (see TWILoop's profile_signal).
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from collections import Counter
+
+from .const import INSTALL_DIR, PYTHON_DIR
+
+log = logging.getLogger(__name__)
+
+PARENT_DIR = os.path.dirname(INSTALL_DIR)
+
+
+def frame_label(code):
+    fname = code.co_filename
+    for prefix in (PARENT_DIR, PYTHON_DIR):
+        if fname.startswith(prefix):
+            fname = fname[len(prefix) + 1 :]
+            break
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{fname}:{name}"
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005, thread_id=None, max_depth=128):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = self.stopped = None
+        self._labels = dict()
+        self._thread = None
+        self._running = threading.Event()
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    def start(self):
+        """
+        Start sampling the thread with thread_id (by default, the thread
+        calling start()).
+        """
+        if self.running:
+            return
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self.started = time.time()
+        self._running.set()
+        self._thread = threading.Thread(
+            target=self._sample_loop, name="twichat-profiler", daemon=True
+        )
+        self._thread.start()
+        log.info("start() sampling every %ss", self.interval)
+
+    def stop(self):
+        if not self.running:
+            return
+        self._running.clear()
+        self._thread.join()
+        self._thread = None
+        self.stopped = time.time()
+        log.info("stop() took %d samples", self.samples)
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = frame_label(code)
+        return label
+
+    def sample(self):
+        # pylint: disable=protected-access
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        stack = list()
+        while frame is not None and len(stack) < self.max_depth:
+            stack.append(self._label(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        self.stacks[tuple(stack)] += 1
+        self.samples += 1
+
+    def _sample_loop(self):
+        while self._running.is_set():
+            self.sample()
+            time.sleep(self.interval)
+
+    def totals(self, match=None):
+        """
+        Samples per frame label, counting each stack a label appears in once
+        (i.e., time spent in that function and whatever it called). match
+        narrows it to labels containing that string:
+
+            prof.totals("twichat/")       # twichat's own stages
+            prof.totals(".accept")        # per handler class
+        """
+        res = Counter()
+        for stack, count in self.stacks.items():
+            for label in set(stack):
+                if match is None or match in label:
+                    res[label] += count
+        return res
+
+    def collapsed(self):
+        """
+        The samples in the "collapsed stack" format flamegraph tools read: a
+        line per distinct stack, frames separated by ';', then the count.
+        """
+        return "".join(
+            ";".join(stack) + f" {count}\n"
+            for stack, count in self.stacks.most_common()
+        )
+
+    def speedscope(self, name="twichat"):
+        """
+        The samples as a speedscope (https://www.speedscope.app) document.
+        """
+        frames = list()
+        index = dict()
+        samples = list()
+        weights = list()
+        for stack, count in self.stacks.most_common():
+            ids = list()
+            for label in stack:
+                if label not in index:
+                    index[label] = len(frames)
+                    frames.append(dict(name=label))
+                ids.append(index[label])
+            samples.append(ids)
+            weights.append(count * self.interval)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": dict(frames=frames),
+            "profiles": [
+                dict(
+                    type="sampled",
+                    name=name,
+                    unit="seconds",
+                    startValue=0,
+                    endValue=sum(weights),
+                    samples=samples,
+                    weights=weights,
+                )
+            ],
+            "name": name,
+            "exporter": "twichat.profiler",
+        }
+
+    def write_collapsed(self, path):
+        with open(path, "w") as fh:
+            fh.write(self.collapsed())
+        return path
+
+    def write_speedscope(self, path, name="twichat"):
+        with open(path, "w") as fh:
+            json.dump(self.speedscope(name), fh)
+        return path
+
+    def write(self, path, fmt="collapsed"):
+        if fmt == "speedscope":
+            return self.write_speedscope(path)
+        if fmt == "collapsed":
+            return self.write_collapsed(path)
+        raise ValueError(f"fmt should be collapsed or speedscope, not {fmt}")
@@ -0,0 +1,563 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Queues between the socket and the handlers.
+
+If the handlers fall behind the server, lines pile up in the kernel and SSL
+buffers until the server gives up on us. TWILoop reads lines into an
+InboundQueue as fast as they arrive and dispatches them from there, so when
+things get bad, the queue's overflow policy decides what to give up instead
+of the server:
+
+    block       :- stop reading until there's room (the old behavior; the
+                   server may still disconnect us if it lasts)
+    drop-oldest :- drop the oldest droppable line (PRIVMSG by default);
+                   control lines (PING, RECONNECT, …) are never dropped
+    spill       :- write the overflow to a temporary file and read it back
+                   (in order) as the queue drains
+
+Control lines (PING, RECONNECT, CAP, …; see twichat.const.CONTROL_COMMANDS)
+skip all of that: they go in a separate priority lane that's always emptied
+first. The OutboundQueue does the same for the messages we send, so a PONG
+never waits behind a backlog of chat.
+
+A DurableOutboundQueue also journals the regular lane to a file, so what
+was queued (or sent but not confirmed) when the bot died or got
+disconnected is sent again on the next connection.
+"""
+
+import os
+import struct
+import asyncio
+import logging
+import tempfile
+from collections import deque
+
+from .const import CONTROL_COMMANDS, WS
+from .irc.parser import peek_command
+
+log = logging.getLogger(__name__)
+
+
+def _wake(waiters):
+    while waiters:
+        fut = waiters.popleft()
+        if not fut.done():
+            fut.set_result(None)
+            break
+
+
+async def _wait(waiters):
+    fut = asyncio.get_running_loop().create_future()
+    waiters.append(fut)
+    try:
+        await fut
+    finally:
+        if not fut.done():
+            fut.cancel()
+
+
+def is_priority(message, priority=CONTROL_COMMANDS):
+    """
+    True if the (raw line or twichat.irc.msg.Message) message belongs in
+    the priority lane.
+    """
+    if isinstance(message, str):
+        return peek_command(message) in priority
+    msg = getattr(message, "msg", None)
+    if isinstance(msg, tuple) and msg:
+        # Message.msg is (tags?, COMMAND, args...)
+        cmd = msg[1] if msg[0].startswith("@") and len(msg) > 1 else msg[0]
+        return cmd in priority
+    return peek_command(str(message)) in priority
+
+
+class InboundQueue:
+    BLOCK = "block"
+    DROP_OLDEST = "drop-oldest"
+    SPILL = "spill"
+    POLICIES = (BLOCK, DROP_OLDEST, SPILL)
+
+    def __init__(
+        self,
+        maxsize=10000,
+        policy=BLOCK,
+        droppable=("PRIVMSG",),
+        spill_dir=None,
+        priority=CONTROL_COMMANDS,
+    ):
+        if policy not in self.POLICIES:
+            raise ValueError(f"policy should be one of {self.POLICIES}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.priority = frozenset(priority)
+        self.droppable = frozenset(droppable) - CONTROL_COMMANDS - self.priority
+        self.spill_dir = spill_dir
+        self.control = deque()
+        self.lines = deque()
+        self.closed = False
+        self.max_depth = self.received = self.dropped = self.spilled = 0
+        self._getters = deque()
+        self._putters = deque()
+        self._spill = None
+        self._spill_read = self._spill_write = 0
+        self._spill_pending = 0
+
+    def __len__(self):
+        return len(self.control) + len(self.lines) + self._spill_pending
+
+    def _append(self, line):
+        self.lines.append(line)
+        if len(self.lines) > self.max_depth:
+            self.max_depth = len(self.lines)
+        _wake(self._getters)
+
+    def _drop_oldest(self, line):
+        """
+        Make room by dropping the oldest droppable line. If there isn't one,
+        drop the new line instead, unless it's a control line.
+        """
+        for idx, queued in enumerate(self.lines):
+            if peek_command(queued) in self.droppable:
+                del self.lines[idx]
+                self.dropped += 1
+                self._append(line)
+                return
+        if peek_command(line) in self.droppable:
+            self.dropped += 1
+            return
+        self._append(line)
+
+    def _spill_out(self, line):
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(dir=self.spill_dir)
+        self._spill.seek(self._spill_write)
+        self._spill.write(line.encode("utf-8") + b"\n")
+        self._spill_write = self._spill.tell()
+        self._spill_pending += 1
+        self.spilled += 1
+
+    def _spill_in(self):
+        self._spill.seek(self._spill_read)
+        while self._spill_pending and len(self.lines) < self.maxsize:
+            line = self._spill.readline()
+            self._spill_pending -= 1
+            self.lines.append(line[:-1].decode("utf-8"))
+        self._spill_read = self._spill.tell()
+        if not self._spill_pending:
+            self._spill.seek(0)
+            self._spill.truncate()
+            self._spill_read = self._spill_write = 0
+
+    async def put(self, line):
+        self.received += 1
+        if self.priority and peek_command(line) in self.priority:
+            self.control.append(line)
+            _wake(self._getters)
+            return
+        if self._spill_pending:
+            # keep things in order: once we've spilled, everything spills
+            # until the file is drained
+            self._spill_out(line)
+            return
+        while len(self.lines) >= self.maxsize:
+            if self.policy == self.DROP_OLDEST:
+                self._drop_oldest(line)
+                return
+            if self.policy == self.SPILL:
+                self._spill_out(line)
+                return
+            await _wait(self._putters)
+        self._append(line)
+
+    async def get(self):
+        """
+        Return the next line, waiting for one if necessary. Returns None once
+        the queue is closed and empty. Control lines come out first.
+        """
+        if self.control:
+            return self.control.popleft()
+        while not self.lines:
+            if self._spill_pending:
+                self._spill_in()
+                break
+            if self.closed:
+                return None
+            await _wait(self._getters)
+            if self.control:
+                return self.control.popleft()
+        line = self.lines.popleft()
+        _wake(self._putters)
+        return line
+
+    def clear(self):
+        """
+        Forget every queued line (e.g., what's left of a dead connection).
+        """
+        self.control.clear()
+        self.lines.clear()
+        if self._spill is not None:
+            self._spill.seek(0)
+            self._spill.truncate()
+        self._spill_read = self._spill_write = self._spill_pending = 0
+        _wake(self._putters)
+
+    def close(self):
+        """
+        Tell get() to return None once the queued lines are used up.
+        """
+        self.closed = True
+        while self._getters:
+            _wake(self._getters)
+
+    def stats(self):
+        return dict(
+            depth=len(self),
+            control_depth=len(self.control),
+            max_depth=self.max_depth,
+            received=self.received,
+            dropped=self.dropped,
+            spilled=self.spilled,
+        )
+
+    def __repr__(self):
+        s = self.stats()
+        return (
+            f"InboundQueue(policy={self.policy},"
+            f" depth={s['depth']}, dropped={s['dropped']})"
+        )
+
+
+class OutboundQueue:
+    """
+    Messages waiting to be written to the server, in two lanes. Messages
+    whose command is in priority (see twichat.const.CONTROL_COMMANDS) are
+    always written before anything in the regular lane.
+    """
+
+    def __init__(self, priority=CONTROL_COMMANDS):
+        self.priority = frozenset(priority)
+        self.control = deque()
+        self.messages = deque()
+        self.closed = False
+        self.max_depth = self.queued = self.sent = 0
+        self._getters = deque()
+        self._taken = None
+
+    def __len__(self):
+        return len(self.control) + len(self.messages)
+
+    def put(self, message):
+        if self.priority and is_priority(message, self.priority):
+            self.control.append(message)
+        else:
+            self.messages.append(message)
+        self.queued += 1
+        if len(self) > self.max_depth:
+            self.max_depth = len(self)
+        _wake(self._getters)
+
+    async def get(self):
+        """
+        Return the next message to write, waiting for one if necessary.
+        Returns None once the queue is closed and empty.
+        """
+        while not self.control and not self.messages:
+            if self.closed:
+                return None
+            await _wait(self._getters)
+        return self.get_nowait()
+
+    def get_nowait(self):
+        """
+        Return the next message to write, or None if there isn't one.
+        """
+        for lane in (self.control, self.messages):
+            if lane:
+                self._taken = lane
+                return lane.popleft()
+        return None
+
+    def ack(self):
+        """
+        Called by the writer once the last message get() returned has been
+        written (see also DurableOutboundQueue).
+        """
+        self._taken = None
+        self.sent += 1
+
+    def confirm(self):
+        """
+        Called by the writer when everything acked so far has actually left
+        the process (the connection's write buffer is empty).
+        """
+
+    def unget(self, message):
+        """
+        Put the last message get() returned back at the front of its lane;
+        the writer does this when the connection went away before it could
+        be written.
+        """
+        lane = self.messages if self._taken is None else self._taken
+        lane.appendleft(message)
+        self._taken = None
+        _wake(self._getters)
+
+    def sync(self):
+        """
+        Called at the end of each session (see DurableOutboundQueue).
+        """
+
+    def reopen(self):
+        """
+        Called at the start of each session.
+        """
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        while self._getters:
+            _wake(self._getters)
+
+    def stats(self):
+        return dict(
+            depth=len(self),
+            control_depth=len(self.control),
+            max_depth=self.max_depth,
+            queued=self.queued,
+            sent=self.sent,
+        )
+
+
+ACK_FORMAT = struct.Struct("<q")
+
+
+class DurableOutboundQueue(OutboundQueue):
+    """
+    An OutboundQueue whose regular lane survives the process (and the
+    connection). Each message put() is appended to the journal at path, a
+    line per message; once the writer has handed a message to the socket,
+    it's acked, and once the connection's write buffer has been emptied
+    (so the message is with the kernel, not just asyncio) it's confirmed:
+    the journal offset just past it is written to the marker file (path +
+    ".ack"). A new queue on the same path, and every reopen() (i.e., every
+    new connection), starts with whatever the journal has past the marker.
+
+        loop = TWILoop(..., outbound=DurableOutboundQueue("announcer.outq"))
+
+    Journal writes are batched: pending lines are written whenever the
+    writer comes back for more (or batch_size of them pile up), and the
+    marker is written every ack_every confirmations or when the queue runs
+    dry. A crash can therefore re-send up to ack_every messages that did
+    get out (and any acked but not yet confirmed); delivery is at least
+    once. With fsync, the journal is fsync()ed on each
+    write (which only matters if the machine, rather than the process, goes
+    down). Once everything is acked and the journal has grown past
+    compact_size, it's truncated.
+
+    The control lane (PONG, CAP, …) isn't journaled; those only make sense
+    on the connection they were meant for.
+    """
+
+    def __init__(
+        self,
+        path,
+        priority=CONTROL_COMMANDS,
+        batch_size=256,
+        ack_every=256,
+        compact_size=1024 * 1024,
+        fsync=False,
+        encoding="utf-8",
+    ):
+        super().__init__(priority=priority)
+        self.path = path
+        self.ack_path = f"{path}.ack"
+        self.batch_size = batch_size
+        self.ack_every = ack_every
+        self.compact_size = compact_size
+        self.fsync = fsync
+        self.encoding = encoding
+        self.replayed = self.journaled = 0
+        # end offsets (in the journal) of the messages in the regular lane
+        self.offsets = deque()
+        self._pending = list()
+        self._inflight = None
+        self._unmarked = self._unconfirmed = 0
+        self._journal = open(path, "a+b")
+        self._ack_fd = os.open(self.ack_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._end = self._untorn(self._journal.fileno(), os.path.getsize(path))
+        data = os.pread(self._ack_fd, ACK_FORMAT.size, 0)
+        self.acked = ACK_FORMAT.unpack(data)[0] if len(data) == ACK_FORMAT.size else 0
+        # the journal may have been truncated after the marker was written
+        self.acked = self._marked = min(max(self.acked, 0), self._end)
+        self._written = self.acked
+        self.replay()
+
+    @staticmethod
+    def _untorn(fd, size, chunk=65536):
+        """
+        If the journal ends in a partial line (the process died mid-write),
+        cut it off, so the next append doesn't get glued onto it. Returns the
+        new size.
+        """
+        end = size
+        while end > 0:
+            start = max(0, end - chunk)
+            data = os.pread(fd, end - start, start)
+            nl = data.rfind(b"\n")
+            if nl >= 0:
+                end = start + nl + 1
+                break
+            end = start
+        if end != size:
+            log.warning("dropping a torn line (%d bytes) from the journal", size - end)
+            os.ftruncate(fd, end)
+        return end
+
+    def put(self, message):
+        if self.priority and is_priority(message, self.priority):
+            super().put(message)
+            return
+        line = str(message).rstrip(WS) + "\n"
+        line = line.encode(self.encoding)
+        self._pending.append(line)
+        self._end += len(line)
+        self.offsets.append(self._end)
+        self.messages.append(message)
+        self.queued += 1
+        if len(self) > self.max_depth:
+            self.max_depth = len(self)
+        _wake(self._getters)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    async def get(self):
+        self.flush()
+        if not self.control and not self.messages:
+            self.mark()
+        return await super().get()
+
+    def get_nowait(self):
+        if self.control:
+            return self.control.popleft()
+        if self.messages:
+            self._inflight = self.offsets.popleft()
+            return self.messages.popleft()
+        return None
+
+    def unget(self, message):
+        if self._inflight is None:
+            self.control.appendleft(message)
+        else:
+            self.offsets.appendleft(self._inflight)
+            self.messages.appendleft(message)
+            self._inflight = None
+        _wake(self._getters)
+
+    def ack(self):
+        self.sent += 1
+        if self._inflight is None:
+            return
+        self._written = self._inflight
+        self._inflight = None
+        self._unconfirmed += 1
+
+    def confirm(self):
+        if not self._unconfirmed:
+            return
+        self.acked = self._written
+        self._unmarked += self._unconfirmed
+        self._unconfirmed = 0
+        if self._unmarked >= self.ack_every:
+            self.mark()
+
+    def flush(self):
+        """
+        Write the pending journal lines.
+        """
+        if not self._pending:
+            return
+        self._journal.write(b"".join(self._pending))
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self.journaled += len(self._pending)
+        self._pending.clear()
+
+    def mark(self):
+        """
+        Write the acked offset to the marker (and compact the journal, if
+        everything in it has been acked).
+        """
+        self._unmarked = 0
+        if (
+            self.acked == self._end
+            and not self._pending
+            and self._end >= self.compact_size
+        ):
+            log.debug("mark() compacting %s (%d bytes)", self.path, self._end)
+            # truncate first: a marker past the end of the journal is clamped
+            # on load, but a zeroed marker on a full journal means re-sending it
+            os.ftruncate(self._journal.fileno(), 0)
+            self.acked = self._written = self._end = 0
+            self._marked = None
+        if self.acked != self._marked:
+            os.pwrite(self._ack_fd, ACK_FORMAT.pack(self.acked), 0)
+            if self.fsync:
+                os.fsync(self._ack_fd)
+            self._marked = self.acked
+
+    def sync(self):
+        self.flush()
+        self.mark()
+
+    def replay(self):
+        """
+        Rebuild the regular lane from the journal: everything past the acked
+        offset, i.e., what was never sent plus what was sent but not acked.
+        """
+        self.flush()
+        self._inflight = None
+        # what was written but never confirmed goes out again
+        self._written = self.acked
+        self._unconfirmed = 0
+        self.messages.clear()
+        self.offsets.clear()
+        with open(self.path, "rb") as fh:
+            fh.seek(self.acked)
+            data = fh.read(self._end - self.acked)
+        end = self.acked
+        for line in data.splitlines(keepends=True):
+            end += len(line)
+            self.messages.append(line.rstrip(b"\r\n").decode(self.encoding))
+            self.offsets.append(end)
+        if self.messages:
+            log.info(
+                "replay() %d unconfirmed messages from %s",
+                len(self.messages),
+                self.path,
+            )
+            self.replayed += len(self.messages)
+            _wake(self._getters)
+
+    def reopen(self):
+        super().reopen()
+        self.replay()
+
+    def release(self):
+        """
+        Write out what's pending and close the files.
+        """
+        self.sync()
+        self._journal.close()
+        os.close(self._ack_fd)
+
+    def stats(self):
+        res = super().stats()
+        res.update(
+            journaled=self.journaled,
+            replayed=self.replayed,
+            unacked=self._end - self.acked,
+        )
+        return res
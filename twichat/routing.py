@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Declarative reply filters and a router that evaluates a whole pile of them
+at once.
+
+Rather than having every handler look at reply.command.name, the channel,
+the sender and run its own regexes over the message text on every single
+line, describe what the handler wants with a Filter:
+
+    class Hello(FilteredHandler):
+        filter = Filter(command="PRIVMSG", channel="#twichat", text=[r"^!hello\\b"])
+
+        def accept(self, reply):
+            return TargetMessage(reply.channel, f"hello {reply.sender}")
+
+and hand the handlers to a Router (which is itself just a ReplyHandler):
+
+    router = Router()
+    router.add(Hello())
+    router.add(SomethingElse())
+    loop.handlers.append(router)
+
+The router indexes its routes by command and channel, so most handlers are
+never even considered for a given line, and all the text patterns are folded
+into combined regexes, so each line's text is scanned once for all of them
+rather than once per handler.
+"""
+
+import re
+import logging
+
+from .handlers import ReplyHandler, HandlerResult
+from .irc.msg import channel_name
+from .irc.reply import ischannel
+from .matcher import combine_patterns, lookahead_patterns
+
+log = logging.getLogger(__name__)
+
+ANY = None
+
+
+def _as_set(thing, normalize):
+    if thing is None:
+        return None
+    if isinstance(thing, str):
+        thing = (thing,)
+    return frozenset(normalize(x) for x in thing)
+
+
+def reply_channel(reply):
+    """
+    The (lowercased) channel a reply is about, or None if it isn't about a
+    channel.
+    """
+    channel = getattr(reply, "channel", None)
+    if channel and ischannel(channel):
+        return channel.lower()
+    if reply.params and ischannel(reply.params[0]):
+        return reply.params[0].lower()
+    return None
+
+
+class Filter:
+    """
+    A declarative description of the replies a handler is interested in.
+    Every given criterion must match; criteria left as None match anything.
+
+        Filter(
+            command="PRIVMSG",            # or a set of commands
+            channel={"#one", "two"},      # channel names get the usual '#' prefixing
+            sender="jettero",             # or a set of nicks
+            tags={"mod": "1"},            # tag values must be equal; True means present
+            text=[r"^!\\w+", "kappa"],    # any of these patterns (re.search) on reply.msg
+        )
+
+    Commands are compared case insensitively, as are channels and senders.
+    """
+
+    def __init__(self, command=ANY, channel=ANY, sender=ANY, tags=ANY, text=ANY):
+        self.commands = _as_set(command, str.upper)
+        self.channels = _as_set(channel, lambda c: channel_name(c).lower())
+        self.senders = _as_set(sender, str.lower)
+        self.tags = dict(tags) if tags else None
+        if isinstance(text, (str, re.Pattern)):
+            text = (text,)
+        self.patterns = tuple(re.compile(p) for p in text) if text else None
+        self.text = combine_patterns(self.patterns) if self.patterns else None
+
+    def match_tags(self, reply):
+        tags = reply.tags or dict()
+        for key, value in self.tags.items():
+            if key not in tags:
+                return False
+            if value is not True and tags[key] != value:
+                return False
+        return True
+
+    def match_text(self, reply):
+        msg = reply.msg
+        if msg is None:
+            return False
+        if self.text is not None:
+            return bool(self.text.search(msg))
+        return any(p.search(msg) for p in self.patterns)
+
+    def match_rest(self, reply, text=True):
+        """
+        Check the criteria that aren't indexed by the Router (sender, tags,
+        and, unless text is False, text).
+        """
+        if self.senders is not None and reply.source.lower() not in self.senders:
+            return False
+        if self.tags is not None and not self.match_tags(reply):
+            return False
+        if text and self.patterns is not None and not self.match_text(reply):
+            return False
+        return True
+
+    def matches(self, reply):
+        if self.commands is not None and reply.command.name not in self.commands:
+            return False
+        if self.channels is not None and reply_channel(reply) not in self.channels:
+            return False
+        return self.match_rest(reply)
+
+    def __repr__(self):
+        items = (
+            ("command", self.commands),
+            ("channel", self.channels),
+            ("sender", self.senders),
+            ("tags", self.tags),
+            ("text", self.patterns and [p.pattern for p in self.patterns]),
+        )
+        i = ", ".join(f"{k}={v}" for k, v in items if v is not None)
+        return f"Filter({i})"
+
+
+class FilteredHandler(ReplyHandler):
+    """
+    A ReplyHandler with a Filter. On its own, it just skips accept() for
+    replies that don't match the filter; but added to a Router, the filter is
+    compiled together with all the other filters in the router.
+
+    Set the filter either as a class attribute or pass one to __init__().
+    """
+
+    filter = None
+
+    def __init__(self, filter=None):  # pylint: disable=redefined-builtin
+        if filter is not None:
+            self.filter = filter
+
+    def __call__(self, reply):
+        if self.filter is None or self.filter.matches(reply):
+            return self.invoke(reply)
+
+    def invoke(self, reply):
+        """
+        Invoke the handler without checking the filter (the Router already
+        did that).
+        """
+        return super().__call__(reply)
+
+
+class Route:
+    def __init__(self, order, flt, handler):
+        self.order = order
+        self.filter = flt
+        self.handler = handler
+        # which of the Router's text patterns are this route's (see
+        # Router.compile())
+        self.text_ids = frozenset()
+        # FilteredHandlers would check their filter again if we just called them
+        self.invoke = getattr(handler, "invoke", handler)
+
+    def __repr__(self):
+        return f"Route({self.order}, {self.filter}, {self.handler})"
+
+
+class Router(ReplyHandler):
+    """
+    Evaluates many handlers' Filters together and invokes only the handlers
+    whose filters match. Routes are considered in the order they were added,
+    so the results behave just as if the matching handlers had been in
+    loop.handlers themselves.
+
+        router = Router()
+        router.add(handler_with_a_filter_attribute)
+        router.add(plain_handler, Filter(command="PRIVMSG", tags={"mod": "1"}))
+        loop.handlers.append(router)
+
+    Handlers that say they're done are removed from the router. A handler
+    that raises is logged and skipped; the other routes still get the reply.
+    """
+
+    def __init__(self):
+        self.routes = list()
+        self._order = 0
+        self._index = None
+        self._candidates = dict()
+        self._any_text = self._which_text = None
+        self._text_groups = ()
+
+    def add(self, handler, flt=None):
+        if flt is None:
+            flt = getattr(handler, "filter", None)
+        if flt is None:
+            flt = Filter()
+        self.routes.append(Route(self._order, flt, handler))
+        self._order += 1
+        self._index = None
+
+    def remove(self, handler):
+        self.routes = [r for r in self.routes if r.handler is not handler]
+        self._index = None
+
+    def __len__(self):
+        return len(self.routes)
+
+    def compile(self):
+        index = dict()
+        for route in self.routes:
+            commands = route.filter.commands or (ANY,)
+            channels = route.filter.channels or (ANY,)
+            for command in commands:
+                by_channel = index.setdefault(command, dict())
+                for channel in channels:
+                    by_channel.setdefault(channel, list()).append(route)
+        self._index = index
+        self._candidates = dict()
+        # each distinct pattern gets an id (its group in _which_text)
+        ids = dict()
+        for route in self.routes:
+            patterns = route.filter.patterns or ()
+            route.text_ids = frozenset(
+                ids.setdefault((p.pattern, p.flags), len(ids)) for p in patterns
+            )
+        patterns = [re.compile(p, flags) for p, flags in ids]
+        self._any_text = combine_patterns(patterns)
+        self._which_text = lookahead_patterns(patterns)
+        if self._any_text is None or self._which_text is None:
+            self._any_text = self._which_text = None
+            self._text_groups = ()
+        else:
+            groups = self._which_text.groupindex
+            self._text_groups = tuple((i, groups[f"_{i}"]) for i in range(len(ids)))
+
+    def text_hits(self, msg):
+        """
+        The ids of the patterns (see compile()) found in msg, or None if the
+        patterns couldn't be combined (and each filter has to search msg
+        itself). The combined alternation skips ahead to each spot where
+        something matches, and the lookaheads tell everything that matches
+        there, so the text is only scanned once.
+        """
+        if self._which_text is None:
+            return None
+        hits = set()
+        if msg is None:
+            return hits
+        pos = 0
+        while len(hits) < len(self._text_groups):
+            m = self._any_text.search(msg, pos)
+            if m is None:
+                break
+            found = self._which_text.match(msg, m.start())
+            hits.update(i for i, group in self._text_groups if found.start(group) >= 0)
+            pos = m.start() + 1
+        return hits
+
+    def candidates(self, command, channel):
+        key = (command, channel)
+        try:
+            return self._candidates[key]
+        except KeyError:
+            pass
+        found = list()
+        for c in {command, ANY}:
+            by_channel = self._index.get(c)
+            if by_channel:
+                for ch in {channel, ANY}:
+                    found.extend(by_channel.get(ch, ()))
+        found = tuple(sorted(found, key=lambda r: r.order))
+        self._candidates[key] = found
+        return found
+
+    def matching(self, reply):
+        """
+        Generate the routes whose filters match the reply.
+        """
+        if self._index is None:
+            self.compile()
+        routes = self.candidates(reply.command.name, reply_channel(reply))
+        if not routes:
+            return
+        hits = unscanned = object()
+        for route in routes:
+            if route.filter.patterns is not None:
+                if hits is unscanned:
+                    hits = self.text_hits(reply.msg)
+                if hits is None:
+                    if not route.filter.match_text(reply):
+                        continue
+                elif not hits or hits.isdisjoint(route.text_ids):
+                    continue
+            if route.filter.match_rest(reply, text=False):
+                yield route
+
+    def __call__(self, reply):
+        send = list()
+        done = list()
+        stop_handles = stop_mainloop = False
+        for route in self.matching(reply):
+            try:
+                res = route.invoke(reply)
+            except Exception as error:  # pylint: disable=broad-except
+                log.error(
+                    "__call__() error handling reply=%s with handler=%s: %s",
+                    reply,
+                    route.handler,
+                    error,
+                )
+                continue
+            if not isinstance(res, HandlerResult):
+                continue
+            if res.send:
+                if isinstance(res.send, (list, tuple)):
+                    send.extend(res.send)
+                else:
+                    send.append(res.send)
+            if res.done:
+                done.append(route.handler)
+            if res.stop_mainloop:
+                stop_mainloop = True
+            if res.stop_handles:
+                stop_handles = True
+                break
+        for handler in done:
+            self.remove(handler)
+        if send or stop_handles or stop_mainloop:
+            return HandlerResult(
+                send=send, stop_handles=stop_handles, stop_mainloop=stop_mainloop
+            )
+
+    def accept(self, reply):
+        """
+        What the matching handlers have to send (calling the Router gives
+        the whole HandlerResult, done and stop flags included).
+        """
+        res = self(reply)
+        return res.send if res is not None else None
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Run many bots in one process and one event loop.
+
+Each TWILoop is just an awaitable with its own tasks and connection, so any
+number of them can share a loop (and the parser, and a ChatHistory or
+DedupCache if you like). The Supervisor starts them, stops them, and
+restarts the ones that fall over (with exponential backoff):
+
+    sup = Supervisor()
+    for nick, token in accounts:
+        bot = TWILoop(nick=nick, passwd=token)
+        bot.handlers.append(PingPong())
+        sup.add(bot)
+    asyncio.run(sup.run(signals=True))
+"""
+
+import time
+import signal
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class Supervisor:
+    """
+    Keeps a set of named TWILoops running.
+
+    A bot whose run() returns (or raises) without having been stop()ed
+    through the supervisor is restarted after min_delay seconds, doubling
+    up to max_delay for each restart in a row. A bot that stayed up for
+    longer than max_delay starts over at min_delay. With restart=False,
+    bots that exit just stay stopped.
+    """
+
+    def __init__(self, restart=True, min_delay=1, max_delay=300):
+        self.restart_bots = restart
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.bots = dict()
+        self.tasks = dict()
+        self.wanted = set()
+        # the bots sleeping before a restart
+        self.delayed = set()
+        self.restarts = dict()
+        self.running = False
+
+    def __len__(self):
+        return len(self.bots)
+
+    def __getitem__(self, name):
+        return self.bots[name]
+
+    def add(self, bot, name=None):
+        """
+        Add a bot under name (default: its nick). If the supervisor is
+        already running, the bot is started right away. Returns the name.
+        """
+        if name is None:
+            name = bot.nick or f"bot{len(self.bots)}"
+        if name in self.bots:
+            raise ValueError(f"there's already a bot named {name}")
+        self.bots[name] = bot
+        self.restarts[name] = 0
+        if self.running:
+            self.start(name)
+        return name
+
+    def remove(self, name):
+        self.stop(name)
+        self.restarts.pop(name, None)
+        return self.bots.pop(name)
+
+    def start(self, name):
+        self.wanted.add(name)
+        task = self.tasks.get(name)
+        if task is None or task.done():
+            self.tasks[name] = asyncio.create_task(
+                self.keep_running(name), name=f"supervisor:{name}"
+            )
+
+    def stop(self, name):
+        """
+        Stop a bot: a running bot is stop()ed (so it gets to send its QUIT and
+        flush), one waiting to be restarted just isn't, and one that's
+        already shutting down is given its shutdown_timeout to finish before
+        it's cancelled.
+        """
+        log.debug("stop() stopping %s", name)
+        self.wanted.discard(name)
+        bot = self.bots[name]
+        task = self.tasks.get(name)
+        if bot.running:
+            bot.stop()
+        elif task is None or task.done():
+            pass
+        elif name in self.delayed:
+            task.cancel()
+        else:
+            task.get_loop().call_later(bot.shutdown_timeout, task.cancel)
+
+    def stop_all(self):
+        for name in self.bots:
+            self.stop(name)
+
+    async def restart(self, name):
+        self.stop(name)
+        task = self.tasks.get(name)
+        if task is not None:
+            await asyncio.wait((task,))
+        self.start(name)
+
+    async def keep_running(self, name):
+        bot = self.bots[name]
+        delay = self.min_delay
+        while name in self.wanted:
+            started = time.monotonic()
+            try:
+                await bot.run()
+            except Exception as e:  # pylint: disable=broad-except
+                log.error("keep_running() %s failed: %s", name, e, exc_info=True)
+            if name not in self.wanted or not self.restart_bots:
+                break
+            if time.monotonic() - started > self.max_delay:
+                delay = self.min_delay
+            self.restarts[name] += 1
+            log.info("keep_running() restarting %s in %ss", name, delay)
+            self.delayed.add(name)
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self.delayed.discard(name)
+            delay = min(delay * 2, self.max_delay)
+        self.wanted.discard(name)
+
+    async def run(self, signals=False):
+        """
+        Start all the bots and wait until they've all stopped. With signals,
+        SIGINT/SIGTERM/SIGQUIT stop all of them.
+        """
+        self.running = True
+        for name in self.bots:
+            self.start(name)
+        loop = asyncio.get_running_loop()
+        signos = (signal.SIGINT, signal.SIGTERM, signal.SIGQUIT) if signals else ()
+        for signo in signos:
+            loop.add_signal_handler(signo, self.stop_all)
+        try:
+            while True:
+                # bots may be added while we wait
+                pending = [t for t in self.tasks.values() if not t.done()]
+                if not pending:
+                    break
+                await asyncio.wait(pending)
+        finally:
+            self.running = False
+            for signo in signos:
+                loop.remove_signal_handler(signo)
+
+    def metrics(self):
+        return {
+            name: dict(
+                running=bot.running, restarts=self.restarts[name], **bot.metrics()
+            )
+            for name, bot in self.bots.items()
+        }
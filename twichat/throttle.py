@@ -3,7 +3,7 @@
 
 import os
 import time
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import dbm
 
 
@@ -110,3 +110,121 @@ class Throttle:
             str(self.ticks).replace("TimeCounts", "Throttle")
             + f" => {c} / {self.limit}"
         )
+
+
+class RateCounter:
+    """
+    Sliding window event counts for lots of keys (e.g., one per chatter).
+
+        rc = RateCounter(interval_in_seconds=30, max_keys=100000)
+        if rc.hit(("#channel", "nick")) > 20:
+            ...  # more than 20 in the last 30 seconds
+
+    Unlike Throttle, there's no per-second history. Each key keeps a count
+    for the current interval and one for the previous interval, and the
+    sliding window count is estimated by weighting the previous one by how
+    much of it still overlaps the window. That makes hit() and count() O(1)
+    and a key costs only a few ints.
+
+    Keys expire lazily: their counts are rolled over when they're touched.
+    The keys are also kept in least recently used order; once there are
+    max_keys of them, the least recently hit key is forgotten. expire()
+    drops every key that hasn't been hit in the last two intervals, and it
+    only has to look at the keys it drops (they're all at the LRU end).
+    """
+
+    def __init__(self, interval_in_seconds, max_keys=100000):
+        self.interval = float(interval_in_seconds)
+        self.max_keys = max_keys
+        self.evicted = 0
+        # key → [bucket number, current count, previous count]
+        self._keys = OrderedDict()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def _bucket(self):
+        t = time.time() / self.interval
+        b = int(t)
+        return b, t - b
+
+    @staticmethod
+    def _roll(entry, bucket):
+        if entry[0] != bucket:
+            if entry[0] == bucket - 1:
+                entry[2] = entry[1]
+            else:
+                entry[2] = 0
+            entry[1] = 0
+            entry[0] = bucket
+
+    @staticmethod
+    def _estimate(entry, bucket, frac):
+        b, cur, prev = entry
+        if b == bucket:
+            return cur + prev * (1 - frac)
+        if b == bucket - 1:
+            return cur * (1 - frac)
+        return 0
+
+    def hit(self, key, n=1):
+        """
+        Count n events for key and return the sliding window count
+        (including these).
+        """
+        bucket, frac = self._bucket()
+        entry = self._keys.get(key)
+        if entry is None:
+            entry = self._keys[key] = [bucket, 0, 0]
+            if len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._roll(entry, bucket)
+            self._keys.move_to_end(key)
+        entry[1] += n
+        return self._estimate(entry, bucket, frac)
+
+    def count(self, key):
+        entry = self._keys.get(key)
+        if entry is None:
+            return 0
+        return self._estimate(entry, *self._bucket())
+
+    def expire(self):
+        """
+        Forget every key that hasn't been hit in the last two intervals.
+        Returns the number of keys forgotten.
+        """
+        bucket, _ = self._bucket()
+        dropped = 0
+        while self._keys:
+            key, entry = next(iter(self._keys.items()))
+            if entry[0] >= bucket - 1:
+                break
+            del self._keys[key]
+            dropped += 1
+        return dropped
+
+    def decay(self, factor=0.5):
+        """
+        Scale every count by factor (e.g., to go easy on everyone once a
+        raid settles down). Keys whose counts drop to zero are forgotten.
+        """
+        todo = list()
+        for key, entry in self._keys.items():
+            entry[1] = int(entry[1] * factor)
+            entry[2] = int(entry[2] * factor)
+            if not entry[1] and not entry[2]:
+                todo.append(key)
+        for key in todo:
+            del self._keys[key]
+        return len(todo)
+
+    def __repr__(self):
+        return (
+            f"RateCounter(interval={self.interval}, keys={len(self)}/{self.max_keys})"
+        )